@@ -1,10 +1,10 @@
 import random
 import math
-
-import pyglet
-from shapely.geometry import LineString, Point
+import operator
+import weakref
 
 from _boidlogic import Priority, sign
+from _boidprofile import timed
 
 DEFAULT_SIZE = 10
 DEFAULT_SPEED = DEFAULT_SIZE/5
@@ -13,28 +13,31 @@ DEFAULT_PALETTE = (180,180,255)
 DEFAULT_BOUNDS = (0,640,0,480)
 DEFAULT_TOLERANCE = 1E-8
 DEFAULT_VISION_ANGLE = 135
+DEFAULT_ANGLE_STEP = None
 
-def _randomise_palette(base):
+def _randomise_palette(base,rng=random):
     '''
     Selects approximately similar colours to given colour
     :param base: (r,g,b) tuple
+    :param rng: random number generator (random.Random or the random module)
     :return: [r,g,b] list of colours
     '''
     new_base = []
     for basecolour in base:
-        interim_base = basecolour + random.randint(-40,40)
+        interim_base = basecolour + rng.randint(-40,40)
         interim_base = 0 if interim_base < 0 else 255 if interim_base > 255 else interim_base
         new_base.append(interim_base)
     return tuple(new_base)
 
-def _random_position(bounds):
+def _random_position(bounds,rng=random):
     '''
     Takes bounds and selects a random x,y coordinate within them
     :param bounds: (x1, x2, y1, y2) tuple of boundaries
+    :param rng: random number generator (random.Random or the random module)
     :return: position [x,y]
     '''
-    x = random.randint(bounds[0],bounds[1])
-    y = random.randint(bounds[2],bounds[3])
+    x = rng.randint(bounds[0],bounds[1])
+    y = rng.randint(bounds[2],bounds[3])
     return [x,y]
 
 
@@ -60,8 +63,9 @@ def get_displacement(boid_1,boid_2):
     :param boid_2: boid 2
     :return: absolute displacement
     '''
-    x = _find_shortest_path(boid_1.position[0],boid_2.position[0],boid_1.bounds[1],boid_1.bounds[0])
-    y = _find_shortest_path(boid_1.position[1],boid_2.position[1],boid_1.bounds[3],boid_1.bounds[2])
+    bounds = boid_1.bounds
+    x = _find_shortest_path(boid_1.position[0],boid_2.position[0],bounds[1],bounds[0])
+    y = _find_shortest_path(boid_1.position[1],boid_2.position[1],bounds[3],bounds[2])
     return distance_between_points((0,0),(x,y))
 
 
@@ -110,20 +114,69 @@ def check_for_collision(boid_1,boid_2):
     boid_2_heading = boid_2.get_heading(False)
     boid_2_heading = (boid_1.position[0] + _find_shortest_path(boid_1.position[0],boid_2_heading[0],boid_1.bounds[1],boid_1.bounds[0]),
                        boid_2.position[1] + _find_shortest_path(boid_1.position[1],boid_2_heading[1],boid_1.bounds[3],boid_1.bounds[2]))
-    l1 = LineString((boid_1_position,boid_1_heading))
-    l2 = LineString((boid_2_position,boid_2_heading))
-    #print(boid_1.position,boid_1.get_heading(),l1,boid_2.position,boid_2.get_heading(),l2)
-    if l1.intersects(l2):
-        # if these intersect, check angle between vectors:
-        # boid_1_angle = (180 * math.atan((boid_1_heading[1]-boid_1_position[1])/(boid_1_heading[0]-boid_1_heading[0]))/math.pi)%360
-        # boid_2_angle = (180 * math.atan((boid_2_heading[1]-boid_2_position[1])/(boid_2_heading[0]-boid_2_heading[0]))/math.pi)%360
-        recommended_orientation_change = -1 if (boid_2.orientation - boid_1.orientation)%180 > 90 else 1
-        recommendation_severity = 1/(Point((boid_1_position)).distance(l1.intersection(l2))+0.0001)
+    return collision_recommendation(boid_1_position,boid_1_heading,boid_2_position,boid_2_heading,
+                                    boid_1.orientation,boid_2.orientation)
+
+
+def collision_recommendation(position_1,heading_1,position_2,heading_2,orientation_1,orientation_2):
+    '''
+    Recommendation for boid 1 given the heading segments check_for_collision compares
+    :param position_1: (x,y) start of boid 1's heading segment
+    :param heading_1: (x,y) end of boid 1's heading segment
+    :param position_2: (x,y) start of boid 2's heading segment, moved next to boid 1 across the boundaries
+    :param heading_2: (x,y) end of boid 2's heading segment, moved next to boid 1 across the boundaries
+    :param orientation_1: boid 1 orientation
+    :param orientation_2: boid 2 orientation
+    :return: recommendation (severity,change_direction), (0,0) if the segments don't meet
+    '''
+    distance = segment_intersection_distance(position_1,heading_1,position_2,heading_2)
+    if distance is not None:
+        recommended_orientation_change = -1 if (orientation_2 - orientation_1)%180 > 90 else 1
+        recommendation_severity = 1/(distance+0.0001)
         return (recommendation_severity,recommended_orientation_change)
     else:
         return (0,0)
 
 
+def segment_intersection_distance(a1,a2,b1,b2):
+    '''
+    Finds where segment a1-a2 meets segment b1-b2 (touching and overlapping count as meeting)
+    :param a1: (x,y) start of segment a
+    :param a2: (x,y) end of segment a
+    :param b1: (x,y) start of segment b
+    :param b2: (x,y) end of segment b
+    :return: distance from a1 to the closest shared point, or None if the segments don't meet
+    '''
+    rx, ry = a2[0] - a1[0], a2[1] - a1[1]
+    sx, sy = b2[0] - b1[0], b2[1] - b1[1]
+    qx, qy = b1[0] - a1[0], b1[1] - a1[1]
+    denominator = rx * sy - ry * sx
+    a_length_squared = rx ** 2 + ry ** 2
+    if denominator != 0:
+        t = (qx * sy - qy * sx) / denominator
+        u = (qx * ry - qy * rx) / denominator
+        if 0 <= t <= 1 and 0 <= u <= 1:
+            return t * a_length_squared ** 0.5
+        return None
+    if a_length_squared == 0:
+        # a is a point: check it lies on b
+        b_length_squared = sx ** 2 + sy ** 2
+        if b_length_squared == 0:
+            return 0 if (qx, qy) == (0, 0) else None
+        u = -(qx * sx + qy * sy) / b_length_squared
+        return 0 if qx * sy - qy * sx == 0 and 0 <= u <= 1 else None
+    if qx * ry - qy * rx != 0:
+        # parallel but not collinear
+        return None
+    # collinear: find the overlap as a fraction along a
+    t0 = (qx * rx + qy * ry) / a_length_squared
+    t1 = t0 + (sx * rx + sy * ry) / a_length_squared
+    lowest, highest = max(0, min(t0,t1)), min(1, max(t0,t1))
+    if lowest <= highest:
+        return lowest * a_length_squared ** 0.5
+    return None
+
+
 def angle_between_vectors(v1, v2):
     '''
     Returns absolute angle between two vectors
@@ -140,7 +193,158 @@ def angle_between_vectors(v1, v2):
     return theta
 
 
+def _cos_vision_angle(vision_angle):
+    '''
+    Cosine of a vision angle in degrees, capped at 180 (every direction is visible beyond that)
+    '''
+    return math.cos(math.pi * min(vision_angle,180) / 180)
+
+
+_trig_tables = {}
+
+def trig_table(angle_step):
+    '''
+    Cosines and sines of every multiple of angle_step in a turn, built once per step
+    :param angle_step: step in degrees, dividing 360 into a whole number of steps
+    :return: (cos,sin) tuples, indexed by orientation / angle_step
+    '''
+    table = _trig_tables.get(angle_step)
+    if table is None:
+        steps = round(360 / angle_step)
+        if steps < 1 or abs(steps * angle_step - 360) > 1E-9:
+            raise ValueError('angle_step must divide 360 degrees, not {}'.format(angle_step))
+        angles = [math.pi * k * angle_step / 180 for k in range(steps)]
+        table = _trig_tables[angle_step] = (tuple(map(math.cos,angles)),tuple(map(math.sin,angles)))
+    return table
+
+
+class Species:
+    __slots__ = ('width','length','speed','bounds','vision_range','tolerance','vision_angle','headless','logic',
+                 'angle_step','offsets','cos_vision_angle','cos_table','sin_table','_templates','_key','__weakref__')
+    PARAMETERS = ('width','length','speed','bounds','vision_range','tolerance','vision_angle','headless','logic',
+                  'angle_step')
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self,width,length,speed,bounds,vision_range,tolerance,vision_angle,headless,logic=None,
+                 angle_step=None):
+        '''
+        Parameters shared by every boid with identical settings, with the values derived from them
+        (offsets, cos_vision_angle, a Priority logic and, with an angle_step, trig tables and vertex
+        templates). Species are immutable and interned, so create them with Species.get and change them
+        with replace.
+        :param logic: logic for the boids to share, Priority(speed) if None
+        :param angle_step: step in degrees boids round their orientation to for trig and drawing, None for exact
+        '''
+        self.width = width
+        self.length = length
+        self.speed = speed
+        self.bounds = bounds
+        self.vision_range = vision_range
+        self.tolerance = tolerance
+        self.vision_angle = vision_angle
+        self.headless = headless
+        self.logic = Priority(speed) if logic is None else logic
+        self.angle_step = angle_step
+        self.offsets = ((length / 2, 0),
+                        (-length / 2, -width / 2),
+                        (-length / 2, width / 2))
+        self.cos_vision_angle = _cos_vision_angle(vision_angle)
+        if angle_step is None:
+            self.cos_table = self.sin_table = self._templates = None
+        else:
+            self.cos_table, self.sin_table = trig_table(angle_step)
+            self._templates = [None] * len(self.cos_table)
+        self._key = (width,length,speed,bounds,vision_range,tolerance,vision_angle,headless,logic,angle_step)
+
+
+    @classmethod
+    def get(cls,**kwargs):
+        '''
+        Finds the species with the given parameters, creating it if no boid uses one yet
+        :return: Species
+        '''
+        kwargs['bounds'] = tuple(kwargs['bounds'])
+        key = tuple(kwargs.get(name) for name in cls.PARAMETERS)
+        species = cls._interned.get(key)
+        if species is None:
+            species = cls(**kwargs)
+            cls._interned[key] = species
+        return species
+
+
+    def parameters(self):
+        '''
+        :return: dict of the parameters the species was created with (logic is None for the default)
+        '''
+        return dict(zip(self.PARAMETERS,self._key))
+
+
+    def vertex_template(self,index):
+        '''
+        Vertex offsets from the position rotated to one step of the trig tables, built on first use
+        :param index: orientation / angle_step, rounded
+        :return: (x1,y1,x2,y2,x3,y3) offsets
+        '''
+        template = self._templates[index]
+        if template is None:
+            cos, sin = self.cos_table[index], self.sin_table[index]
+            template = self._templates[index] = tuple(value for x_offset, y_offset in self.offsets
+                                                      for value in (x_offset * cos - y_offset * sin,
+                                                                    x_offset * sin + y_offset * cos))
+        return template
+
+
+    def vertex_templates(self):
+        '''
+        Every vertex template, one for each step of the trig tables (for drawing boids in bulk)
+        :return: list of (x1,y1,x2,y2,x3,y3) offsets, indexed by orientation / angle_step
+        '''
+        return [self.vertex_template(index) for index in range(len(self._templates))]
+
+
+    def replace(self,**kwargs):
+        '''
+        :return: the species with some parameters changed
+        '''
+        parameters = self.parameters()
+        parameters.update(kwargs)
+        return Species.get(**parameters)
+
+
+def species_from_kwargs(kwargs):
+    '''
+    Finds the species for the parameters in Boid kwargs, filling in defaults
+    :return: Species
+    '''
+    return Species.get(width=kwargs.get('width',kwargs.get('size',DEFAULT_SIZE)),
+                       length=kwargs.get('length',kwargs.get('size',DEFAULT_SIZE*2)),
+                       speed=kwargs.get('speed',DEFAULT_SPEED),
+                       bounds=kwargs.get('bounds',DEFAULT_BOUNDS),
+                       vision_range=kwargs.get('vision_range',DEFAULT_VISION_RANGE),
+                       tolerance=kwargs.get('tolerance',DEFAULT_TOLERANCE),
+                       vision_angle=kwargs.get('vision_angle',DEFAULT_VISION_ANGLE),
+                       headless=kwargs.get('headless',False),
+                       logic=kwargs.get('logic',None),
+                       angle_step=kwargs.get('angle_step',DEFAULT_ANGLE_STEP))
+
+
+def _species_property(name,doc):
+    '''
+    Builds a property reading a parameter from a boid's species; setting it moves the boid to the species
+    with that parameter changed, so a boid only stores what differs from its species by sharing another one
+    '''
+    def setter(self,value):
+        self._species = self._species.replace(**{name:value})
+        self._last_orientation = None
+        self._neighbours_need_updating = True
+
+    return property(operator.attrgetter('_species.' + name),setter,doc=doc)
+
+
 class Boid:
+    __slots__ = ('id','handle','colour','orientation','position','collection','vertex_list','_species','_angle',
+                 '_direction','_angle_index','_last_orientation','_movement_vector','_neighbours','_neighbours_need_updating')
+
     def __init__(self, *args, **kwargs):
         '''
         Boid class. All parameters are passed as kwargs.
@@ -159,46 +363,128 @@ class Boid:
         vision_range: distance at which boid considers other boids
         collection: reference to container BoidCollection
         vision_angle: angle to which Boid can see neighbours
+        headless: boid is never drawn, so pyglet is never imported and no vertex list is allocated
+        logic: logic turning recommendations into a change of orientation (default Priority(speed))
+        rng: random number generator for the random colour, orientation and position (default: the random module)
+        angle_step: step in degrees (dividing 360, e.g. 0.25) to round the orientation to when moving, looking and
+            drawing, so sines, cosines and rotated vertices come from tables shared by the species (default None:
+            exact trigonometry)
+
+        Parameters other than id, colour, orientation, position and collection are kept in a Species shared
+        by every boid with the same settings; changing one on a boid moves it to another species.
         '''
-        self.id = kwargs.get('id',None)
-        self.width = kwargs.get('width',kwargs.get('size',DEFAULT_SIZE))
-        self.length = kwargs.get('length',kwargs.get('size',DEFAULT_SIZE*2))
-        self.colour = kwargs.get('specific_colour',_randomise_palette(kwargs.get('palette',DEFAULT_PALETTE)))
-        self.orientation = kwargs.get('orientation',random.randint(0,359))
-        self.speed = kwargs.get('speed',DEFAULT_SPEED)
-        self.bounds = kwargs.get('bounds',DEFAULT_BOUNDS)
-        self.position = list(kwargs.get('position',_random_position(self.bounds)))
-        self.vision_range = kwargs.get('vision_range',DEFAULT_VISION_RANGE)
-        self.tolerance = kwargs.get('tolerance',DEFAULT_TOLERANCE)
-        self.collection = kwargs.get('collection',None)
-        self.vision_angle = kwargs.get('vision_angle',DEFAULT_VISION_ANGLE)
-
-        self.logic = Priority(self.speed)
+        rng = kwargs.get('rng',random)
+        self.colour = kwargs.get('specific_colour',_randomise_palette(kwargs.get('palette',DEFAULT_PALETTE),rng))
+        self.orientation = kwargs.get('orientation',rng.randint(0,359))
+        species = species_from_kwargs(kwargs)
+        self.position = list(kwargs.get('position',_random_position(species.bounds,rng)))
+        self._init_shared(species,kwargs.get('collection',None),kwargs.get('id',None))
 
+
+    def _init_shared(self,species,collection,id=None):
+        '''
+        Internal function, sets up everything but the colour, orientation and position
+        '''
+        self.id = id
+        self.handle = None
+        self._species = species
+        self.collection = collection
         self._last_orientation = None
-        self._update_offsets()
-        self.colour_info = tuple(self.colour*3)
-        self._create_vertex_list()
+        self.vertex_list = None
         self._new_position()
 
 
+    @classmethod
+    def _from_state(cls,species,colour,orientation,position,collection=None):
+        '''
+        Internal function, builds a boid from values chosen elsewhere without drawing random numbers
+        (used by BoidCollection.spawn)
+        '''
+        boid = cls.__new__(cls)
+        boid.colour = colour
+        boid.orientation = orientation
+        boid.position = position
+        boid._init_shared(species,collection)
+        return boid
+
+
+    width = _species_property('width','width of boid')
+    length = _species_property('length','length of boid')
+    speed = _species_property('speed','pixels-per-tick speed of boid')
+    bounds = _species_property('bounds','area boids can move in')
+    vision_range = _species_property('vision_range','distance at which boid considers other boids')
+    tolerance = _species_property('tolerance','tolerance for being on boundary')
+    vision_angle = _species_property('vision_angle','angle to which Boid can see neighbours')
+    headless = _species_property('headless','boid is never drawn')
+    logic = _species_property('logic','logic turning recommendations into a change of orientation')
+    angle_step = _species_property('angle_step','step orientations are rounded to for trig, None for exact')
+
+
+    @property
+    def species(self):
+        '''
+        Species holding the parameters this boid shares
+        '''
+        return self._species
+
+
+    @property
+    def offsets(self):
+        '''
+        Vertex offsets from the position, for an orientation of 0
+        '''
+        return self._species.offsets
+
+
+    @property
+    def colour_info(self):
+        '''
+        Colour of each of the 3 vertices, for pyglet
+        '''
+        return tuple(self.colour)*3
+
+
     def decide_movement_strategy(self):
         '''
-        Look around boid to decide how to move when tick() called
+        Look around boid to decide how to move when tick() called, turning it straight away
+        (BoidCollection.tick instead lets every boid decide before turning any of them)
         '''
-        self._get_recommendations()
+        self._turn(self._get_recommendations())
+
+
+    def _turn(self,change):
+        '''
+        Internal function, changes orientation by change degrees
+        '''
+        self.orientation += change
+        self.orientation = self.orientation % 360
 
 
     def tick(self):
         '''
         Increments one tick: update movement, perform move, check for boundary cross, update list of vertices for drawing
         '''
+        profiler = self._profiler()
+        timed(profiler,'movement',self._move)
+        timed(profiler,'vertices',self._update_vertex_list)
+        self._new_position()
+
+
+    def _move(self):
+        '''
+        Internal function, moves boid along its movement vector and wraps it at the bounds
+        '''
         self._update_movement_vector()
         self.position[0] += self._movement_vector[0]
         self.position[1] += self._movement_vector[1]
         self._check_boundaries()
-        self._update_vertex_list()
-        self._new_position()
+
+
+    def _profiler(self):
+        '''
+        Internal function, returns the TickProfiler of the boid's collection, if any
+        '''
+        return getattr(self.collection,'profiler',None)
 
 
     def _get_recommendations(self):
@@ -207,14 +493,22 @@ class Boid:
         1. gets recommendation for collision avoidance
         2. gets recommendation for velocity matching
         3. gets recommendation for flock centering
-        then organises the recommendations and metes out suggested changes to boid
-        '''
-        recommendations = [self._get_recommendation_avoidance(),
-                           self._get_recommendation_matching(),
-                           self._get_recommendation_centering()]
-        change = self.logic.from_recommendations(recommendations)
-        self.orientation += change
-        self.orientation = self.orientation % 360
+        (4. gets recommendation for obstacle avoidance, if the collection has obstacles)
+        then organises the recommendations into a change of orientation. Only reads the state of the boid
+        and its neighbours.
+        :return: orientation change
+        '''
+        profiler = self._profiler()
+        if profiler is not None:
+            profiler.count('neighbours',len(self.neighbours))
+            profiler.count('collision_checks',len(self.neighbours))
+        recommendations = [timed(profiler,'avoidance',self._get_recommendation_avoidance),
+                           timed(profiler,'matching',self._get_recommendation_matching),
+                           timed(profiler,'centering',self._get_recommendation_centering)]
+        obstacles = getattr(self.collection,'obstacles',None)
+        if obstacles is not None:
+            recommendations.append(timed(profiler,'obstacles',obstacles.recommendation,self))
+        return timed(profiler,'arbitration',self.logic.from_recommendations,recommendations)
 
 
     def _get_recommendation_avoidance(self):
@@ -275,20 +569,66 @@ class Boid:
         :return: dict of neighbour:distance
         '''
         if self._neighbours_need_updating:
-            displacements = self.collection.get_displacements()[self]
-            self._neighbours = {}
-            for boid, displacement in displacements.items():
-                if displacement < self.vision_range and self._in_vision_angle(boid):
-                    self._neighbours[boid] = displacement
+            profiler = self._profiler()
+            offsets = timed(profiler,'nearby',self.collection._get_nearby_offsets,self)
+            self._neighbours = timed(profiler,'vision',self._visible,offsets)
             self._neighbours_need_updating = False
         return self._neighbours
 
 
+    def _visible(self,offsets):
+        '''
+        Internal function, filters boids to those within vision_range and vision_angle
+        :param offsets: dict of boid:wrapped (dx,dy) from self
+        :return: dict of boid:displacement
+        '''
+        direction = self.direction
+        cos_vision_angle = self.cos_vision_angle
+        vision_range = self.vision_range
+        visible = {}
+        for boid, offset in offsets.items():
+            displacement = distance_between_points((0,0),offset)
+            if displacement < vision_range and self._in_vision_cone(offset,displacement,direction,cos_vision_angle):
+                visible[boid] = displacement
+        return visible
+
+
     def _in_vision_angle(self, boid):
-        boid_relative_position = (self.position[0] + _find_shortest_path(self.position[0], boid.position[0], self.bounds[1],self.bounds[0]),
-                         self.position[1] + _find_shortest_path(self.position[1], boid.position[1], self.bounds[3],self.bounds[2]))
-        theta = self._angle_from_me_to_position(boid_relative_position)
-        return True if abs(theta) <= self.vision_angle else False
+        relative_position = self._relative_position(boid)
+        return self._in_vision_cone(relative_position,distance_between_points((0,0),relative_position),
+                                    self.direction,self.cos_vision_angle)
+
+
+    def _in_vision_cone(self,relative_position,distance,direction,cos_vision_angle):
+        '''
+        Internal function, checks a boid is within vision_angle of the heading by comparing the dot product
+        of the displacement and the unit heading with distance * cos(vision_angle), so no angle is computed
+        :param relative_position: wrapped (dx,dy) from self to the boid
+        :param distance: displacement to the boid
+        :param direction: (cos,sin) of own angle
+        :param cos_vision_angle: cosine of vision_angle
+        '''
+        return relative_position[0] * direction[0] + relative_position[1] * direction[1] >= cos_vision_angle * distance
+
+
+    def _relative_position(self,boid):
+        '''
+        Internal function, wrapped (dx,dy) from self to boid
+        '''
+        bounds = self.bounds
+        return (_find_shortest_path(self.position[0], boid.position[0], bounds[1],bounds[0]),
+                _find_shortest_path(self.position[1], boid.position[1], bounds[3],bounds[2]))
+
+
+    @property
+    def cos_vision_angle(self):
+        '''
+        Cosine of vision_angle (capped at 180 degrees), precomputed by the species
+        '''
+        species = self._species
+        if self.vision_angle == species.vision_angle:
+            return species.cos_vision_angle
+        return _cos_vision_angle(self.vision_angle)
 
 
     def _angle_from_me_to_position(self,position):
@@ -305,26 +645,62 @@ class Boid:
 
     def draw(self):
         '''
-        Draws the Boid
+        Draws the Boid, creating its vertex list on first draw
         '''
+        import pyglet
+        if self.headless:
+            raise RuntimeError('headless boids can not be drawn')
+        if self.vertex_list is None:
+            self._create_vertex_list()
         self.vertex_list.draw(pyglet.gl.GL_TRIANGLES)
 
 
     @property
     def angle(self):
         '''
-        Calculates the angle in radians from the orientation
+        Calculates the angle in radians from the orientation (rounded to angle_step, if set)
         :return: angle in radians
         '''
         if self._last_orientation != self.orientation:
-            self._angle = math.pi * self.orientation / 180
+            self._update_angle()
         return self._angle
 
 
+    @property
+    def direction(self):
+        '''
+        Unit vector of the angle, kept with it until the orientation changes
+        :return: (cos,sin) of angle
+        '''
+        if self._last_orientation != self.orientation:
+            self._update_angle()
+        return self._direction
+
+
+    def _update_angle(self):
+        '''
+        Internal function, recomputes angle and direction from the orientation; with an angle_step they are
+        looked up in the species' trig tables instead
+        '''
+        orientation = self.orientation
+        species = self._species
+        if species.angle_step is None:
+            self._angle = math.pi * orientation / 180
+            self._direction = (math.cos(self._angle), math.sin(self._angle))
+            self._angle_index = None
+        else:
+            index = round(orientation / species.angle_step) % len(species.cos_table)
+            self._angle = math.pi * index * species.angle_step / 180
+            self._direction = (species.cos_table[index], species.sin_table[index])
+            self._angle_index = index
+        self._last_orientation = orientation
+
+
     def _create_vertex_list(self):
         '''
         Internal function, creates list of vertices for pyglet
         '''
+        import pyglet
         self.vertex_list = pyglet.graphics.vertex_list(
             3,
             ('v2f', self.get_vertices()),
@@ -334,18 +710,23 @@ class Boid:
 
     def _update_vertex_list(self):
         '''
-        Internal function, updates vertex list position for pyglet
+        Internal function, updates vertex list position for pyglet (if the boid has been drawn)
         '''
-        self.vertex_list.vertices = self.get_vertices()
+        if self.vertex_list is not None:
+            self.vertex_list.vertices = self.get_vertices()
 
 
-    def _update_offsets(self):
+    def _vertex_template(self):
         '''
-        Internal function, updates offsets tuple using length and width values
+        Internal function, the vertex offsets from the position for the current orientation, from the species'
+        templates
+        :return: (x1,y1,x2,y2,x3,y3) offsets, None without an angle_step
         '''
-        self.offsets = ((self.length / 2, 0),
-                        (-self.length / 2, -self.width / 2),
-                        (-self.length / 2, self.width / 2))
+        if self._last_orientation != self.orientation:
+            self._update_angle()
+        if self._angle_index is None:
+            return None
+        return self._species.vertex_template(self._angle_index)
 
 
     def get_vertices(self):
@@ -353,11 +734,16 @@ class Boid:
         Gets the vertices for use in vertex list
         :return (x1,y1,x2,y2,x3,y3): tuple of vertices
         '''
-        self.vertices = []
+        template = self._vertex_template()
+        x, y = self.position[0], self.position[1]
+        if template is not None:
+            return [x + template[0], y + template[1], x + template[2], y + template[3], x + template[4], y + template[5]]
+        cos, sin = self.direction
+        vertices = []
         for x_offset, y_offset in self.offsets:
-            self.vertices.append(self.position[0] + (x_offset * math.cos(self.angle) - (y_offset * math.sin(self.angle))))
-            self.vertices.append(self.position[1] + (x_offset * math.sin(self.angle) + (y_offset * math.cos(self.angle))))
-        return self.vertices
+            vertices.append(x + (x_offset * cos - (y_offset * sin)))
+            vertices.append(y + (x_offset * sin + (y_offset * cos)))
+        return vertices
 
 
     def _check_boundaries(self):
@@ -371,7 +757,8 @@ class Boid:
         '''
         Internal function to update the movement vector
         '''
-        self._movement_vector = [self.speed * math.cos(self.angle), self.speed * math.sin(self.angle)]
+        cos, sin = self.direction
+        self._movement_vector = [self.speed * cos, self.speed * sin]
 
 
     def _new_position(self):
@@ -383,8 +770,9 @@ class Boid:
         Returns the heading (x_heading,y_heading) based off vision_range
         :return: (x_heading,y_heading)
         '''
-        x_heading = self.position[0] + (self.vision_range * math.cos(self.angle))
-        y_heading = self.position[1] + (self.vision_range * math.sin(self.angle))
+        cos, sin = self.direction
+        x_heading = self.position[0] + (self.vision_range * cos)
+        y_heading = self.position[1] + (self.vision_range * sin)
         heading = (x_heading, y_heading)
         if adjusted:
             heading = adjust_position_for_boundaries(heading,self.bounds,self.tolerance)
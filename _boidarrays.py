@@ -0,0 +1,569 @@
+import collections.abc
+import functools
+import time
+
+import numpy as np
+
+from _boid import Boid
+from _boidbackends import get_backend
+from _boidprofile import timed
+from _boidkernels import get_vertices, cell_list_pairs, pair_displacements, symmetric_pair_displacements
+
+DEFAULT_CAPACITY = 64
+BRUTE_FORCE_LIMIT = 128
+
+FIELDS = (('positions', (2,), np.float64),
+          ('orientations', (), np.float64),
+          ('speeds', (), np.float64),
+          ('vision_ranges', (), np.float64),
+          ('vision_angles', (), np.float64),
+          ('lengths', (), np.float64),
+          ('widths', (), np.float64),
+          ('colours', (3,), np.uint8))
+
+
+class BoidArrays:
+    def __init__(self,capacity=DEFAULT_CAPACITY):
+        '''
+        Structure-of-arrays storage for the state of a flock: one contiguous NumPy array per field,
+        one row per boid. Rows are kept packed, so removing a boid moves the last row into its place.
+        :param capacity: number of rows to preallocate (grows as needed)
+        '''
+        self.n = 0
+        self._data = {name:np.zeros((capacity,) + shape, dtype) for name, shape, dtype in FIELDS}
+
+
+    def __len__(self):
+        return self.n
+
+
+    def __getattr__(self,name):
+        '''
+        Returns the in-use rows of a field, e.g. arrays.positions
+        '''
+        try:
+            return self.__dict__['_data'][name][:self.n]
+        except KeyError:
+            raise AttributeError(name)
+
+
+    @classmethod
+    def from_fields(cls,fields,copy=True):
+        '''
+        Builds BoidArrays holding copies of the given rows
+        :param fields: dict of field name:array, as returned by get_fields
+        :param copy: if False, the given arrays (e.g. memory-mapped ones) become the storage, as long as they have
+            the field's dtype; they are only copied once the arrays grow
+        '''
+        if copy:
+            arrays = cls(capacity=max(DEFAULT_CAPACITY,len(fields['positions'])))
+            arrays.n = len(fields['positions'])
+            for name, array in arrays._data.items():
+                array[:arrays.n] = fields[name]
+            return arrays
+        arrays = cls(capacity=0)
+        arrays.n = len(fields['positions'])
+        arrays._data = {name:np.asarray(fields[name],dtype) for name, shape, dtype in FIELDS}
+        return arrays
+
+
+    def get_fields(self,selection=slice(None)):
+        '''
+        Copies rows out of the arrays
+        :param selection: index, slice or boolean mask of rows
+        :return: dict of field name:array
+        '''
+        return {name:array[:self.n][selection].copy() for name, array in self._data.items()}
+
+
+    @property
+    def capacity(self):
+        return len(self._data['positions'])
+
+
+    def append(self):
+        '''
+        Adds a zeroed row, growing the arrays if full
+        :return: index of new row
+        '''
+        if self.n == self.capacity:
+            self._grow(max(DEFAULT_CAPACITY,2 * self.capacity))
+        index = self.n
+        for array in self._data.values():
+            array[index] = 0
+        self.n += 1
+        return index
+
+
+    def extend(self,fields):
+        '''
+        Appends rows in bulk, growing the arrays once if needed
+        :param fields: dict of field name:array of new rows, missing fields are zeroed
+        :return: range of the new row indices
+        '''
+        number = len(fields['positions'])
+        if self.n + number > self.capacity:
+            self._grow(max(DEFAULT_CAPACITY,2 * self.capacity,self.n + number))
+        start = self.n
+        self.n += number
+        for name, array in self._data.items():
+            array[start:self.n] = fields.get(name,0)
+        return range(start,self.n)
+
+
+    def remove(self,index):
+        '''
+        Removes a row by moving the last row into its place
+        :param index: row to remove
+        :return: index of the row that was moved into index (equal to index if it was the last row)
+        '''
+        last = self.n - 1
+        if index != last:
+            for array in self._data.values():
+                array[index] = array[last]
+        self.n -= 1
+        return last
+
+
+    def _grow(self,capacity):
+        '''
+        Internal function, reallocates every field with room for capacity rows
+        '''
+        for name, array in self._data.items():
+            grown = np.zeros((capacity,) + array.shape[1:], array.dtype)
+            grown[:self.n] = array[:self.n]
+            self._data[name] = grown
+
+
+class NeighbourLists:
+    def __init__(self,indptr,indices,distances,dx,dy,start=0,stop=None):
+        '''
+        Neighbours of every boid in compressed sparse row layout: the neighbours of row i are
+        indices[indptr[i]:indptr[i+1]], in index order, with matching distances and wrapped dx, dy.
+        Lists from take_rows only cover rows start to stop, leaving the others empty.
+        '''
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.dx = dx
+        self.dy = dy
+        self.start = start
+        self.stop = len(indptr) - 1 if stop is None else stop
+
+
+    def take_rows(self,start,stop):
+        '''
+        Neighbour lists of rows start to stop only (other rows get no neighbours), so rules can work on a
+        chunk of the flock
+        :return: NeighbourLists
+        '''
+        first, last = self.indptr[start], self.indptr[stop]
+        entries = slice(first,last)
+        return NeighbourLists(np.clip(self.indptr,first,last) - first,self.indices[entries],
+                              self.distances[entries],self.dx[entries],self.dy[entries],start,stop)
+
+
+    @property
+    def counts(self):
+        return np.diff(self.indptr)
+
+
+    @property
+    def rows(self):
+        '''
+        Row index of every entry in indices
+        '''
+        return np.repeat(np.arange(len(self.indptr) - 1),self.counts)
+
+
+class NeighbourView(collections.abc.Mapping):
+    def __init__(self,views,indices,distances):
+        '''
+        Read-only neighbour:distance mapping over one row of NeighbourLists, in index order,
+        so reading a boid's neighbours doesn't build a dict
+        :param views: boids of the collection, by row
+        :param indices: the row's neighbour indices (sorted)
+        :param distances: the row's neighbour distances
+        '''
+        self._views = views
+        self._indices = indices
+        self._distances = distances
+
+
+    def __len__(self):
+        return len(self._indices)
+
+
+    def __iter__(self):
+        views = self._views
+        return (views[j] for j in self._indices.tolist())
+
+
+    def __getitem__(self,boid):
+        index = getattr(boid,'_index',None)
+        if index is not None and index < len(self._views) and self._views[index] is boid:
+            k = np.searchsorted(self._indices,index)
+            if k < len(self._indices) and self._indices[k] == index:
+                return float(self._distances[k])
+        raise KeyError(boid)
+
+
+def _per_boid(values,n):
+    '''
+    Internal function, broadcasts one value or one value per boid to an array of n
+    '''
+    return np.broadcast_to(np.asarray(values,np.float64),(n,))
+
+
+def find_candidates(arrays,bounds,skin=0,dtype=np.float64,profiler=None,radii=None):
+    '''
+    Builds a Verlet list: the pairs of boids closer than the larger of their vision_ranges plus skin.
+    The list holds every pair of neighbours until some boid has moved more than skin/2.
+    Flocks of up to BRUTE_FORCE_LIMIT boids check every pair, larger ones only check pairs in adjacent
+    cells of a cell list.
+    :param arrays: BoidArrays
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param skin: extra distance beyond vision_range
+    :param dtype: float dtype for displacements
+    :param profiler: optional TickProfiler
+    :param radii: optional radius to use instead of vision_range, one for all boids or one per boid
+    :return: (i,j) arrays of candidate pairs, i < j
+    '''
+    if profiler is not None:
+        start = time.perf_counter()
+    n = len(arrays)
+    positions = arrays.positions
+    vision_ranges = arrays.vision_ranges if radii is None else _per_boid(radii,n)
+    if n <= BRUTE_FORCE_LIMIT:
+        i, j = np.triu_indices(n,1)
+    else:
+        i, j = cell_list_pairs(positions,bounds,vision_ranges.max() + skin)
+        upper = i < j
+        i, j = i[upper], j[upper]
+    distances = pair_displacements(positions,bounds,i,j,dtype)[2]
+    keep = distances < np.maximum(vision_ranges[i],vision_ranges[j]) + skin
+    i, j = i[keep], j[keep]
+    if profiler is not None:
+        profiler.count('candidate_pairs',len(i))
+        profiler.count('candidate_rebuilds')
+        profiler.add_time('candidates',time.perf_counter() - start)
+    return i, j
+
+
+def find_neighbours(arrays,bounds,dtype=np.float64,profiler=None,candidates=None,radii=None,cones=None):
+    '''
+    Finds the neighbours of every boid, as Boid.neighbours does: other boids closer than vision_range
+    and within vision_angle of the heading. The cone test compares the dot product of each displacement
+    and the unit heading with distance * cos(vision_angle), so no angles are computed.
+    :param arrays: BoidArrays
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param dtype: float dtype for displacements
+    :param profiler: optional TickProfiler
+    :param candidates: optional (i,j) pairs from find_candidates to check (covering radii), built afresh if None
+    :param radii: optional radius to use instead of vision_range, one for all boids or one per boid
+    :param cones: optional angle in degrees to use instead of vision_angle, one for all boids or one per boid
+    :return: NeighbourLists
+    '''
+    n = len(arrays)
+    if n < 2:
+        empty = np.zeros(0)
+        return NeighbourLists(np.zeros(n + 1,np.int64),np.zeros(0,np.int64),empty,empty,empty)
+    if candidates is None:
+        candidates = find_candidates(arrays,bounds,0,dtype,profiler,radii)
+    if profiler is not None:
+        start = time.perf_counter()
+    positions = arrays.positions
+    vision_ranges = arrays.vision_ranges if radii is None else _per_boid(radii,n)
+    vision_angles = arrays.vision_angles if cones is None else _per_boid(cones,n)
+    cos_vision_angles = np.cos(np.pi * np.minimum(vision_angles,180) / 180)
+    i, j, dx, dy, distances = symmetric_pair_displacements(positions,bounds,candidates[0],candidates[1],dtype)
+    keep = distances < vision_ranges[i]
+    i, j, dx, dy, distances = i[keep], j[keep], dx[keep], dy[keep], distances[keep]
+
+    angles = np.pi * arrays.orientations[i] / 180
+    keep = dx * np.cos(angles) + dy * np.sin(angles) >= cos_vision_angles[i] * distances
+    i, j, dx, dy, distances = i[keep], j[keep], dx[keep], dy[keep], distances[keep]
+
+    order = np.lexsort((j,i))
+    indptr = np.zeros(n + 1,np.int64)
+    np.cumsum(np.bincount(i,minlength=n),out=indptr[1:])
+    if profiler is not None:
+        profiler.count('neighbours',len(i))
+        profiler.count('neighbour_rebuilds')
+        profiler.add_time('vision',time.perf_counter() - start)
+    return NeighbourLists(indptr,j[order],distances[order],dx[order],dy[order])
+
+
+def recommendations_matching(arrays,neighbours,bounds=None):
+    '''
+    Vectorised Boid._get_recommendation_matching
+    :return: (severity,change) arrays
+    '''
+    counts = neighbours.counts
+    change = np.zeros(len(arrays))
+    seen = counts > 0
+    last = neighbours.indices[neighbours.indptr[1:][seen] - 1]
+    delta_orientation = arrays.orientations[last] - arrays.orientations[seen]
+    delta_orientation = np.where(delta_orientation <= 180, delta_orientation, delta_orientation - 360)
+    change[seen] = delta_orientation / counts[seen]
+    return np.abs(change), change
+
+
+def recommendations_centering(arrays,neighbours,bounds=None,kernels=None):
+    '''
+    Vectorised Boid._get_recommendation_centering
+    :param kernels: kernel backend name or KernelBackend (default None: NumPy)
+    :return: (severity,change) arrays
+    '''
+    kernels = get_backend(kernels)
+    n = len(arrays)
+    counts = neighbours.counts
+    rows = neighbours.rows
+    average_x = np.bincount(rows,weights=neighbours.dx,minlength=n) / (counts + 1)
+    average_y = np.bincount(rows,weights=neighbours.dy,minlength=n) / (counts + 1)
+    orientation_position = np.where(average_y >= 0, 1, -1) * kernels.angles_between_vectors(1.0, 0.0, average_x, average_y)
+    seen = counts > 0
+    severity = np.where(seen, kernels.distances_between_points(0.0, 0.0, average_x, average_y) * 10, 0)
+    change = np.where(seen, orientation_position - arrays.orientations, 0)
+    return severity, change
+
+
+def recommendations_avoidance(arrays,neighbours,bounds,kernels=None):
+    '''
+    Vectorised Boid._get_recommendation_avoidance: checks every neighbour pair for a collision at once,
+    then each boid takes the first neighbour (in index order) recommending a +1 turn, as the scalar loop does
+    :param kernels: kernel backend name or KernelBackend (default None: NumPy)
+    :return: (severity,change) arrays
+    '''
+    kernels = get_backend(kernels)
+    n = len(arrays)
+    rows = neighbours.rows
+    others = neighbours.indices
+    positions = arrays.positions
+    orientations = arrays.orientations
+    angles = np.pi * orientations / 180
+    headings = np.stack((positions[:,0] + (arrays.vision_ranges * np.cos(angles)),
+                         positions[:,1] + (arrays.vision_ranges * np.sin(angles))),axis=1)
+    positions_1 = positions[rows]
+    # boid 2's segment is moved next to boid 1 across the boundaries, mirroring check_for_collision
+    positions_2 = np.stack((positions_1[:,0] + neighbours.dx, positions[others,1] + neighbours.dy),axis=1)
+    headings_2 = np.stack((positions_1[:,0] + kernels.find_shortest_paths(positions_1[:,0],headings[others,0],bounds[1],bounds[0]),
+                           positions[others,1] + kernels.find_shortest_paths(positions_1[:,1],headings[others,1],bounds[3],bounds[2])),
+                          axis=1)
+    pair_severity, pair_change = kernels.collision_recommendations(positions_1,headings[rows],positions_2,headings_2,
+                                                                   orientations[rows],orientations[others])
+    turning = np.flatnonzero(pair_change == 1)
+    turning_rows, first = np.unique(rows[turning],return_index=True)
+    severity = np.zeros(n)
+    change = np.zeros(n)
+    severity[turning_rows] = pair_severity[turning[first]]
+    change[turning_rows] = 1
+    return severity, change
+
+
+DEFAULT_RULES = (('avoidance',recommendations_avoidance),
+                 ('matching',recommendations_matching),
+                 ('centering',recommendations_centering))
+
+
+def default_rules(kernels=None):
+    '''
+    DEFAULT_RULES computed with a kernel backend
+    :param kernels: kernel backend name or KernelBackend (default None: NumPy, giving DEFAULT_RULES itself)
+    :return: sequence of (name,function) rules
+    '''
+    kernels = get_backend(kernels)
+    if kernels is get_backend():
+        return DEFAULT_RULES
+    return (('avoidance',functools.partial(recommendations_avoidance,kernels=kernels)),
+            ('matching',recommendations_matching),
+            ('centering',functools.partial(recommendations_centering,kernels=kernels)))
+
+
+def recommendations(arrays,neighbours,bounds,profiler=None,rules=None,executor=None,chunks=1):
+    '''
+    Recommendations of every rule for every boid. Rules only read the flock, and each boid's
+    recommendations only depend on its own row of neighbours, so the flock can be split into chunks of
+    rows handled in parallel; NumPy releases the GIL in its kernels, so threads run them side by side.
+    :param profiler: optional TickProfiler (chunked runs are timed as one 'recommendations' phase)
+    :param rules: sequence of (name,function) rules, each function taking (arrays,neighbours,bounds) and
+        returning (severity,change) arrays; DEFAULT_RULES (avoidance, matching, centering) if None. Rules
+        given a chunk (neighbours.take_rows) only need to fill in rows neighbours.start to neighbours.stop.
+    :param executor: optional concurrent.futures executor to run chunks on
+    :param chunks: number of chunks of rows to split the flock into when executor is given
+    :return: (severity,change) arrays shaped (n_boids,n_rules)
+    '''
+    if profiler is not None:
+        profiler.count('collision_checks',len(neighbours.indices))
+    rules = rules or DEFAULT_RULES
+    n = len(arrays)
+    if executor is None or chunks <= 1 or n < 2 * chunks:
+        results = [timed(profiler,name,rule,arrays,neighbours,bounds) for name, rule in rules]
+        return np.stack([severity for severity, change in results],axis=1), np.stack([change for severity, change in results],axis=1)
+    start = time.perf_counter()
+    edges = np.linspace(0,n,chunks + 1).astype(np.intp).tolist()
+    futures = [executor.submit(_chunk_recommendations,arrays,neighbours.take_rows(start,stop),bounds,rules)
+               for start, stop in zip(edges[:-1],edges[1:])]
+    parts = [future.result() for future in futures]
+    severity = np.concatenate([part[0] for part in parts])
+    change = np.concatenate([part[1] for part in parts])
+    if profiler is not None:
+        profiler.add_time('recommendations',time.perf_counter() - start)
+    return severity, change
+
+
+def _chunk_recommendations(arrays,neighbours,bounds,rules):
+    '''
+    Internal function, recommendations of every rule for the rows neighbours covers
+    :return: (severity,change) arrays shaped (rows,n_rules)
+    '''
+    rows = slice(neighbours.start,neighbours.stop)
+    results = [rule(arrays,neighbours,bounds) for name, rule in rules]
+    return np.stack([severity[rows] for severity, change in results],axis=1), np.stack([change[rows] for severity, change in results],axis=1)
+
+
+def arbitrate(logics,severity,change):
+    '''
+    Turns each boid's recommendations into an orientation change with its logic (e.g. Priority), passing
+    all boids with the same class of logic to its from_recommendation_arrays at once
+    :param logics: one logic per row of severity and change
+    :param severity: (n_boids,n_rules) array
+    :param change: (n_boids,n_rules) array
+    :return: array of orientation changes
+    '''
+    classes = [type(logic) for logic in logics]
+    if len(set(classes)) == 1:
+        return np.asarray(classes[0].from_recommendation_arrays(logics,severity,change),np.float64)
+    changes = np.zeros(len(logics))
+    for cls in set(classes):
+        rows = np.array([k for k, logic_class in enumerate(classes) if logic_class is cls])
+        changes[rows] = cls.from_recommendation_arrays([logics[k] for k in rows.tolist()],severity[rows],change[rows])
+    return changes
+
+
+def apply_changes(arrays,changes,bounds,tolerance,kernels=None):
+    '''
+    Turns every boid by its orientation change, then moves the flock
+    '''
+    orientations = arrays.orientations
+    orientations += changes
+    orientations %= 360
+    move(arrays,bounds,tolerance,kernels)
+
+
+def move(arrays,bounds,tolerance,kernels=None):
+    '''
+    Vectorised Boid.tick movement: steps every boid along its orientation and wraps at the bounds
+    :param kernels: kernel backend name or KernelBackend (default None: NumPy)
+    '''
+    angles = np.pi * arrays.orientations / 180
+    positions = arrays.positions
+    positions[:,0] += arrays.speeds * np.cos(angles)
+    positions[:,1] += arrays.speeds * np.sin(angles)
+    get_backend(kernels).adjust_positions_for_boundaries(positions,bounds,tolerance)
+
+
+def vertices(arrays):
+    '''
+    Vertices of every boid for drawing
+    :return: (n,6) array of (x1,y1,x2,y2,x3,y3)
+    '''
+    return get_vertices(arrays.positions,np.pi * arrays.orientations / 180,arrays.lengths,arrays.widths)
+
+
+# species parameters that array-backed boids keep in their row instead, so kernels can read them
+ROW_PARAMETERS = (('speeds','speed'),
+                  ('vision_ranges','vision_range'),
+                  ('vision_angles','vision_angle'),
+                  ('lengths','length'),
+                  ('widths','width'))
+
+
+def _row_property(field,doc,convert=float,changes_neighbours=False):
+    '''
+    Builds a property reading and writing one row of a BoidArrays field
+    :param changes_neighbours: writing it changes who the boid sees, so the collection's neighbour lists are
+        dropped
+    '''
+    def getter(self):
+        return convert(self._arrays._data[field][self._index])
+
+    def setter(self,value):
+        self._arrays._data[field][self._index] = value
+        if changes_neighbours and self.collection is not None:
+            self.collection.neighbour_lists = None
+
+    return property(getter,setter,doc=doc)
+
+
+class ArrayBoid(Boid):
+    __slots__ = ('_arrays','_index')
+
+    def __init__(self,arrays,*args,**kwargs):
+        '''
+        Boid whose state lives in one row of a BoidArrays; takes the same kwargs as Boid.
+        Array-backed boids never create vertex lists: the collection draws them in bulk.
+        :param arrays: BoidArrays to append a row to
+        '''
+        self._arrays = arrays
+        self._index = arrays.append()
+        super().__init__(*args,**kwargs)
+        for field, name in ROW_PARAMETERS:
+            arrays._data[field][self._index] = getattr(self._species,name)
+
+
+    @classmethod
+    def _view(cls,arrays,index,species,collection=None):
+        '''
+        Internal function, builds a boid for a row already filled in (used by BoidCollection.spawn)
+        '''
+        boid = cls.__new__(cls)
+        boid._arrays = arrays
+        boid._index = index
+        boid._init_shared(species,collection)
+        return boid
+
+
+    @property
+    def position(self):
+        '''
+        (x,y) view of this boid's row, so in-place updates write through to the arrays
+        '''
+        return self._arrays._data['positions'][self._index]
+
+
+    @position.setter
+    def position(self,value):
+        self._arrays._data['positions'][self._index] = value
+
+
+    orientation = _row_property('orientations','angle (0-360) boid is travelling in')
+    speed = _row_property('speeds','pixels-per-tick speed of boid')
+    vision_range = _row_property('vision_ranges','distance at which boid considers other boids',
+                                 changes_neighbours=True)
+    vision_angle = _row_property('vision_angles','angle to which Boid can see neighbours',changes_neighbours=True)
+    length = _row_property('lengths','length of boid')
+    width = _row_property('widths','width of boid')
+    colour = _row_property('colours','(r,g,b) colour of boid',lambda c: tuple(c.tolist()))
+
+
+    @property
+    def neighbours(self):
+        '''
+        Neighbours from the collection's NeighbourLists
+        :return: NeighbourView mapping neighbour:distance, in index order
+        '''
+        neighbours = self.collection.get_neighbour_lists()
+        start, end = neighbours.indptr[self._index], neighbours.indptr[self._index + 1]
+        return NeighbourView(self.collection.views,neighbours.indices[start:end],neighbours.distances[start:end])
+
+
+    def draw(self):
+        '''
+        Draws the Boid
+        '''
+        import pyglet
+        if self.headless:
+            raise RuntimeError('headless boids can not be drawn')
+        pyglet.graphics.draw(3,pyglet.gl.GL_TRIANGLES,('v2f',self.get_vertices()),('c3B',self.colour_info))
+
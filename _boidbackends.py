@@ -0,0 +1,249 @@
+import math
+
+import numpy as np
+
+import _boidkernels
+from _boid import _find_shortest_path, distance_between_points, angle_between_vectors, \
+    adjust_position_for_boundaries, collision_recommendation
+
+# the kernel interface every backend implements, with the signatures of the functions in _boidkernels
+KERNELS = ('find_shortest_paths','distances_between_points','angles_between_vectors',
+           'adjust_positions_for_boundaries','collision_recommendations')
+# backends 'auto' chooses from, fastest first
+PREFERENCE = ('numba','numpy','python')
+DEFAULT_BACKEND = 'numpy'
+
+_factories = {}
+_backends = {}
+
+
+class KernelBackend:
+    def __init__(self,name,kernels):
+        '''
+        One implementation of every kernel in KERNELS, e.g. backend.find_shortest_paths(...)
+        :param name: name the backend is registered under
+        :param kernels: dict of kernel name:function
+        '''
+        missing = [kernel for kernel in KERNELS if kernel not in kernels]
+        if missing:
+            raise ValueError('backend {} lacks {}'.format(name,', '.join(missing)))
+        self.name = name
+        for kernel in KERNELS:
+            setattr(self,kernel,kernels[kernel])
+
+
+    def __repr__(self):
+        return 'KernelBackend({!r})'.format(self.name)
+
+
+    def __reduce__(self):
+        # backends are pickled by name (e.g. in the rules sent to shard workers) and found again there
+        return get_backend, (self.name,)
+
+
+def register_backend(name,factory):
+    '''
+    Registers a backend
+    :param name: backend name
+    :param factory: function returning a dict of kernel name:function, raising ImportError if the backend
+        can't be used on this machine. It is called once, when the backend is first used.
+    '''
+    _factories[name] = factory
+    _backends.pop(name,None)
+
+
+def available_backends():
+    '''
+    :return: names of the registered backends that can be used here, in PREFERENCE order then the rest
+    '''
+    names = []
+    for name in sorted(_factories,key=lambda name: (PREFERENCE.index(name) if name in PREFERENCE else len(PREFERENCE),
+                                                     name)):
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_backend(name=None):
+    '''
+    Finds a kernel backend
+    :param name: registered name, 'auto' for the first available in PREFERENCE, a KernelBackend (returned
+        as it is) or None for DEFAULT_BACKEND
+    :return: KernelBackend
+    '''
+    if isinstance(name,KernelBackend):
+        return name
+    if name is None:
+        name = DEFAULT_BACKEND
+    if name == 'auto':
+        return get_backend(available_backends()[0])
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in _factories:
+            raise ValueError('unknown kernel backend {!r}'.format(name))
+        backend = _backends[name] = KernelBackend(name,_factories[name]())
+    return backend
+
+
+def _numpy_kernels():
+    '''
+    The vectorised NumPy kernels of _boidkernels
+    '''
+    return {kernel:getattr(_boidkernels,kernel) for kernel in KERNELS}
+
+
+def _elementwise(function):
+    '''
+    Internal function, applies a scalar function to every element of broadcast array arguments
+    '''
+    def kernel(*args):
+        args = np.broadcast_arrays(*args)
+        values = [function(*values) for values in zip(*(arg.ravel().tolist() for arg in args))]
+        return np.array(values,np.float64).reshape(args[0].shape)
+    return kernel
+
+
+def _python_kernels():
+    '''
+    Reference kernels calling the scalar helpers of _boid (the ones scalar boids use) element by element
+    '''
+    def find_shortest_paths(n1,n2,n_max,n_min=0):
+        return _elementwise(_find_shortest_path)(n1,n2,n_max,n_min)
+
+    def distances_between_points(x1,y1,x2,y2):
+        return _elementwise(lambda x1,y1,x2,y2: distance_between_points((x1,y1),(x2,y2)))(x1,y1,x2,y2)
+
+    def angles_between_vectors(x1,y1,x2,y2):
+        return _elementwise(lambda x1,y1,x2,y2: angle_between_vectors((x1,y1),(x2,y2)))(x1,y1,x2,y2)
+
+    def adjust_positions_for_boundaries(positions,bounds,tolerance):
+        positions[:] = [adjust_position_for_boundaries(position,bounds,tolerance) for position in positions.tolist()]
+
+    def collision_recommendations(positions_1,headings_1,positions_2,headings_2,orientations_1,orientations_2):
+        recommendations = [collision_recommendation(*pair) for pair in zip(
+            map(tuple,positions_1.tolist()),map(tuple,headings_1.tolist()),map(tuple,positions_2.tolist()),
+            map(tuple,headings_2.tolist()),np.asarray(orientations_1).tolist(),np.asarray(orientations_2).tolist())]
+        severity, change = np.array(recommendations,np.float64).reshape(-1,2).T
+        return severity, change
+
+    return {'find_shortest_paths':find_shortest_paths,
+            'distances_between_points':distances_between_points,
+            'angles_between_vectors':angles_between_vectors,
+            'adjust_positions_for_boundaries':adjust_positions_for_boundaries,
+            'collision_recommendations':collision_recommendations}
+
+
+def loop_kernels(vectorize,jit):
+    '''
+    Kernels written as scalar functions and explicit loops for a JIT compiler, compiled with the given
+    decorators. Nothing here calls NumPy on whole arrays, so the loops run as compiled code.
+    :param vectorize: decorator turning a scalar function into a broadcasting ufunc (e.g. numba.vectorize)
+    :param jit: decorator compiling a function of arrays (e.g. numba.njit)
+    :return: dict of kernel name:function
+    '''
+    @vectorize
+    def shortest_path(n1,n2,n_max,n_min):
+        width = n_max - n_min
+        dn = n2 - n1
+        return dn - width * np.rint(dn / width)
+
+    @vectorize
+    def distance(x1,y1,x2,y2):
+        return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+    @vectorize
+    def angle(x1,y1,x2,y2):
+        numerator = x2 * x1 + y2 * y1
+        denominator = math.sqrt(x2 ** 2 + y2 ** 2) * math.sqrt(x1 ** 2 + y1 ** 2)
+        if denominator == 0:
+            opp_over_adj = 1.0 if numerator >= 0 else -1.0
+        else:
+            opp_over_adj = min(1.0,max(-1.0,numerator / denominator))
+        return math.acos(opp_over_adj) * 180 / math.pi
+
+    @jit
+    def adjust(positions,xmin,xmax,ymin,ymax,tolerance):
+        for k in range(positions.shape[0]):
+            if positions[k,0] < xmin - tolerance:
+                positions[k,0] += xmax
+            elif positions[k,0] > xmax + tolerance:
+                positions[k,0] -= xmax
+            if positions[k,1] < ymin - tolerance:
+                positions[k,1] += ymax
+            elif positions[k,1] > ymax + tolerance:
+                positions[k,1] -= ymax
+
+    @jit
+    def segment_distance(ax1,ay1,ax2,ay2,bx1,by1,bx2,by2):
+        # segment_intersection_distance, NaN where the segments don't meet
+        rx, ry = ax2 - ax1, ay2 - ay1
+        sx, sy = bx2 - bx1, by2 - by1
+        qx, qy = bx1 - ax1, by1 - ay1
+        denominator = rx * sy - ry * sx
+        a_length_squared = rx ** 2 + ry ** 2
+        if denominator != 0:
+            t = (qx * sy - qy * sx) / denominator
+            u = (qx * ry - qy * rx) / denominator
+            if 0 <= t <= 1 and 0 <= u <= 1:
+                return t * math.sqrt(a_length_squared)
+            return math.nan
+        if a_length_squared == 0:
+            b_length_squared = sx ** 2 + sy ** 2
+            if b_length_squared == 0:
+                return 0.0 if qx == 0 and qy == 0 else math.nan
+            u = -(qx * sx + qy * sy) / b_length_squared
+            return 0.0 if qx * sy - qy * sx == 0 and 0 <= u <= 1 else math.nan
+        if qx * ry - qy * rx != 0:
+            return math.nan
+        t0 = (qx * rx + qy * ry) / a_length_squared
+        t1 = t0 + (sx * rx + sy * ry) / a_length_squared
+        lowest, highest = max(0.0,min(t0,t1)), min(1.0,max(t0,t1))
+        if lowest <= highest:
+            return lowest * math.sqrt(a_length_squared)
+        return math.nan
+
+    @jit
+    def collisions(positions_1,headings_1,positions_2,headings_2,orientations_1,orientations_2,severity,change):
+        for k in range(positions_1.shape[0]):
+            distance = segment_distance(positions_1[k,0],positions_1[k,1],headings_1[k,0],headings_1[k,1],
+                                        positions_2[k,0],positions_2[k,1],headings_2[k,0],headings_2[k,1])
+            if not math.isnan(distance):
+                severity[k] = 1 / (distance + 0.0001)
+                change[k] = -1.0 if (orientations_2[k] - orientations_1[k]) % 180 > 90 else 1.0
+
+    def find_shortest_paths(n1,n2,n_max,n_min=0):
+        return shortest_path(n1,n2,n_max,n_min)
+
+    def adjust_positions_for_boundaries(positions,bounds,tolerance):
+        adjust(positions,float(bounds[0]),float(bounds[1]),float(bounds[2]),float(bounds[3]),float(tolerance))
+
+    def collision_recommendations(positions_1,headings_1,positions_2,headings_2,orientations_1,orientations_2):
+        severity = np.zeros(len(positions_1))
+        change = np.zeros(len(positions_1))
+        collisions(np.ascontiguousarray(positions_1,np.float64),np.ascontiguousarray(headings_1,np.float64),
+                   np.ascontiguousarray(positions_2,np.float64),np.ascontiguousarray(headings_2,np.float64),
+                   np.ascontiguousarray(orientations_1,np.float64),np.ascontiguousarray(orientations_2,np.float64),
+                   severity,change)
+        return severity, change
+
+    return {'find_shortest_paths':find_shortest_paths,
+            'distances_between_points':distance,
+            'angles_between_vectors':angle,
+            'adjust_positions_for_boundaries':adjust_positions_for_boundaries,
+            'collision_recommendations':collision_recommendations}
+
+
+def _numba_kernels():
+    '''
+    loop_kernels compiled by numba (an optional dependency), cached on disk between runs
+    '''
+    import numba
+    return loop_kernels(numba.vectorize(cache=True),numba.njit(cache=True))
+
+
+register_backend('python',_python_kernels)
+register_backend('numpy',_numpy_kernels)
+register_backend('numba',_numba_kernels)
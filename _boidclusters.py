@@ -0,0 +1,186 @@
+import numpy as np
+
+from _boidkernels import find_shortest_paths
+
+
+def connect(n,rows,columns):
+    '''
+    Union-find over an edge list, vectorised: each round hooks the larger root of every edge whose ends
+    have different roots onto the smaller one, then compresses paths by pointer jumping until every
+    boid points straight at its root. Roots only ever move to smaller indices, so no cycles can form.
+    :param n: number of boids
+    :param rows: array of edge starts
+    :param columns: array of edge ends
+    :return: array giving each boid's root, the smallest index in its component
+    '''
+    parent = np.arange(n)
+    while True:
+        root_1, root_2 = parent[rows], parent[columns]
+        apart = root_1 != root_2
+        if not apart.any():
+            return parent
+        rows, columns = rows[apart], columns[apart]
+        root_1, root_2 = root_1[apart], root_2[apart]
+        np.minimum.at(parent,np.maximum(root_1,root_2),np.minimum(root_1,root_2))
+        # only boids below a hooked root need to jump
+        moved = np.flatnonzero(parent[parent] != parent)
+        while len(moved):
+            parent[moved] = parent[parent[moved]]
+            moved = moved[parent[parent[moved]] != parent[moved]]
+
+
+def edges_from_boids(boids):
+    '''
+    The neighbour graph of scalar boids, from the neighbours they found while deciding this tick
+    :param boids: list of boids, giving the row of each
+    :return: (rows,columns) arrays of edges, one for each boid seeing another
+    '''
+    row_of = {boid:row for row, boid in enumerate(boids)}
+    rows = []
+    columns = []
+    for row, boid in enumerate(boids):
+        neighbours = boid.neighbours
+        rows.extend([row] * len(neighbours))
+        columns.extend(row_of[neighbour] for neighbour in neighbours)
+    return np.array(rows,np.int64), np.array(columns,np.int64)
+
+
+class ClusterTracker:
+    def __init__(self):
+        '''
+        Tracks the distinct flocks of a BoidCollection: the connected components of the graph of boids
+        seeing each other (either way round). Attach it with BoidCollection(clusters=ClusterTracker());
+        every tick then hands it the neighbour relations the tick already found, so no extra neighbour
+        search is made.
+
+        Components are found afresh each tick by a vectorised union-find over the tick's edges: as boids
+        turn, about a quarter of the edges change every tick, so finding which components an edge loss
+        might have split costs more than it saves. What is kept between ticks is each cluster's identity:
+        a cluster takes the id its root (its boid in the lowest row) had, so clusters that merge keep one
+        of their ids and, when a cluster splits, its largest part keeps the id and the others get new ones.
+        Adding or removing boids starts the tracking afresh.
+
+        After a tick: handles and ids give each boid's cluster; cluster_ids, sizes and centroids describe
+        each cluster, in the order of their roots.
+        '''
+        self.handles = np.zeros(0,np.int64)
+        self.ids = np.zeros(0,np.int64)
+        self.cluster_ids = np.zeros(0,np.int64)
+        self.sizes = np.zeros(0,np.int64)
+        self._centroids = np.zeros((0,2))
+        self.updates = 0
+        self.resets = 0
+        self._parent = None
+        self._population = None
+        self._next_id = 0
+        self._roots = None
+        self._component = None
+        self._positions = None
+        self._bounds = None
+
+
+    def __len__(self):
+        return len(self.cluster_ids)
+
+
+    def update(self,collection,rows,columns):
+        '''
+        Brings the clusters up to date with this tick's neighbour graph (BoidCollection.tick calls this)
+        :param collection: BoidCollection the graph is of, for the positions and handles of its boids
+        :param rows: array of edge starts, as rows of collection.views or collection.handles.values()
+        :param columns: array of edge ends
+        '''
+        if collection.array_backed:
+            boids = collection.views
+            positions = collection.arrays.positions
+        else:
+            boids = list(collection.handles.values())
+            positions = np.array([boid.position for boid in boids],np.float64).reshape(-1,2)
+        population = (len(collection.handles),collection._next_handle)
+        if population != self._population:
+            self._population = population
+            self.handles = np.array([boid.handle for boid in boids],np.int64)
+            self.ids = None
+            self.resets += 1
+        self._parent = connect(len(boids),rows,columns)
+        self._label()
+        # kept for centroids: array-backed positions change in place when boids are added or removed
+        self._positions = positions.copy() if collection.array_backed else positions
+        self._bounds = collection._shared_bounds()
+        self.updates += 1
+
+
+    def _label(self):
+        '''
+        Internal function, gives each component an id and finds the size of each. Every boid points
+        straight at the smallest row in its component, so components are numbered in the order of those
+        roots without sorting.
+        '''
+        n = len(self._parent)
+        is_root = self._parent == np.arange(n)
+        roots = np.flatnonzero(is_root)
+        component = (np.cumsum(is_root) - 1)[self._parent]
+        count = len(roots)
+        sizes = np.bincount(component,minlength=count)
+        if self.ids is None:
+            ids = self._next_id + np.arange(count)
+        else:
+            ids = self.ids[roots]
+            # a cluster split (or lost its root to another): of the components claiming its id, the
+            # largest keeps it
+            claimed = np.flatnonzero(np.bincount(ids,minlength=self._next_id)[ids] > 1)
+            order = claimed[np.lexsort((-sizes[claimed],ids[claimed]))]
+            losers = order[1:][ids[order[1:]] == ids[order[:-1]]]
+            ids[losers] = self._next_id + np.arange(len(losers))
+        self._next_id = max(self._next_id,int(ids.max(initial=-1)) + 1)
+        self.ids = ids[component]
+        self.cluster_ids = ids
+        self.sizes = sizes
+        self._roots = roots
+        self._component = component
+        self._centroids = None
+
+
+    @property
+    def centroids(self):
+        '''
+        (n_clusters,2) array of the centre of each cluster, across the bounds: each cluster's boids are
+        averaged by their shortest displacement from its root. Found from the positions after the last
+        update on first use, as many uses of clusters only need sizes.
+        '''
+        if self._centroids is None:
+            positions, roots, component = self._positions, self._roots, self._component
+            count = len(roots)
+            xmin, xmax, ymin, ymax = self._bounds
+            anchors = positions[roots]
+            offsets_x = find_shortest_paths(anchors[component,0],positions[:,0],xmax,xmin)
+            offsets_y = find_shortest_paths(anchors[component,1],positions[:,1],ymax,ymin)
+            centroids = anchors + np.stack((np.bincount(component,offsets_x,count),
+                                            np.bincount(component,offsets_y,count)),axis=1) / self.sizes[:,None]
+            centroids[:,0] = xmin + (centroids[:,0] - xmin) % (xmax - xmin)
+            centroids[:,1] = ymin + (centroids[:,1] - ymin) % (ymax - ymin)
+            self._centroids = centroids
+        return self._centroids
+
+
+    def cluster_of(self,boid):
+        '''
+        :return: id of the cluster boid belongs to
+        '''
+        return int(self.ids[np.flatnonzero(self.handles == boid.handle)[0]])
+
+
+    def members(self,cluster_id):
+        '''
+        :return: array of the handles of the boids in a cluster
+        '''
+        return self.handles[self.ids == cluster_id]
+
+
+    def summary(self,min_size=1):
+        '''
+        :param min_size: smallest cluster to include, e.g. 2 to leave out boids on their own
+        :return: (cluster_ids,sizes,centroids) of the clusters with at least min_size boids
+        '''
+        keep = self.sizes >= min_size
+        return self.cluster_ids[keep], self.sizes[keep], self.centroids[keep]
@@ -1,4 +1,27 @@
-from _boid import Boid, get_displacement
+import operator
+import random
+import weakref
+
+from _boid import Boid, get_displacement, distance_between_points, species_from_kwargs, _find_shortest_path, \
+    DEFAULT_BOUNDS, DEFAULT_TOLERANCE, DEFAULT_SPEED, DEFAULT_PALETTE
+from _spatialhash import SpatialHash
+from _boidprofile import timed
+
+DEFAULT_SKIN = 20 * DEFAULT_SPEED
+# largest number of (new boid,boid) pairs checked to add boids to an array-backed Verlet list in place,
+# beyond which it is rebuilt instead
+INCREMENTAL_PAIR_LIMIT = 1 << 20
+
+_by_handle = operator.attrgetter('handle')
+# vertex templates of each species with an angle_step, as arrays for drawing in bulk
+_template_arrays = weakref.WeakKeyDictionary()
+
+
+def _decide_chunk(boids):
+    '''
+    Orientation changes for a chunk of scalar boids (run on a worker thread)
+    '''
+    return [boid._get_recommendations() for boid in boids]
 
 
 class BoidCollection:
@@ -7,8 +30,79 @@ class BoidCollection:
         Collection of Boids.
         :param args:
         :param kwargs:
+        array_backed: keep boid state in NumPy arrays and tick the whole flock with vectorised kernels
+        bounds: area boids can move in (only used when array_backed, where every boid shares it)
+        tolerance: tolerance for being on boundary (only used when array_backed, where every boid shares it)
+        displacement_dtype: float dtype for array-backed displacements, 'float32' halves their memory
+        skin: extra distance beyond vision_range covered by the cached (Verlet) neighbour candidates, which are
+            only rebuilt once a boid has moved more than skin/2. 0 rebuilds them every tick.
+        rules: (name,function) recommendation rules for array-backed flocks, in place of
+            _boidarrays.DEFAULT_RULES (functions must be picklable for sharded flocks)
+        neighbour_range: radius array-backed ticks find neighbours within, the same for every boid, in place of
+            each boid's vision_range (default None: vision_range). boid.neighbours, get_neighbour_lists and
+            cluster tracking then only cover this radius; it is meant for rules that find more distant boids
+            themselves, e.g. _boidquadtree.ApproximateRules, leaving only avoidance on the lists.
+        kernels: compute-kernel backend array-backed flocks tick with: 'numpy', 'python' (the scalar helpers
+            element by element), 'numba' (JIT-compiled loops, needs numba) or 'auto' for the fastest available
+            (default None: 'numpy'). Scalar boids always use the pure Python helpers.
+        seed: seed for the collection's own random.Random, used for every random choice when adding boids
+            (default None: use the global random module)
+        headless: collection is never drawn, so pyglet is never imported (passed on to every boid)
+        angle_step: step in degrees scalar boids round their orientation to, taking sines, cosines and vertices
+            from tables (passed on to every boid, default None: exact). Array-backed flocks always compute their
+            trigonometry in bulk, so can't use it.
+        workers: number of threads deciding how boids turn each tick, each taking a chunk of the flock
+            (default None: decide on the calling thread). Array-backed flocks gain from this on several cores,
+            as NumPy releases the GIL; scalar boids are pure Python, so only gain without a GIL.
+        profiler: TickProfiler collecting per-phase timings and counters (default None: no profiling)
+        obstacles: ObstacleLayer of static walls and polygons boids steer around, as a fourth recommendation
+            (default None: no obstacles)
+        recorder: TrajectoryRecorder writing positions and orientations to a file as the flock ticks
+            (default None: no recording)
+        clusters: ClusterTracker finding the distinct flocks from each tick's neighbours
+            (default None: no cluster tracking). Sharded flocks get the neighbour graph from their workers, but
+            are synced every tick for the positions of the boids.
+        shards: (columns,rows) of tiles to split the bounds into, ticking each tile in its own worker process
+            (implies array_backed). Boid state is only copied back from the workers by sync(), which
+            draw(), add() and remove() call.
         '''
+        self.seed = kwargs.get('seed',None)
+        self.random = random if self.seed is None else random.Random(self.seed)
         self.boids = set()
+        self.handles = {}
+        self._next_handle = 0
+        self.shards = kwargs.get('shards',None)
+        self.array_backed = kwargs.get('array_backed',False) or self.shards is not None
+        self.bounds = tuple(kwargs.get('bounds',DEFAULT_BOUNDS))
+        self.tolerance = kwargs.get('tolerance',DEFAULT_TOLERANCE)
+        self.displacement_dtype = kwargs.get('displacement_dtype','float64')
+        self.skin = kwargs.get('skin',DEFAULT_SKIN)
+        self.rules = kwargs.get('rules',None)
+        self.neighbour_range = kwargs.get('neighbour_range',None)
+        self.kernels = kwargs.get('kernels',None)
+        self.headless = kwargs.get('headless',False)
+        self.angle_step = kwargs.get('angle_step',None)
+        self.profiler = kwargs.get('profiler',None)
+        self.workers = kwargs.get('workers',None)
+        self.executor = None
+        self.obstacles = kwargs.get('obstacles',None)
+        self.recorder = kwargs.get('recorder',None)
+        self.clusters = kwargs.get('clusters',None)
+        self.simulation = None
+        self.batch = None
+        self.vertex_list = None
+        self.drawn_boids = None
+        if self.array_backed:
+            from _boidarrays import BoidArrays
+            from _boidbackends import get_backend
+            self.arrays = BoidArrays()
+            self.views = []
+            self.kernels = get_backend(self.kernels)
+        if self.shards is not None:
+            from _boidshards import ShardedFlock
+            self.sharded_flock = ShardedFlock(self.bounds,self.tolerance,self.displacement_dtype,self.shards,
+                                              self._get_rules(),self.neighbour_range,self.kernels.name)
+            self.arrays_up_to_date = True
         self._init_displacements()
 
 
@@ -18,6 +112,12 @@ class BoidCollection:
         '''
         self.displacements = {boid:{} for boid in self.boids}
         self.displacements_up_to_date = False
+        self.index = None
+        self.index_up_to_date = False
+        self.index_checked = False
+        self.candidates = None
+        self.candidate_pairs = None
+        self.neighbour_lists = None
 
 
     def add(self,number=None,**kwargs):
@@ -30,54 +130,793 @@ class BoidCollection:
             kwargs['collection'] = self
         if not number:
             number = 1
+        kwargs.setdefault('headless',self.headless)
+        kwargs.setdefault('angle_step',self.angle_step)
+        kwargs.setdefault('rng',self.random)
+        self._stop_shards()
+        if self.array_backed:
+            from _boidarrays import ArrayBoid
+            if tuple(kwargs.setdefault('bounds',self.bounds)) != self.bounds or \
+                    kwargs.setdefault('tolerance',self.tolerance) != self.tolerance:
+                raise ValueError('array-backed boids must share the bounds and tolerance of their collection')
+            if kwargs['angle_step'] is not None:
+                raise ValueError('array-backed boids compute their trigonometry in bulk and can not use angle_step')
         newboids = []
         for i in range(number):
-            b = Boid(**kwargs)
-            self.boids.add(b)
+            if self.array_backed:
+                b = ArrayBoid(self.arrays,**kwargs)
+                self.views.append(b)
+            else:
+                b = Boid(**kwargs)
             newboids.append(b)
-        self._init_displacements()
+        self._register(newboids)
         return newboids
 
 
+    def spawn(self,number,**kwargs):
+        '''
+        Adds number boids in bulk, drawing their positions, orientations and colours as vectorised random
+        numbers rather than boid by boid. Takes the same kwargs as add, except that position, orientation and
+        specific_colour may also be given per boid, as sequences of number values.
+        :returns: list of boids created
+        '''
+        import numpy as np
+        kwargs.setdefault('headless',self.headless)
+        kwargs.setdefault('angle_step',self.angle_step)
+        self._stop_shards()
+        if self.array_backed:
+            from _boidarrays import ArrayBoid, ROW_PARAMETERS
+            if tuple(kwargs.setdefault('bounds',self.bounds)) != self.bounds or \
+                    kwargs.setdefault('tolerance',self.tolerance) != self.tolerance:
+                raise ValueError('array-backed boids must share the bounds and tolerance of their collection')
+            if kwargs['angle_step'] is not None:
+                raise ValueError('array-backed boids compute their trigonometry in bulk and can not use angle_step')
+        species = species_from_kwargs(kwargs)
+        bounds = species.bounds
+        rng = np.random.default_rng(self.random.getrandbits(64))
+        if 'position' in kwargs:
+            positions = np.broadcast_to(np.asarray(kwargs['position'],np.float64),(number,2))
+        else:
+            positions = np.stack((rng.integers(bounds[0],bounds[1],number,endpoint=True),
+                                  rng.integers(bounds[2],bounds[3],number,endpoint=True)),axis=1)
+        if 'orientation' in kwargs:
+            orientations = np.broadcast_to(np.asarray(kwargs['orientation']),(number,))
+        else:
+            orientations = rng.integers(0,360,number)
+        if 'specific_colour' in kwargs:
+            colours = np.broadcast_to(np.asarray(kwargs['specific_colour'],np.int64),(number,3))
+        else:
+            palette = np.asarray(kwargs.get('palette',DEFAULT_PALETTE))
+            colours = np.clip(palette + rng.integers(-40,40,(number,3),endpoint=True),0,255)
+        collection = kwargs.get('collection') or self
+        if self.array_backed:
+            fields = {'positions':positions,'orientations':orientations,'colours':colours}
+            fields.update({field:getattr(species,name) for field, name in ROW_PARAMETERS})
+            newboids = [ArrayBoid._view(self.arrays,index,species,collection)
+                        for index in self.arrays.extend(fields)]
+            self.views.extend(newboids)
+        else:
+            newboids = [Boid._from_state(species,colour,orientation,position,collection)
+                        for colour, orientation, position in zip(map(tuple,colours.tolist()),orientations.tolist(),
+                                                                 positions.tolist())]
+        self._register(newboids)
+        return newboids
+
+
+    def _register(self,boids):
+        '''
+        Internal function, adds new boids to the collection, giving each a stable integer handle, and adds them
+        to the neighbour index in place
+        '''
+        for boid in boids:
+            boid.handle = self._next_handle
+            self.handles[boid.handle] = boid
+            self._next_handle += 1
+            self.boids.add(boid)
+        if self.array_backed:
+            self._insert_candidate_rows(range(len(self.arrays) - len(boids),len(self.arrays)))
+        else:
+            for boid in boids:
+                self._index_insert(boid)
+        self.displacements_up_to_date = False
+        self.neighbour_lists = None
+        self.drawn_boids = None
+
+
+    def get(self,handle):
+        '''
+        :return: the boid with the given handle
+        '''
+        return self.handles[handle]
+
+
     def remove(self,boid):
         '''
-        Removes boid from collection
+        Removes boid (or the boid with the given handle) from collection
         '''
+        if not isinstance(boid,Boid):
+            boid = self.handles[boid]
+        self._stop_shards()
         self.boids.remove(boid)
-        self._init_displacements()
+        del self.handles[boid.handle]
+        if self.array_backed:
+            index = boid._index
+            moved = self.arrays.remove(index)
+            self._remove_candidate_row(index,moved)
+            self.views[index] = self.views[moved]
+            self.views[index]._index = index
+            self.views.pop()
+        else:
+            self._index_remove(boid)
+        self.displacements_up_to_date = False
+        self.neighbour_lists = None
+        self.drawn_boids = None
 
 
     def _update_displacements(self):
         '''
         Updates displacements between boids (only needs calling if displacements are not up to date)
         '''
-        for boid_1 in self.boids:
-            for boid_2 in self.boids:
-                if boid_1 != boid_2:
-                    self.displacements[boid_1][boid_2] = get_displacement(boid_1,boid_2)
+        if self.profiler is not None:
+            self.profiler.count('displacement_rebuilds')
+        if self.array_backed:
+            self._update_displacements_arrays()
+            return
+        boids = list(self.handles.values())
+        self.displacements = {boid:{} for boid in boids}
+        for i, boid_1 in enumerate(boids):
+            for boid_2 in boids[i+1:]:
+                displacement = get_displacement(boid_1,boid_2)
+                self.displacements[boid_1][boid_2] = displacement
+                if boid_1.bounds == boid_2.bounds:
+                    self.displacements[boid_2][boid_1] = displacement
+                else:
+                    self.displacements[boid_2][boid_1] = get_displacement(boid_2,boid_1)
+        self.displacements_up_to_date = True
+
+
+    def _update_displacements_arrays(self):
+        '''
+        Fills displacements from a vectorised displacement matrix of the array-backed boids
+        '''
+        from _boidkernels import displacement_matrix
+        distances = displacement_matrix(self.arrays.positions,self.bounds,self.displacement_dtype)[2]
+        self.displacements = {}
+        for boid_1, row in zip(self.views,distances.tolist()):
+            self.displacements[boid_1] = {boid_2:displacement for boid_2, displacement in zip(self.views,row)
+                                          if boid_2 is not boid_1}
         self.displacements_up_to_date = True
 
 
     def get_displacements(self):
+        self.sync()
         if not self.displacements_up_to_date:
-            self._update_displacements()
+            timed(self.profiler,'displacements',self._update_displacements)
         return self.displacements
 
 
+    def _update_index(self):
+        '''
+        Rebuilds the Verlet lists: for every boid, the other boids closer than its vision_range + skin,
+        found with a spatial hash whose cells are as wide as the largest vision_range + skin. The
+        vision_range each list was built for is kept, as get_nearby rebuilds them if a boid sees further.
+        Boids with differing bounds can't share a toroidal grid, so every boid is a candidate for them.
+        '''
+        if self.profiler is not None:
+            self.profiler.count('index_rebuilds')
+        boids = self.handles.values()
+        bounds = {tuple(boid.bounds) for boid in boids}
+        if len(bounds) == 1:
+            self.index_range = max(boid.vision_range for boid in boids)
+            self.index = SpatialHash(bounds.pop(),self.index_range + self.skin)
+            for boid in boids:
+                self.index.insert(boid,boid.position)
+            self.candidates = {boid:{other:None for other in sorted(self.index.nearby(boid.position),key=_by_handle)
+                                     if other is not boid
+                                     and get_displacement(boid,other) < boid.vision_range + self.skin}
+                               for boid in boids}
+        else:
+            self.index = None
+            self.candidates = None
+        self.index_positions = {boid:tuple(boid.position) for boid in boids}
+        self.index_ranges = {boid:boid.vision_range for boid in boids}
+        self.index_up_to_date = True
+        self.index_checked = True
+
+
+    def _check_index(self):
+        '''
+        Rebuilds the Verlet lists if they are out of date or any boid has moved more than skin/2 since they
+        were built (so no boid can have come within vision_range of a boid missing from its list)
+        '''
+        if self.index_up_to_date:
+            for boid, position in self.index_positions.items():
+                moved = (_find_shortest_path(position[0],boid.position[0],boid.bounds[1],boid.bounds[0]),
+                         _find_shortest_path(position[1],boid.position[1],boid.bounds[3],boid.bounds[2]))
+                if distance_between_points((0,0),moved) > self.skin / 2:
+                    self.index_up_to_date = False
+                    break
+        if not self.index_up_to_date:
+            timed(self.profiler,'index',self._update_index)
+        self.index_checked = True
+
+
+    def _index_insert(self,boid):
+        '''
+        Internal function, adds a new boid to the Verlet lists without rebuilding them. The listed boids may
+        already have moved skin/2 since the lists were built, so pairs with the new boid are listed out to
+        vision_range + 1.5 * skin.
+        '''
+        if not self.index_up_to_date:
+            return
+        if self.index is None or tuple(boid.bounds) != self.index.bounds:
+            self.index_up_to_date = False
+            return
+        reach = 1.5 * self.skin
+        self.index_range = max(self.index_range,boid.vision_range)
+        candidates = {}
+        for other in sorted(self.index.nearby(boid.position,self.index_range + 2 * self.skin),key=_by_handle):
+            displacement = get_displacement(boid,other)
+            if displacement < boid.vision_range + reach:
+                candidates[other] = None
+            if displacement < other.vision_range + reach:
+                self.candidates[other][boid] = None
+        self.candidates[boid] = candidates
+        self.index.insert(boid,boid.position)
+        self.index_positions[boid] = tuple(boid.position)
+        self.index_ranges[boid] = boid.vision_range
+
+
+    def _index_remove(self,boid):
+        '''
+        Internal function, removes a boid from the Verlet lists without rebuilding them
+        '''
+        if not self.index_up_to_date:
+            return
+        position = self.index_positions.pop(boid)
+        del self.index_ranges[boid]
+        if self.index is None:
+            return
+        self.index.remove(boid,position)
+        del self.candidates[boid]
+        for other in self.index.nearby(position,self.index_range + 2 * self.skin):
+            self.candidates[other].pop(boid,None)
+
+
+    def _insert_candidate_rows(self,rows):
+        '''
+        Internal function, adds pairs with new rows to the Verlet list of array-backed boids in place, as
+        _index_insert does, unless that would check more than INCREMENTAL_PAIR_LIMIT pairs
+        '''
+        if self.candidate_pairs is None or not rows:
+            return
+        if len(rows) * len(self.arrays) > INCREMENTAL_PAIR_LIMIT:
+            self.candidate_pairs = None
+            return
+        import numpy as np
+        from _boidkernels import pair_displacements
+        new = np.arange(rows.start,rows.stop)
+        i = np.concatenate([np.arange(k) for k in new])
+        j = np.repeat(new,new)
+        distances = pair_displacements(self.arrays.positions,self.bounds,i,j,self.displacement_dtype)[2]
+        vision_ranges = self._neighbour_ranges()
+        keep = distances < np.maximum(vision_ranges[i],vision_ranges[j]) + 1.5 * self.skin
+        self.candidate_pairs = (np.concatenate((self.candidate_pairs[0],i[keep])),
+                                np.concatenate((self.candidate_pairs[1],j[keep])))
+        self.candidate_positions = np.concatenate((self.candidate_positions,self.arrays.positions[new]))
+        self.candidate_ranges = np.concatenate((self.candidate_ranges,vision_ranges[new]))
+
+
+    def _remove_candidate_row(self,index,moved):
+        '''
+        Internal function, removes a row from the Verlet list of array-backed boids in place, renumbering the
+        row moved into its place
+        '''
+        if self.candidate_pairs is None:
+            return
+        import numpy as np
+        i, j = self.candidate_pairs
+        keep = (i != index) & (j != index)
+        i = np.where(i[keep] == moved, index, i[keep])
+        j = np.where(j[keep] == moved, index, j[keep])
+        self.candidate_pairs = (np.minimum(i,j), np.maximum(i,j))
+        self.candidate_positions[index] = self.candidate_positions[moved]
+        self.candidate_positions = self.candidate_positions[:moved]
+        self.candidate_ranges[index] = self.candidate_ranges[moved]
+        self.candidate_ranges = self.candidate_ranges[:moved]
+
+
+    def get_nearby(self,boid):
+        '''
+        Finds boids close enough that boid might see them, using the Verlet lists
+        :param boid: boid to search around
+        :return: dict of boid:displacement for every candidate neighbour
+        '''
+        return {other:distance_between_points((0,0),offset) for other, offset in self._get_nearby_offsets(boid).items()}
+
+
+    def _get_nearby_offsets(self,boid):
+        '''
+        Internal function, get_nearby giving the wrapped (dx,dy) from boid to each candidate, so Boid.neighbours
+        can test distance and vision cone without wrapping the positions again
+        :return: dict of boid:(dx,dy)
+        '''
+        if self.candidates is not None and boid.vision_range > self.index_ranges.get(boid,-1):
+            # the boid now sees further than its list reaches
+            self.index_up_to_date = False
+            self.index_checked = False
+        if not self.index_checked:
+            self._check_index()
+        candidates = self.handles.values() if self.candidates is None else self.candidates[boid]
+        return {other:boid._relative_position(other) for other in candidates if other is not boid}
+
+
+    def get_neighbour_lists(self):
+        '''
+        Neighbours of every array-backed boid, found with vectorised kernels once per tick
+        :return: NeighbourLists, rows ordered like self.views
+        '''
+        self.sync()
+        if self.neighbour_lists is None:
+            from _boidarrays import find_neighbours
+            self.neighbour_lists = find_neighbours(self.arrays,self.bounds,self.displacement_dtype,self.profiler,
+                                                   self._get_candidate_pairs(),self.neighbour_range)
+        return self.neighbour_lists
+
+
+    def _neighbour_ranges(self):
+        '''
+        Internal function, the radius each array-backed boid's neighbours are found within: neighbour_range if
+        set, otherwise its vision_range
+        :return: array of one radius per boid
+        '''
+        if self.neighbour_range is None:
+            return self.arrays.vision_ranges
+        import numpy as np
+        return np.full(len(self.arrays),float(self.neighbour_range))
+
+
+    def _get_candidate_pairs(self):
+        '''
+        Internal function, returns the Verlet list of array-backed boids, rebuilding it once a boid has moved
+        more than skin/2 since it was built or sees further than it did then
+        '''
+        from _boidarrays import find_candidates
+        from _boidkernels import max_displacement
+        if self.candidate_pairs is None or (self._neighbour_ranges() > self.candidate_ranges).any() or \
+                max_displacement(self.candidate_positions,self.arrays.positions,self.bounds) > self.skin / 2:
+            self.candidate_pairs = find_candidates(self.arrays,self.bounds,self.skin,self.displacement_dtype,
+                                                   self.profiler,self.neighbour_range)
+            self.candidate_positions = self.arrays.positions.copy()
+            self.candidate_ranges = self._neighbour_ranges().copy()
+        return self.candidate_pairs
+
+
+    def query_neighbours(self,radius=None,angle=None):
+        '''
+        Finds the neighbours of every boid at once: the other boids closer than radius and within angle of
+        its heading
+        :param radius: search radius, one for all boids or one per boid; each boid's vision_range if None
+        :param angle: angle in degrees either side of the heading, one for all boids or one per boid;
+            each boid's vision_angle if None
+        :return: (boids,NeighbourLists) where row k of the CSR layout holds the neighbours of boids[k]
+        '''
+        from _boidarrays import find_neighbours
+        if not self.array_backed:
+            boids, arrays, bounds = self._scalar_arrays()
+            return boids, find_neighbours(arrays,bounds,self.displacement_dtype,radii=radius,cones=angle)
+        # the cached lists only cover vision_range without a neighbour_range
+        cached = self.neighbour_range is None and radius is None
+        if cached and angle is None:
+            return self.views, self.get_neighbour_lists()
+        self.sync()
+        candidates = self._get_candidate_pairs() if cached else None
+        return self.views, find_neighbours(self.arrays,self.bounds,self.displacement_dtype,None,candidates,
+                                           radius,angle)
+
+
+    def _scalar_arrays(self):
+        '''
+        Internal function, copies the state of scalar boids (in handle order) into BoidArrays, so the
+        vectorised functions of _boidarrays can be used on them
+        :return: (boids,BoidArrays,bounds)
+        '''
+        from _boidarrays import BoidArrays
+        boids = list(self.handles.values())
+        fields = {'positions':[boid.position for boid in boids],
+                  'orientations':[boid.orientation for boid in boids],
+                  'speeds':[boid.speed for boid in boids],
+                  'vision_ranges':[boid.vision_range for boid in boids],
+                  'vision_angles':[boid.vision_angle for boid in boids],
+                  'lengths':[boid.length for boid in boids],
+                  'widths':[boid.width for boid in boids],
+                  'colours':[boid.colour for boid in boids]}
+        return boids, BoidArrays.from_fields(fields), self._shared_bounds()
+
+
+    def _shared_bounds(self):
+        '''
+        Internal function, the bounds every boid moves in: the collection's for array-backed flocks, otherwise
+        the bounds the scalar boids share (the collection's bounds are only a default for them)
+        :return: (xmin,xmax,ymin,ymax) boundaries
+        '''
+        if self.array_backed:
+            return self.bounds
+        bounds = {tuple(boid.bounds) for boid in self.handles.values()}
+        if len(bounds) > 1:
+            raise ValueError('boids with differing bounds can not be queried together')
+        return bounds.pop() if bounds else self.bounds
+
+
     def tick(self):
         '''
         Ticks every boid
         '''
-        for boid in self.boids:
-            boid.decide_movement_strategy()
-        for boid in self.boids:
-            boid.tick()
+        if self.shards is not None:
+            edges = timed(self.profiler,'shards',self._tick_shards)
+            if self.clusters is not None:
+                # the workers send the neighbour graph they found, by id (the row each boid syncs to)
+                self.sync()
+                timed(self.profiler,'clusters',self.clusters.update,self,*edges)
+        elif self.array_backed:
+            self._tick_arrays()
+        else:
+            if not self.index_checked:
+                self._check_index()
+            boids = list(self.handles.values())
+            # every boid decides from the state at the start of the tick, before any of them turns
+            changes = self._decide(boids)
+            if self.clusters is not None:
+                from _boidclusters import edges_from_boids
+                edges = timed(self.profiler,'clusters',edges_from_boids,boids)
+            for boid, change in zip(boids,changes):
+                boid._turn(change)
+            for boid in boids:
+                boid.tick()
+            self.displacements_up_to_date = False
+            self.index_checked = False
+            if self.clusters is not None:
+                timed(self.profiler,'clusters',self.clusters.update,self,*edges)
+        if self.recorder is not None:
+            timed(self.profiler,'recording',self.recorder.record,self)
+        if self.profiler is not None:
+            self.profiler.count('boids',len(self.boids))
+            self.profiler.end_tick()
+
+
+    def _get_executor(self):
+        '''
+        Internal function, the thread pool for workers (created on first use), or None
+        '''
+        if self.workers and self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(self.workers,'boids')
+        return self.executor
+
+
+    def _decide(self,boids):
+        '''
+        Internal function, finds how each scalar boid will turn, in chunks on the thread pool if there is one.
+        Deciding only reads the flock (the index and displacements are brought up to date beforehand), so
+        chunks can't interfere.
+        :return: list of orientation changes
+        '''
+        executor = self._get_executor()
+        if executor is None or len(boids) < 2 * self.workers:
+            return _decide_chunk(boids)
+        edges = [len(boids) * k // self.workers for k in range(self.workers + 1)]
+        futures = [executor.submit(_decide_chunk,boids[start:stop]) for start, stop in zip(edges[:-1],edges[1:])]
+        return [change for future in futures for change in future.result()]
+
+
+    def _get_rules(self):
+        '''
+        Internal function, the recommendation rules for array-backed ticks: self.rules (or DEFAULT_RULES
+        computed with self.kernels), followed by obstacle avoidance if the collection has obstacles
+        '''
+        from _boidarrays import default_rules
+        rules = self.rules or default_rules(self.kernels)
+        if self.obstacles is None:
+            return rules
+        return tuple(rules) + (('obstacles',self.obstacles.recommendations),)
+
+
+    def _tick_arrays(self):
+        '''
+        Ticks every array-backed boid at once. Every boid decides from the state at the start of the tick,
+        then the whole flock moves.
+        '''
+        from _boidarrays import recommendations, arbitrate, apply_changes
+        neighbours = self.get_neighbour_lists()
+        severity, change = recommendations(self.arrays,neighbours,self.bounds,self.profiler,
+                                           self._get_rules(),self._get_executor(),self.workers or 1)
+        changes = timed(self.profiler,'arbitration',arbitrate,[boid.logic for boid in self.views],severity,change)
+        timed(self.profiler,'movement',apply_changes,self.arrays,changes,self.bounds,self.tolerance,self.kernels)
         self.displacements_up_to_date = False
+        self.index_up_to_date = False
+        self.neighbour_lists = None
+        if self.clusters is not None:
+            timed(self.profiler,'clusters',self.clusters.update,self,neighbours.rows,neighbours.indices)
+
+
+    def _tick_shards(self):
+        '''
+        Ticks a sharded flock in its worker processes, starting them if needed
+        :return: (rows,columns) edges of the tick's neighbour graph if tracking clusters, else None
+        '''
+        import numpy as np
+        if not self.sharded_flock.running:
+            fields = self.arrays.get_fields()
+            fields['ids'] = np.arange(len(self.arrays))
+            fields['logics'] = np.empty(len(self.views),object)
+            fields['logics'][:] = [boid.logic for boid in self.views]
+            self.sharded_flock.start(fields)
+        edges = self.sharded_flock.tick(self.clusters is not None)
+        self.arrays_up_to_date = False
+        self.displacements_up_to_date = False
+        self.index_up_to_date = False
+        self.candidate_pairs = None
+        self.neighbour_lists = None
+        return edges
+
+
+    def snapshot(self,path):
+        '''
+        Saves the collection to a compact binary file (see _boidsnapshot): the collection's settings, the
+        species its boids share and the state of its random number generator in a JSON header, then one
+        fixed-size record per boid with its handle, position, orientation, parameters and colour.
+        The kernel backend is saved by name, and found again in the registry of _boidbackends on restore.
+        Boid ids, rules and custom logics are not saved.
+        :param path: file to write
+        '''
+        import numpy as np
+        from _boidbackends import get_backend
+        from _boidsnapshot import RECORD_DTYPE, write_snapshot, species_to_dict, encode_random_state
+        self.sync()
+        boids = self.views if self.array_backed else list(self.handles.values())
+        species = {}
+        records = np.zeros(len(boids),RECORD_DTYPE)
+        records['handle'] = [boid.handle for boid in boids]
+        records['species'] = [species.setdefault(boid.species,len(species)) for boid in boids]
+        if self.array_backed:
+            for name, field in (('position','positions'),('orientation','orientations'),('speed','speeds'),
+                                ('vision_range','vision_ranges'),('vision_angle','vision_angles'),
+                                ('length','lengths'),('width','widths'),('colour','colours')):
+                records[name] = getattr(self.arrays,field)
+        else:
+            for name in ('position','orientation','speed','vision_range','vision_angle','length','width','colour'):
+                records[name] = [getattr(boid,name) for boid in boids]
+        header = {'array_backed':self.array_backed,
+                  'bounds':list(self.bounds),
+                  'tolerance':self.tolerance,
+                  'displacement_dtype':str(self.displacement_dtype),
+                  'skin':self.skin,
+                  'neighbour_range':self.neighbour_range,
+                  'headless':self.headless,
+                  'angle_step':self.angle_step,
+                  'kernels':None if self.kernels is None else get_backend(self.kernels).name,
+                  'shards':self.shards,
+                  'next_handle':self._next_handle,
+                  'random_state':encode_random_state(self.random.getstate()),
+                  'species':[species_to_dict(s) for s in species]}
+        write_snapshot(path,header,records)
+
+
+    @classmethod
+    def restore(cls,path,mmap=False,**kwargs):
+        '''
+        Loads a collection saved by snapshot. Ticking it continues the saved run bit for bit, and its random
+        number generator continues from the saved state (as a random.Random of its own).
+        :param path: file written by snapshot
+        :param mmap: memory-map the boid records rather than reading them, for very large flocks. An
+            array-backed collection keeps the mapped columns as its arrays (copy-on-write), so only the
+            pages it uses are read and the file is never changed.
+        :param kwargs: further BoidCollection kwargs, e.g. profiler or rules
+        :return: BoidCollection
+        '''
+        from _boid import Species
+        from _boidsnapshot import read_snapshot, decode_random_state
+        header, records = read_snapshot(path,mmap)
+        settings = {'array_backed':header['array_backed'],
+                    'bounds':tuple(header['bounds']),
+                    'tolerance':header['tolerance'],
+                    'displacement_dtype':header['displacement_dtype'],
+                    'skin':header['skin'],
+                    'neighbour_range':header.get('neighbour_range'),
+                    'headless':header['headless'],
+                    'angle_step':header.get('angle_step'),
+                    'kernels':header.get('kernels'),
+                    'shards':None if header['shards'] is None else tuple(header['shards'])}
+        settings.update(kwargs)
+        collection = cls(**settings)
+        collection.random = random.Random()
+        collection.random.setstate(decode_random_state(header['random_state']))
+        species = [Species.get(**parameters) for parameters in header['species']]
+        species_indices = records['species'].tolist()
+        if collection.array_backed:
+            from _boidarrays import ArrayBoid, BoidArrays
+            # the columns read (or mapped) from the file become the collection's arrays
+            collection.arrays = BoidArrays.from_fields({'positions':records['position'],
+                                                        'orientations':records['orientation'],
+                                                        'speeds':records['speed'],
+                                                        'vision_ranges':records['vision_range'],
+                                                        'vision_angles':records['vision_angle'],
+                                                        'lengths':records['length'],
+                                                        'widths':records['width'],
+                                                        'colours':records['colour']},copy=False)
+            boids = [ArrayBoid._view(collection.arrays,index,species[k],collection)
+                     for index, k in enumerate(species_indices)]
+            collection.views.extend(boids)
+        else:
+            boids = [Boid._from_state(species[k],tuple(colour),orientation,position,collection)
+                     for k, colour, orientation, position in zip(species_indices,records['colour'].tolist(),
+                                                                 records['orientation'].tolist(),
+                                                                 records['position'].tolist())]
+        for boid, handle in zip(boids,records['handle'].tolist()):
+            boid.handle = handle
+        for boid in sorted(boids,key=_by_handle):
+            collection.handles[boid.handle] = boid
+            collection.boids.add(boid)
+        collection._next_handle = header['next_handle']
+        return collection
+
+
+    def sync(self):
+        '''
+        Copies boid state back from the worker processes of a sharded flock into self.arrays,
+        which the boids in self.views read from. Does nothing for other collections.
+        '''
+        if self.shards is None or self.arrays_up_to_date:
+            return
+        fields = self.sharded_flock.gather()
+        for name, array in fields.items():
+            if name not in ('ids','logics'):
+                getattr(self.arrays,name)[fields['ids']] = array
+        self.arrays_up_to_date = True
+
+
+    def _stop_shards(self):
+        '''
+        Syncs and stops the worker processes of a sharded flock (they restart on the next tick)
+        '''
+        if self.shards is not None:
+            self.sync()
+            self.sharded_flock.stop()
+
+
+    def close(self):
+        '''
+        Releases worker processes, threads and the background thread, and closes the recorder, if any
+        '''
+        self.stop_background()
+        self._stop_shards()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.recorder is not None:
+            self.recorder.close()
 
 
     def draw(self):
         '''
-        Draws every boid
+        Draws every boid in one call, from a single vertex list covering the whole flock. While the flock
+        runs in the background (run_in_background), draws its latest state interpolated to the current time.
+        '''
+        import numpy as np
+        if self.headless:
+            raise RuntimeError('headless collections can not be drawn')
+        if self.simulation is not None:
+            if self.simulation.error is not None:
+                raise self.simulation.error
+            latest, positions, orientations = self.simulation.state()
+            if self.drawn_boids != self.simulation.generation:
+                self.drawn_boids = self.simulation.generation
+                self._build_vertex_list(len(positions),latest['colours'].repeat(3,axis=0).ravel())
+            if self.vertex_list is not None:
+                from _boidkernels import get_vertices
+                vertices = timed(self.profiler,'vertices',get_vertices,positions,np.pi * orientations / 180,
+                                 latest['lengths'],latest['widths'])
+                np.ctypeslib.as_array(self.vertex_list.vertices)[:] = vertices.ravel()
+                self.batch.draw()
+            return
+        self.sync()
+        if self.drawn_boids is None:
+            self.drawn_boids = list(self.views) if self.array_backed else list(self.handles.values())
+            self._build_vertex_list(len(self.drawn_boids),self.get_colours())
+        if self.vertex_list is not None:
+            np.ctypeslib.as_array(self.vertex_list.vertices)[:] = timed(self.profiler,'vertices',self.get_vertices).ravel()
+            self.batch.draw()
+
+
+    def _build_vertex_list(self,number,colours):
+        '''
+        Internal function, replaces the vertex list with one for number boids
+        :param colours: flat uint8 array of (r,g,b) per vertex
+        '''
+        import pyglet
+        if self.vertex_list is not None:
+            self.vertex_list.delete()
+            self.vertex_list = None
+        if number:
+            if self.batch is None:
+                self.batch = pyglet.graphics.Batch()
+                if self.obstacles is not None and len(self.obstacles):
+                    self.batch.add(2 * len(self.obstacles),pyglet.gl.GL_LINES,None,
+                                   ('v2f/static',self.obstacles.line_vertices()))
+            self.vertex_list = self.batch.add(3 * number,pyglet.gl.GL_TRIANGLES,None,
+                                              'v2f/stream',('c3B/static',colours.tolist()))
+
+
+    def run_in_background(self,rate=None):
+        '''
+        Starts ticking the flock at a fixed rate on a background thread (see _boidthread.SimulationThread),
+        so slow ticks don't hold up drawing and slow frames don't slow the simulation. Until stop_background,
+        change the flock through the returned thread's submit() rather than directly.
+        :param rate: ticks per second (default _boidthread.DEFAULT_RATE)
+        :return: SimulationThread
+        '''
+        from _boidthread import SimulationThread, DEFAULT_RATE
+        self.stop_background()
+        self.sync()
+        self.simulation = SimulationThread(self,rate or DEFAULT_RATE).start()
+        self.drawn_boids = None
+        return self.simulation
+
+
+    def stop_background(self):
+        '''
+        Stops the background thread started by run_in_background, if any
+        '''
+        simulation, self.simulation = self.simulation, None
+        self.drawn_boids = None
+        if simulation is not None:
+            simulation.stop()
+
+
+    def get_vertices(self):
+        '''
+        Vertices of every boid (in draw order), computed in bulk. Boids with an angle_step take their rotated
+        triangles from their species' templates by index, so only need translating.
+        :return: (n,6) array of (x1,y1,x2,y2,x3,y3)
+        '''
+        import numpy as np
+        from _boidkernels import get_vertices
+        if self.array_backed:
+            from _boidarrays import vertices
+            return vertices(self.arrays)
+        boids = self.drawn_boids if self.drawn_boids is not None else list(self.handles.values())
+        positions = np.array([boid.position for boid in boids],float).reshape(-1,2)
+        # reading angle brings each boid's step in its species' tables up to date
+        angles = np.array([boid.angle for boid in boids],float)
+        by_species = {}
+        exact = []
+        for k, boid in enumerate(boids):
+            if boid._angle_index is None:
+                exact.append(k)
+            else:
+                by_species.setdefault(boid._species,[]).append(k)
+        vertices = np.empty((len(boids),6))
+        for species, rows in by_species.items():
+            templates = _template_arrays.get(species)
+            if templates is None:
+                templates = _template_arrays[species] = np.array(species.vertex_templates(),float)
+            indices = np.array([boids[k]._angle_index for k in rows],np.intp)
+            vertices[rows] = np.tile(positions[rows],3) + templates[indices]
+        if exact:
+            exact_boids = [boids[k] for k in exact]
+            vertices[exact] = get_vertices(positions[exact],angles[exact],
+                                           np.array([boid.length for boid in exact_boids],float),
+                                           np.array([boid.width for boid in exact_boids],float))
+        return vertices
+
+
+    def get_colours(self):
+        '''
+        Colour of each vertex of every boid (in draw order)
+        :return: flat uint8 array of (r,g,b) per vertex
         '''
-        for boid in self.boids:
-            boid.draw()
\ No newline at end of file
+        import numpy as np
+        if self.array_backed:
+            return self.arrays.colours.repeat(3,axis=0).ravel()
+        boids = self.drawn_boids if self.drawn_boids is not None else list(self.handles.values())
+        return np.array([boid.colour_info for boid in boids],np.uint8).ravel()
@@ -0,0 +1,232 @@
+import numpy as np
+
+from _spatialhash import _cells_along_axis
+
+
+def find_shortest_paths(n1,n2,n_max,n_min=0):
+    '''
+    Vectorised _find_shortest_path: shortest signed displacements from n1 to n2 including toroidal geometry
+    :param n1: array of points 1
+    :param n2: array of points 2
+    :param n_max: maximum axis value
+    :param n_min: minimum axis value
+    :return: array of signed displacements between n1 and n2
+    '''
+    width = n_max if n_min == 0 else n_max - n_min
+    dn = n2 - n1
+    return dn - width * np.round(dn / width)
+
+
+def distances_between_points(x1,y1,x2,y2):
+    '''
+    Vectorised distance_between_points
+    :param x1,y1: coordinates of points 1
+    :param x2,y2: coordinates of points 2
+    :return: array of cartesian distances
+    '''
+    return np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+
+
+def angles_between_vectors(x1,y1,x2,y2):
+    '''
+    Vectorised angle_between_vectors
+    :param x1,y1: components of vectors 1
+    :param x2,y2: components of vectors 2
+    :return: array of theta in degrees
+    '''
+    numerator = (x2 * x1) + (y2 * y1)
+    denominator = np.sqrt(x2 ** 2 + y2 ** 2) * np.sqrt(x1 ** 2 + y1 ** 2)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        opp_over_adj = numerator / denominator
+    opp_over_adj = np.where(denominator == 0, np.where(numerator >= 0, 1.0, -1.0), opp_over_adj)
+    return np.arccos(np.clip(opp_over_adj,-1,1)) * 180 / np.pi
+
+
+def adjust_positions_for_boundaries(positions,bounds,tolerance):
+    '''
+    Vectorised adjust_position_for_boundaries, updates positions in place
+    :param positions: (n,2) array of positions
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param tolerance: tolerance for being on boundary (for rounding errors)
+    '''
+    x = positions[:,0]
+    y = positions[:,1]
+    x[x < (bounds[0] - tolerance)] += bounds[1]
+    x[x > (bounds[1] + tolerance)] -= bounds[1]
+    y[y < (bounds[2] - tolerance)] += bounds[3]
+    y[y > (bounds[3] + tolerance)] -= bounds[3]
+
+
+def get_vertices(positions,angles,lengths,widths):
+    '''
+    Vectorised Boid.get_vertices
+    :param positions: (n,2) array of positions
+    :param angles: array of angles in radians
+    :param lengths: array of boid lengths
+    :param widths: array of boid widths
+    :return: (n,6) array of (x1,y1,x2,y2,x3,y3) vertices
+    '''
+    cos = np.cos(angles)
+    sin = np.sin(angles)
+    vertices = np.empty((len(positions),6))
+    offsets = ((lengths / 2, 0),
+               (-lengths / 2, -widths / 2),
+               (-lengths / 2, widths / 2))
+    for k, (x_offset, y_offset) in enumerate(offsets):
+        vertices[:,2*k] = positions[:,0] + (x_offset * cos - (y_offset * sin))
+        vertices[:,2*k+1] = positions[:,1] + (x_offset * sin + (y_offset * cos))
+    return vertices
+
+
+def cell_list_pairs(positions,bounds,cell_size):
+    '''
+    Vectorised SpatialHash lookup: finds every ordered pair of boids in the same or adjacent cells
+    :param positions: (n,2) array of positions
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param cell_size: minimum width of a cell (normally the largest vision_range)
+    :return: (i,j) arrays of candidate pairs, i != j
+    '''
+    columns = _cells_along_axis(bounds[1] - bounds[0],cell_size)
+    rows = _cells_along_axis(bounds[3] - bounds[2],cell_size)
+    column = np.floor((positions[:,0] - bounds[0]) / ((bounds[1] - bounds[0]) / columns)).astype(np.int64) % columns
+    row = np.floor((positions[:,1] - bounds[2]) / ((bounds[3] - bounds[2]) / rows)).astype(np.int64) % rows
+    cells = column * rows + row
+    order = np.argsort(cells,kind='stable')
+    starts = np.searchsorted(cells[order],np.arange(columns * rows))
+    counts = np.bincount(cells,minlength=columns * rows)
+    adjacent = {(dc % columns,dr % rows) for dc in (-1,0,1) for dr in (-1,0,1)}
+    all_i = []
+    all_j = []
+    for dc, dr in sorted(adjacent):
+        target = ((column + dc) % columns) * rows + (row + dr) % rows
+        n_candidates = counts[target]
+        i = np.repeat(np.arange(len(positions)),n_candidates)
+        first = np.repeat(np.cumsum(n_candidates) - n_candidates,n_candidates)
+        j = order[np.repeat(starts[target],n_candidates) + np.arange(len(i)) - first]
+        all_i.append(i)
+        all_j.append(j)
+    i = np.concatenate(all_i)
+    j = np.concatenate(all_j)
+    distinct = i != j
+    return i[distinct], j[distinct]
+
+
+def pair_displacements(positions,bounds,i,j,dtype=np.float64):
+    '''
+    Toroidal displacements from boid i to boid j for each given pair
+    :param positions: (n,2) array of positions
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param i: array of first boid indices
+    :param j: array of second boid indices
+    :param dtype: float dtype to compute in (np.float32 halves memory at the cost of precision)
+    :return: (dx,dy,distance) arrays
+    '''
+    positions = positions.astype(dtype,copy=False)
+    bounds = np.asarray(bounds,dtype)
+    dx = find_shortest_paths(positions[i,0],positions[j,0],bounds[1],bounds[0])
+    dy = find_shortest_paths(positions[i,1],positions[j,1],bounds[3],bounds[2])
+    return dx, dy, np.sqrt(dx ** 2 + dy ** 2)
+
+
+def symmetric_pair_displacements(positions,bounds,i,j,dtype=np.float64):
+    '''
+    pair_displacements for a set of pairs containing both (a,b) and (b,a) (e.g. from cell_list_pairs).
+    Only pairs with i < j are computed; the reverse pairs are mirrored from them.
+    :return: (i,j,dx,dy,distance) arrays, with mirrored pairs appended after the computed ones
+    '''
+    upper = i < j
+    i, j = i[upper], j[upper]
+    dx, dy, distances = pair_displacements(positions,bounds,i,j,dtype)
+    return (np.concatenate((i,j)), np.concatenate((j,i)), np.concatenate((dx,-dx)),
+            np.concatenate((dy,-dy)), np.concatenate((distances,distances)))
+
+
+def max_displacement(positions_1,positions_2,bounds):
+    '''
+    Largest toroidal distance moved between two sets of positions of the same boids
+    :param positions_1: (n,2) array of earlier positions
+    :param positions_2: (n,2) array of later positions
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :return: float distance, 0 for no boids
+    '''
+    if len(positions_1) == 0:
+        return 0.0
+    dx = find_shortest_paths(positions_1[:,0],positions_2[:,0],bounds[1],bounds[0])
+    dy = find_shortest_paths(positions_1[:,1],positions_2[:,1],bounds[3],bounds[2])
+    return float(np.sqrt((dx ** 2 + dy ** 2).max()))
+
+
+def displacement_matrix(positions,bounds,dtype=np.float64):
+    '''
+    Toroidal displacements between every pair of boids, computing only the upper triangle and mirroring it
+    :param positions: (n,2) array of positions
+    :param bounds: (xmin,xmax,ymin,ymax) boundaries
+    :param dtype: float dtype to compute and store in (np.float32 halves memory at the cost of precision)
+    :return: (dx,dy,distance) (n,n) arrays, where dx[a,b] is the x displacement from boid a to boid b
+    '''
+    n = len(positions)
+    i, j = np.triu_indices(n,1)
+    upper_dx, upper_dy, upper_distances = pair_displacements(positions,bounds,i,j,dtype)
+    dx = np.zeros((n,n),dtype)
+    dy = np.zeros((n,n),dtype)
+    distances = np.zeros((n,n),dtype)
+    for matrix, upper, mirrored in ((dx,upper_dx,-upper_dx),(dy,upper_dy,-upper_dy),
+                                    (distances,upper_distances,upper_distances)):
+        matrix[i,j] = upper
+        matrix[j,i] = mirrored
+    return dx, dy, distances
+
+
+def segment_intersection_distances(ax1,ay1,ax2,ay2,bx1,by1,bx2,by2):
+    '''
+    Vectorised segment_intersection_distance
+    :return: array of distances from a1 to the closest point shared with segment b, NaN where they don't meet
+    '''
+    rx, ry = ax2 - ax1, ay2 - ay1
+    sx, sy = bx2 - bx1, by2 - by1
+    qx, qy = bx1 - ax1, by1 - ay1
+    denominator = rx * sy - ry * sx
+    a_length_squared = rx ** 2 + ry ** 2
+    b_length_squared = sx ** 2 + sy ** 2
+    a_length = np.sqrt(a_length_squared)
+    q_cross_r = qx * ry - qy * rx
+    q_cross_s = qx * sy - qy * sx
+    distances = np.full(np.broadcast(ax1,bx1).shape, np.nan)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        # segments cross at a single point
+        t = q_cross_s / denominator
+        u = q_cross_r / denominator
+        crossing = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        distances[crossing] = (t * a_length)[crossing]
+        # collinear segments overlap
+        t0 = (qx * rx + qy * ry) / a_length_squared
+        t1 = t0 + (sx * rx + sy * ry) / a_length_squared
+        lowest = np.maximum(0, np.minimum(t0,t1))
+        highest = np.minimum(1, np.maximum(t0,t1))
+        overlapping = (denominator == 0) & (a_length_squared != 0) & (q_cross_r == 0) & (lowest <= highest)
+        distances[overlapping] = (lowest * a_length)[overlapping]
+        # a is a point lying on b
+        u = -(qx * sx + qy * sy) / b_length_squared
+        on_b = (a_length_squared == 0) & np.where(b_length_squared == 0, (qx == 0) & (qy == 0),
+                                                  (q_cross_s == 0) & (u >= 0) & (u <= 1))
+    distances[on_b] = 0
+    return distances
+
+
+def collision_recommendations(positions_1,headings_1,positions_2,headings_2,orientations_1,orientations_2):
+    '''
+    Vectorised check_for_collision for many pairs at once, given the segments it compares
+    :param positions_1: (n,2) start of each boid 1 heading segment
+    :param headings_1: (n,2) end of each boid 1 heading segment
+    :param positions_2: (n,2) start of each boid 2 heading segment
+    :param headings_2: (n,2) end of each boid 2 heading segment
+    :param orientations_1: boid 1 orientations
+    :param orientations_2: boid 2 orientations
+    :return: (severity,change) arrays, (0,0) where segments don't meet
+    '''
+    distances = segment_intersection_distances(positions_1[:,0],positions_1[:,1],headings_1[:,0],headings_1[:,1],
+                                               positions_2[:,0],positions_2[:,1],headings_2[:,0],headings_2[:,1])
+    colliding = ~np.isnan(distances)
+    severity = np.where(colliding, 1/(distances+0.0001), 0)
+    change = np.where(colliding, np.where(np.mod(orientations_2 - orientations_1,180) > 90, -1, 1), 0)
+    return severity, change
@@ -1,4 +1,7 @@
 
+from abc import ABC, abstractmethod
+
+
 def sign(x):
     '''
     Returns the sign of x (+1 or -1)
@@ -13,15 +16,66 @@ def sign(x):
         raise ValueError(x)
 
 
-class BaseLogic:
+class BaseLogic(ABC):
     def __init__(self):
         pass
 
 
+    @abstractmethod
+    def from_recommendations(self,recommendations):
+        '''
+        Turns one boid's recommendations into a change of orientation
+        :param recommendations: sequence of (severity,change), one per rule
+        :return: orientation change
+        '''
+
+
+    @classmethod
+    def from_recommendation_arrays(cls,logics,severity,change):
+        '''
+        Batched from_recommendations for many boids using logics of this class. Subclasses override this
+        with a vectorised version; the default calls from_recommendations for each boid.
+        :param logics: one logic per row of severity and change
+        :param severity: (n_boids,n_rules) array
+        :param change: (n_boids,n_rules) array
+        :return: sequence of orientation changes
+        '''
+        return [logic.from_recommendations(list(zip(boid_severity,boid_change)))
+                for logic, boid_severity, boid_change in zip(logics,severity.tolist(),change.tolist())]
+
+
 class Priority(BaseLogic):
     def __init__(self,allowed_change):
         self.allowed_change = allowed_change
 
+
+    @classmethod
+    def from_recommendation_arrays(cls,logics,severity,change):
+        '''
+        Vectorised from_recommendations, giving identical results: each boid takes its rules in order of
+        decreasing severity (ties in rule order), applying changes until allowed_change is used up
+        '''
+        import numpy as np
+        n, n_rules = change.shape
+        allowed_changes = np.fromiter((logic.allowed_change for logic in logics),np.float64,len(logics))
+        order = np.argsort(-severity,axis=1,kind='stable')
+        change = np.take_along_axis(change,order,axis=1)
+        remaining = allowed_changes
+        total = np.zeros(n)
+        done = np.zeros(n,bool)
+        for rule in range(n_rules):
+            recommendation = change[:,rule]
+            size = np.abs(recommendation)
+            active = ~done & (recommendation != 0) & (remaining > 0)
+            clipped = active & (size > remaining)
+            unclipped = active & ~clipped
+            total += np.where(clipped, np.where(recommendation >= 0, remaining, -remaining),
+                              np.where(unclipped, recommendation, 0))
+            remaining = np.where(unclipped, remaining - size, remaining)
+            done |= clipped
+        return total
+
+
     def from_recommendations(self,recommendations):
         change = 0
         allowed_change_remaining = self.allowed_change
@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+
+from _boid import DEFAULT_VISION_RANGE, segment_intersection_distance
+from _boidkernels import segment_intersection_distances
+
+DEFAULT_CELL_SIZE = DEFAULT_VISION_RANGE
+
+
+def _turn(heading_x,heading_y,wall_x,wall_y):
+    '''
+    Signed angle in degrees (within +-90) to turn a heading by to run parallel to a wall
+    '''
+    cross = heading_x * wall_y - heading_y * wall_x
+    dot = heading_x * wall_x + heading_y * wall_y
+    if dot < 0:
+        cross, dot = -cross, -dot
+    return math.degrees(math.atan2(cross,dot))
+
+
+def _turns(heading_x,heading_y,wall_x,wall_y):
+    '''
+    Vectorised _turn
+    '''
+    cross = heading_x * wall_y - heading_y * wall_x
+    dot = heading_x * wall_x + heading_y * wall_y
+    flip = np.where(dot < 0,-1.0,1.0)
+    return np.degrees(np.arctan2(flip * cross,flip * dot))
+
+
+class ObstacleLayer:
+    def __init__(self,obstacles,cell_size=DEFAULT_CELL_SIZE):
+        '''
+        Static obstacles (walls and polygons) boids steer around. Their edges are indexed once, here, in a
+        grid of cells covering the obstacles, so each boid only tests its heading segment (the segment
+        check_for_collision uses, from its position to get_heading(False)) against the edges in the cells
+        that segment crosses. Obstacles are fixed in space and don't wrap around a collection's bounds.
+        Attach a layer with BoidCollection(obstacles=ObstacleLayer(...)) to add obstacle avoidance as a
+        fourth recommendation after avoidance, matching and centering.
+        :param obstacles: sequence of obstacles, each a sequence of (x,y) points; polygons are closed by
+            repeating their first point at the end, walls are just the points along them
+        :param cell_size: width of the grid cells
+        '''
+        segments = []
+        for points in obstacles:
+            points = [tuple(map(float,point)) for point in points]
+            segments.extend((a + b) for a, b in zip(points,points[1:]) if a != b)
+        self.cell_size = cell_size
+        self.segments = np.array(segments,np.float64).reshape(-1,4)
+        self._segments = [tuple(segment) for segment in segments]
+        if len(self.segments):
+            self.origin = (float(self.segments[:,0::2].min()),float(self.segments[:,1::2].min()))
+            self.shape = (int(math.floor((self.segments[:,0::2].max() - self.origin[0]) / cell_size)) + 1,
+                          int(math.floor((self.segments[:,1::2].max() - self.origin[1]) / cell_size)) + 1)
+        else:
+            self.origin = (0.0,0.0)
+            self.shape = (1,1)
+        segment_ids, cells = self._cells_crossed(self.segments[:,:2],self.segments[:,2:])
+        order = np.lexsort((segment_ids,cells))
+        self.cell_segments = segment_ids[order]
+        self.cell_starts = np.searchsorted(cells[order],np.arange(self.shape[0] * self.shape[1] + 1))
+        self._cell_lists = [self.cell_segments[start:end].tolist()
+                            for start, end in zip(self.cell_starts[:-1].tolist(),self.cell_starts[1:].tolist())]
+
+
+    def __len__(self):
+        return len(self.segments)
+
+
+    def _cells_crossed(self,starts,ends):
+        '''
+        Internal function, finds every grid cell each segment passes through (cells are clamped to the grid,
+        so cells at its edge also hold everything beyond them). Each segment is split into pieces no longer
+        than a cell, whose bounding boxes span at most 2x2 cells.
+        :param starts: (n,2) array of segment starts
+        :param ends: (n,2) array of segment ends
+        :return: (segment,cell) arrays of unique pairs
+        '''
+        n = len(starts)
+        if n == 0:
+            return np.zeros(0,np.intp), np.zeros(0,np.intp)
+        lengths = np.abs(ends - starts).max(axis=1)
+        pieces = max(1,int(math.ceil(lengths.max() / self.cell_size)))
+        fractions = np.linspace(0,1,pieces + 1)
+        points = starts[:,None,:] + fractions[None,:,None] * (ends - starts)[:,None,:]
+        x = np.clip(np.floor((points[:,:,0] - self.origin[0]) / self.cell_size),0,self.shape[0] - 1).astype(np.intp)
+        y = np.clip(np.floor((points[:,:,1] - self.origin[1]) / self.cell_size),0,self.shape[1] - 1).astype(np.intp)
+        cells = np.concatenate([x * self.shape[1] + y,
+                                x[:,1:] * self.shape[1] + y[:,:-1],
+                                x[:,:-1] * self.shape[1] + y[:,1:]],axis=1)
+        number_of_cells = self.shape[0] * self.shape[1]
+        pairs = np.unique((np.arange(n)[:,None] * number_of_cells + cells).ravel())
+        return pairs // number_of_cells, pairs % number_of_cells
+
+
+    def nearest_hits(self,starts,ends):
+        '''
+        Finds the nearest edge each segment meets
+        :param starts: (n,2) array of segment starts
+        :param ends: (n,2) array of segment ends
+        :return: (segments,edges,distances) arrays for each segment meeting an edge, with the edge it meets
+            closest to its start and the distance from its start
+        '''
+        segment_ids, cells = self._cells_crossed(starts,ends)
+        counts = self.cell_starts[cells + 1] - self.cell_starts[cells]
+        segment_ids = np.repeat(segment_ids,counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,counts)
+        edges = self.cell_segments[np.repeat(self.cell_starts[cells],counts) + offsets]
+        pairs = np.unique(segment_ids * max(1,len(self.segments)) + edges)
+        segment_ids, edges = pairs // max(1,len(self.segments)), pairs % max(1,len(self.segments))
+        walls = self.segments[edges]
+        distances = segment_intersection_distances(starts[segment_ids,0],starts[segment_ids,1],
+                                                   ends[segment_ids,0],ends[segment_ids,1],
+                                                   walls[:,0],walls[:,1],walls[:,2],walls[:,3])
+        hit = ~np.isnan(distances)
+        segment_ids, edges, distances = segment_ids[hit], edges[hit], distances[hit]
+        order = np.lexsort((edges,distances,segment_ids))
+        segment_ids, first = np.unique(segment_ids[order],return_index=True)
+        return segment_ids, edges[order][first], distances[order][first]
+
+
+    def nearest_hit(self,start,end):
+        '''
+        Scalar nearest_hits for a single segment
+        :param start: (x,y) segment start
+        :param end: (x,y) segment end
+        :return: (distance,edge) of the nearest edge the segment meets, or None
+        '''
+        pieces = max(1,int(math.ceil(max(abs(end[0] - start[0]),abs(end[1] - start[1])) / self.cell_size)))
+        columns, rows = self.shape
+        cells = []
+        for piece in range(pieces + 1):
+            fraction = piece / pieces
+            x = (start[0] + fraction * (end[0] - start[0]) - self.origin[0]) / self.cell_size
+            y = (start[1] + fraction * (end[1] - start[1]) - self.origin[1]) / self.cell_size
+            cells.append((min(max(int(math.floor(x)),0),columns - 1),min(max(int(math.floor(y)),0),rows - 1)))
+        edges = set()
+        for (x1, y1), (x2, y2) in zip(cells,cells[1:]):
+            for x, y in ((x1,y1),(x2,y2),(x2,y1),(x1,y2)):
+                edges.update(self._cell_lists[x * rows + y])
+        nearest = None
+        for edge in sorted(edges):
+            x1, y1, x2, y2 = self._segments[edge]
+            distance = segment_intersection_distance(start,end,(x1,y1),(x2,y2))
+            if distance is not None and (nearest is None or distance < nearest[0]):
+                nearest = (distance,edge)
+        return nearest
+
+
+    def recommendation(self,boid):
+        '''
+        Obstacle avoidance for one boid: if its heading segment meets an edge, turn to run parallel to the
+        nearest one, with severity 1/distance as for collisions between boids
+        :return: recommendation (severity,change_direction)
+        '''
+        heading = boid.get_heading(False)
+        hit = self.nearest_hit(boid.position,heading)
+        if hit is None:
+            return (0,0)
+        distance, edge = hit
+        x1, y1, x2, y2 = self._segments[edge]
+        turn = _turn(heading[0] - boid.position[0],heading[1] - boid.position[1],x2 - x1,y2 - y1)
+        return (1/(distance+0.0001),turn)
+
+
+    def recommendations(self,arrays,neighbours=None,bounds=None):
+        '''
+        Vectorised recommendation for every array-backed boid; a rule for _boidarrays.recommendations
+        (given a chunk of neighbour lists, only its rows are filled in)
+        :return: (severity,change) arrays
+        '''
+        n = len(arrays)
+        severity = np.zeros(n)
+        change = np.zeros(n)
+        if n == 0 or not len(self.segments):
+            return severity, change
+        rows = slice(0,n) if neighbours is None else slice(neighbours.start,neighbours.stop)
+        positions = arrays.positions[rows]
+        angles = np.pi * arrays.orientations[rows] / 180
+        vision_ranges = arrays.vision_ranges[rows]
+        headings = np.stack((vision_ranges * np.cos(angles),vision_ranges * np.sin(angles)),axis=1)
+        boids, edges, distances = self.nearest_hits(positions,positions + headings)
+        walls = self.segments[edges]
+        severity[rows.start + boids] = 1/(distances+0.0001)
+        change[rows.start + boids] = _turns(headings[boids,0],headings[boids,1],
+                                            walls[:,2] - walls[:,0],walls[:,3] - walls[:,1])
+        return severity, change
+
+
+    def line_vertices(self):
+        '''
+        :return: flat list of (x1,y1,x2,y2) for every edge, for drawing as GL_LINES
+        '''
+        return self.segments.ravel().tolist()
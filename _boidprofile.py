@@ -0,0 +1,120 @@
+import collections
+import contextlib
+import threading
+import time
+
+DEFAULT_WINDOW = 120
+
+
+class TickProfiler:
+    def __init__(self,window=DEFAULT_WINDOW,callback=None):
+        '''
+        Collects per-phase timings and counters for each tick of a BoidCollection.
+        Attach it with BoidCollection(profiler=TickProfiler()) or by setting collection.profiler;
+        with no profiler attached, the tick only pays for an `is None` check per phase.
+
+        Scalar phases: index, displacements, nearby, vision, avoidance, matching, centering, arbitration,
+        movement, vertices. Array-backed phases: candidates (only on ticks rebuilding the Verlet list), vision,
+        avoidance, matching, centering, arbitration, movement, vertices (and shards for sharded flocks).
+        Array-backed flocks with workers time their rules together as recommendations.
+        Either mode adds recording when a TrajectoryRecorder is attached.
+        Counters: boids, neighbours, collision_checks, candidate_pairs, candidate_rebuilds, index_rebuilds,
+        displacement_rebuilds, neighbour_rebuilds.
+        Times and counts can be added from several threads at once (as the workers deciding a tick do).
+
+        :param window: number of ticks kept for rolling statistics
+        :param callback: optional function called with each tick's record as it ends
+        '''
+        self.history = collections.deque(maxlen=window)
+        self.callback = callback
+        self.ticks = 0
+        self._lock = threading.Lock()
+        self._start_tick()
+
+
+    def _start_tick(self):
+        '''
+        Internal function, starts collecting a new tick
+        '''
+        self.times = {}
+        self.counts = {}
+
+
+    def add_time(self,name,seconds):
+        '''
+        Adds time spent in a phase during the current tick
+        '''
+        with self._lock:
+            self.times[name] = self.times.get(name,0) + seconds
+
+
+    def count(self,name,amount=1):
+        '''
+        Adds to a counter for the current tick
+        '''
+        with self._lock:
+            self.counts[name] = self.counts.get(name,0) + amount
+
+
+    @contextlib.contextmanager
+    def phase(self,name):
+        '''
+        Context manager timing a phase of the current tick
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name,time.perf_counter() - start)
+
+
+    def end_tick(self):
+        '''
+        Finishes the current tick, stores it for rolling statistics and passes it to the callback
+        :return: record dict of tick number, times (seconds per phase) and counts
+        '''
+        record = {'tick':self.ticks,'times':self.times,'counts':self.counts}
+        self.history.append(record)
+        self.ticks += 1
+        self._start_tick()
+        if self.callback is not None:
+            self.callback(record)
+        return record
+
+
+    def stats(self):
+        '''
+        Rolling statistics over the stored ticks (phases missing from a tick count as 0)
+        :return: {'ticks':n, 'times':{phase:stat}, 'counts':{counter:stat}} where each stat is a dict of
+        mean, min, max and last
+        '''
+        stats = {'ticks':len(self.history)}
+        for kind in ('times','counts'):
+            names = {name for record in self.history for name in record[kind]}
+            stats[kind] = {}
+            for name in sorted(names):
+                values = [record[kind].get(name,0) for record in self.history]
+                stats[kind][name] = {'mean':sum(values) / len(values),'min':min(values),
+                                     'max':max(values),'last':values[-1]}
+        return stats
+
+
+    def reset(self):
+        '''
+        Forgets every stored tick
+        '''
+        self.history.clear()
+        self._start_tick()
+
+
+def timed(profiler,name,function,*args):
+    '''
+    Calls function(*args), timing it as a phase if profiler is not None
+    :return: the function's result
+    '''
+    if profiler is None:
+        return function(*args)
+    start = time.perf_counter()
+    result = function(*args)
+    profiler.add_time(name,time.perf_counter() - start)
+    return result
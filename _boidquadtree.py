@@ -0,0 +1,235 @@
+import math
+
+import numpy as np
+
+from _boidarrays import recommendations_avoidance
+from _boidkernels import find_shortest_paths, angles_between_vectors
+
+DEFAULT_THETA = 0
+DEFAULT_LEAF_SIZE = 8
+# neighbour_range for collections using ApproximateRules, within which avoidance still checks every boid
+DEFAULT_AVOIDANCE_RANGE = 30
+
+
+class FlockTree:
+    def __init__(self,positions,bounds,leaf_size=DEFAULT_LEAF_SIZE):
+        '''
+        Quadtree over toroidal bounds storing, for every node, the number of boids in it, the sum of their
+        positions (for the centre of mass) and the highest index of its boids (for matching, which follows
+        the last neighbour in index order). Each level is a grid halving the cells of the one above, with
+        nodes stored as flat arrays indexed by cell, so the whole tree is built with a bincount per level.
+        Nodes never straddle the bounds, so their centres of mass need no wrapping.
+        :param positions: (n,2) array of positions inside bounds
+        :param bounds: (xmin,xmax,ymin,ymax) boundaries
+        :param leaf_size: average number of boids per leaf the depth is chosen for
+        '''
+        n = len(positions)
+        self.bounds = bounds
+        self.positions = positions
+        self.depth = max(1,int(math.ceil(math.log(max(n,1) / leaf_size,4)))) if n > leaf_size else 1
+        side = 1 << self.depth
+        self.width = bounds[1] - bounds[0]
+        self.height = bounds[3] - bounds[2]
+        column = np.clip(((positions[:,0] - bounds[0]) * (side / self.width)).astype(np.intp),0,side - 1)
+        row = np.clip(((positions[:,1] - bounds[2]) * (side / self.height)).astype(np.intp),0,side - 1)
+        self.levels = []
+        for level in range(self.depth + 1):
+            shift = self.depth - level
+            cells = ((column >> shift) << level) + (row >> shift)
+            size = 1 << (2 * level)
+            self.levels.append({'count':np.bincount(cells,minlength=size),
+                                'x':np.bincount(cells,weights=positions[:,0],minlength=size),
+                                'y':np.bincount(cells,weights=positions[:,1],minlength=size)})
+        # boids of each leaf, in index order
+        leaves = (column << self.depth) + row
+        self.leaf_boids = np.argsort(leaves,kind='stable')
+        self.leaf_starts = np.searchsorted(leaves[self.leaf_boids],np.arange((1 << (2 * self.depth)) + 1))
+        # highest index in each leaf is its last boid, and each node's is the highest of its four children's
+        last = np.where(self.leaf_starts[1:] > self.leaf_starts[:-1],
+                        self.leaf_boids[np.maximum(self.leaf_starts[1:] - 1,0)] if n else 0,-1)
+        for level in range(self.depth,-1,-1):
+            self.levels[level]['last'] = last
+            side = 1 << level
+            last = last.reshape(side // 2,2,side // 2,2).max(axis=(1,3)).ravel() if level else last
+
+
+    def aggregate(self,boids,orientations,vision_ranges,cos_vision_angles,theta=DEFAULT_THETA):
+        '''
+        Sums over the boids each given boid can see (closer than vision_range and within vision_angle of
+        its heading, as find_neighbours), walking down from the root. A node lying wholly inside a boid's
+        view is summed as a whole, which is exact; one wholly outside is skipped. A node straddling the
+        edge of the view is taken as a whole, seen or not by its centre of mass, if its size is less than
+        theta times its distance from the boid (as in Barnes-Hut), otherwise it is opened, down to the boids
+        in the leaves. theta=0 gives exact sums.
+        :param boids: indices of the boids to aggregate for
+        :param orientations: orientation in degrees of every boid in the tree
+        :param vision_ranges: vision_range of every boid in the tree
+        :param cos_vision_angles: cosine of the vision_angle (capped at 180) of every boid in the tree
+        :param theta: accuracy parameter, larger is faster and less accurate
+        :return: (count,dx,dy,last) arrays for the given boids: number of boids seen, sums of their wrapped
+            displacements and the highest index seen (-1 if none)
+        '''
+        xmin, xmax, ymin, ymax = self.bounds
+        n = len(boids)
+        totals = [np.zeros(n) for _ in range(3)]
+        last = np.full(n,-1,np.intp)
+        angles = np.pi * orientations[boids] / 180
+        heading_x, heading_y = np.cos(angles), np.sin(angles)
+        vision_ranges = vision_ranges[boids]
+        cos_vision_angles = cos_vision_angles[boids]
+        vision_angles = np.arccos(cos_vision_angles)
+        px, py = self.positions[boids,0], self.positions[boids,1]
+
+        def add(query,count,dx,dy,highest,test=True):
+            # nodes or boids are seen by their (centre of mass) displacement from the boid
+            if test:
+                distances = np.sqrt(dx ** 2 + dy ** 2)
+                seen = (distances < vision_ranges[query]) & \
+                       (dx * heading_x[query] + dy * heading_y[query] >= cos_vision_angles[query] * distances)
+                query, count, dx, dy, highest = query[seen], count[seen], dx[seen], dy[seen], highest[seen]
+            for total, values in zip(totals,(count,dx * count,dy * count)):
+                total += np.bincount(query,weights=values,minlength=n)
+            np.maximum.at(last,query,highest)
+
+        def add_nodes(nodes,query,cells,test=True):
+            count = nodes['count'][cells]
+            add(query,count,
+                find_shortest_paths(px[query],nodes['x'][cells] / count,xmax,xmin),
+                find_shortest_paths(py[query],nodes['y'][cells] / count,ymax,ymin),
+                nodes['last'][cells],test)
+
+        # (query,cell) pairs still to visit, starting from the root
+        query = np.arange(n)
+        cells = np.zeros(n,np.intp)
+        for level in range(self.depth + 1):
+            nodes = self.levels[level]
+            side = 1 << level
+            size_x, size_y = self.width / side, self.height / side
+            radius = math.sqrt(size_x ** 2 + size_y ** 2) / 2
+            keep = nodes['count'][cells] > 0
+            query, cells = query[keep], cells[keep]
+            column, row = cells >> level, cells & (side - 1)
+            # displacement from each boid to the centre of each node, and to its nearest point, across the bounds
+            centre_x = find_shortest_paths(px[query],xmin + (column + 0.5) * size_x,xmax,xmin)
+            centre_y = find_shortest_paths(py[query],ymin + (row + 0.5) * size_y,ymax,ymin)
+            gaps = np.sqrt(np.maximum(0,np.abs(centre_x) - size_x / 2) ** 2 +
+                           np.maximum(0,np.abs(centre_y) - size_y / 2) ** 2)
+            # the angles from the heading to the node's centre, and either side of it to the node's corners
+            centres = np.sqrt(centre_x ** 2 + centre_y ** 2)
+            spread = np.arcsin(np.minimum(1,radius / np.maximum(centres,1e-12)))
+            bearing = np.arccos(np.clip((centre_x * heading_x[query] + centre_y * heading_y[query]) /
+                                        np.maximum(centres,1e-12),-1,1))
+            keep = (gaps < vision_ranges[query]) & ((bearing - spread <= vision_angles[query]) | (gaps == 0))
+            query, cells, column, row, gaps, centres, spread, bearing = (
+                values[keep] for values in (query,cells,column,row,gaps,centres,spread,bearing))
+            whole = (gaps > 0) & (centres + radius < vision_ranges[query]) & \
+                    ((bearing + spread < vision_angles[query]) | (vision_angles[query] >= np.pi))
+            if whole.any():
+                add_nodes(nodes,query[whole],cells[whole],False)
+            far = ~whole & (gaps > 0) & (max(size_x,size_y) < theta * gaps)
+            if far.any():
+                add_nodes(nodes,query[far],cells[far])
+            opened = ~(whole | far)
+            query, column, row = query[opened], column[opened], row[opened]
+            if level < self.depth:
+                query = np.repeat(query,4)
+                column = 2 * np.repeat(column,4) + np.tile((0,0,1,1),len(column))
+                row = 2 * np.repeat(row,4) + np.tile((0,1,0,1),len(row))
+                cells = (column << (level + 1)) + row
+            else:
+                cells = (column << level) + row
+        # open the remaining leaves into their boids
+        counts = self.leaf_starts[cells + 1] - self.leaf_starts[cells]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,counts)
+        others = self.leaf_boids[np.repeat(self.leaf_starts[cells],counts) + offsets]
+        query = np.repeat(query,counts)
+        distinct = others != boids[query]
+        query, others = query[distinct], others[distinct]
+        add(query,np.ones(len(query)),
+            find_shortest_paths(px[query],self.positions[others,0],xmax,xmin),
+            find_shortest_paths(py[query],self.positions[others,1],ymax,ymin),
+            others)
+        return tuple(totals) + (last,)
+
+
+class ApproximateRules:
+    def __init__(self,theta=DEFAULT_THETA,leaf_size=DEFAULT_LEAF_SIZE):
+        '''
+        Velocity matching and flock centering from a FlockTree, for array-backed flocks whose ticks only find
+        neighbours close enough to avoid:
+        BoidCollection(array_backed=True,rules=ApproximateRules().rules(),neighbour_range=DEFAULT_AVOIDANCE_RANGE)
+        The tree finds the boids each boid sees out to its vision_range, summing whole nodes where it can, so
+        the costly vision_range neighbour search of a tick is replaced by a short one for avoidance (see
+        benchmark.py --approximation). Centering follows recommendations_centering with the neighbours'
+        summed displacements taken from the tree, and matching follows recommendations_matching with the
+        neighbour count and the last neighbour (highest index) taken from it; with theta=0 both are exact.
+        Larger theta also takes nodes straddling the edge of a boid's view as a whole, counting its last boid
+        as seen if its centre of mass is.
+        :param theta: accuracy parameter of FlockTree.aggregate, 0 is exact
+        :param leaf_size: average number of boids per leaf
+        '''
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self._cache = None
+
+
+    def rules(self):
+        '''
+        :return: (name,function) rules replacing matching and centering in DEFAULT_RULES
+        '''
+        return (('avoidance',recommendations_avoidance),
+                ('matching',self.recommendations_matching),
+                ('centering',self.recommendations_centering))
+
+
+    def aggregate(self,arrays,neighbours=None,bounds=None):
+        '''
+        FlockTree.aggregate for every boid (or the rows of a chunk of neighbour lists). Both rules call this
+        with the same neighbour lists in a tick, so the result is kept for the second.
+        :return: (rows,(count,dx,dy,last))
+        '''
+        if self._cache is not None and self._cache[0] is neighbours and neighbours is not None:
+            return self._cache[1]
+        n = len(arrays)
+        rows = slice(0,n) if neighbours is None else slice(neighbours.start,neighbours.stop)
+        tree = FlockTree(arrays.positions,bounds,self.leaf_size)
+        cos_vision_angles = np.cos(np.pi * np.minimum(arrays.vision_angles,180) / 180)
+        result = rows, tree.aggregate(np.arange(n)[rows],arrays.orientations,arrays.vision_ranges,
+                                      cos_vision_angles,self.theta)
+        self._cache = (neighbours,result)
+        return result
+
+
+    def recommendations_matching(self,arrays,neighbours,bounds):
+        '''
+        recommendations_matching from the tree's neighbour counts and last neighbours
+        :return: (severity,change) arrays
+        '''
+        rows, (count, dx, dy, last) = self.aggregate(arrays,neighbours,bounds)
+        orientations = arrays.orientations
+        change = np.zeros(len(arrays))
+        seen = count > 0
+        delta_orientation = orientations[last[seen]] - orientations[rows][seen]
+        delta_orientation = np.where(delta_orientation <= 180, delta_orientation, delta_orientation - 360)
+        matching = np.zeros(len(count))
+        matching[seen] = delta_orientation / count[seen]
+        change[rows] = matching
+        return np.abs(change), change
+
+
+    def recommendations_centering(self,arrays,neighbours,bounds):
+        '''
+        recommendations_centering from the tree's summed displacements
+        :return: (severity,change) arrays
+        '''
+        rows, (count, dx, dy, last) = self.aggregate(arrays,neighbours,bounds)
+        n = len(arrays)
+        severity = np.zeros(n)
+        change = np.zeros(n)
+        average_x = dx / (count + 1)
+        average_y = dy / (count + 1)
+        orientation_position = np.where(average_y >= 0, 1, -1) * angles_between_vectors(1.0, 0.0, average_x, average_y)
+        seen = count > 0
+        severity[rows] = np.where(seen, np.sqrt(average_x ** 2 + average_y ** 2) * 10, 0)
+        change[rows] = np.where(seen, orientation_position - arrays.orientations[rows], 0)
+        return severity, change
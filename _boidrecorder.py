@@ -0,0 +1,194 @@
+import json
+import struct
+
+import numpy as np
+
+from _boidsnapshot import ALIGNMENT
+
+MAGIC = b'BOIDTRAJ'
+VERSION = 1
+DEFAULT_DTYPE = 'float32'
+DEFAULT_CHUNK_FRAMES = 256
+# the number of frames written is kept at a fixed offset so it can be updated as the file grows
+FRAMES_OFFSET = len(MAGIC)
+
+
+def frame_dtype(dtype,count):
+    '''
+    One frame of a trajectory: positions and orientations of count boids
+    :param dtype: float dtype the values are stored as ('float16', 'float32' or 'float64')
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    return np.dtype([('positions',dtype,(count,2)),('orientations',dtype,(count,))])
+
+
+class TrajectoryRecorder:
+    def __init__(self,path,stride=1,dtype=DEFAULT_DTYPE,chunk_frames=DEFAULT_CHUNK_FRAMES):
+        '''
+        Records the positions and orientations of a flock to a file as it ticks.
+        Attach it with BoidCollection(recorder=TrajectoryRecorder(path)) or by setting collection.recorder;
+        a frame is then written after every stride ticks. The file grows chunk_frames frames at a time and
+        each chunk is written through a memory map, so recording never holds more than a chunk in memory.
+        The flock must keep the same boids while recording (adding or removing one raises ValueError).
+
+        File layout: MAGIC, the number of frames (uint64), the length of a JSON header (uint32), the header
+        (dtype, stride, boid count and handles), then the frames, starting at a multiple of ALIGNMENT bytes.
+
+        :param path: file to write
+        :param stride: ticks between frames
+        :param dtype: float dtype to store values as; float16 quarters the size of a float64 recording but
+            only keeps 11 significant bits (positions in a 640x480 window to within 0.25)
+        :param chunk_frames: frames preallocated at a time
+        '''
+        if stride < 1 or chunk_frames < 1:
+            raise ValueError('stride and chunk_frames must be positive')
+        self.path = path
+        self.stride = stride
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.chunk_frames = chunk_frames
+        self.ticks = 0
+        self.frames = 0
+        self.file = None
+        self.chunk = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+
+    def record(self,collection):
+        '''
+        Counts a tick of collection, writing a frame every stride ticks (BoidCollection.tick calls this)
+        '''
+        self.ticks += 1
+        if self.ticks % self.stride == 0:
+            self.write_frame(collection)
+
+
+    def write_frame(self,collection):
+        '''
+        Writes the current positions and orientations of collection's boids (in handle order) as a frame
+        '''
+        if self.file is None:
+            self._start(collection)
+        elif len(collection.handles) != len(self.handles) or collection._next_handle != self.next_handle:
+            raise ValueError('boids were added or removed while recording')
+        if self.frames % self.chunk_frames == 0:
+            self._map_chunk()
+        frame = self.chunk[self.frames % self.chunk_frames]
+        collection.sync()
+        if collection.array_backed:
+            frame['positions'] = collection.arrays.positions[self.rows]
+            frame['orientations'] = collection.arrays.orientations[self.rows]
+        else:
+            boids = collection.handles.values()
+            frame['positions'] = [boid.position for boid in boids]
+            frame['orientations'] = [boid.orientation for boid in boids]
+        self.frames += 1
+
+
+    def _start(self,collection):
+        '''
+        Internal function, creates the file and writes its header
+        '''
+        self.handles = list(collection.handles)
+        if not self.handles:
+            raise ValueError('can not record an empty flock')
+        self.next_handle = collection._next_handle
+        if collection.array_backed:
+            self.rows = np.array([boid._index for boid in collection.handles.values()],np.intp)
+        self.frame_dtype = frame_dtype(self.dtype,len(self.handles))
+        header = {'version':VERSION,'dtype':self.dtype.str,
+                  'stride':self.stride,'count':len(self.handles),'handles':self.handles}
+        encoded = json.dumps(header).encode()
+        start = FRAMES_OFFSET + 8 + 4 + len(encoded)
+        encoded += b' ' * (-start % ALIGNMENT)
+        self.data_offset = start + (-start % ALIGNMENT)
+        self.file = open(self.path,'w+b')
+        self.file.write(MAGIC)
+        self.file.write(struct.pack('<QI',0,len(encoded)))
+        self.file.write(encoded)
+
+
+    def _map_chunk(self):
+        '''
+        Internal function, grows the file by a chunk and maps it
+        '''
+        self.flush()
+        start = self.data_offset + self.frames * self.frame_dtype.itemsize
+        self.file.truncate(start + self.chunk_frames * self.frame_dtype.itemsize)
+        self.chunk = np.memmap(self.file,self.frame_dtype,'r+',start,(self.chunk_frames,))
+
+
+    def flush(self):
+        '''
+        Writes frames so far to disk, so readers (even after a crash) see them
+        '''
+        if self.chunk is not None:
+            self.chunk.flush()
+        if self.file is not None:
+            self.file.seek(FRAMES_OFFSET)
+            self.file.write(struct.pack('<Q',self.frames))
+            self.file.flush()
+
+
+    def close(self):
+        '''
+        Flushes the recording and trims the unused end of the last chunk
+        '''
+        if self.file is None:
+            return
+        self.flush()
+        self.chunk = None
+        self.file.truncate(self.data_offset + self.frames * self.frame_dtype.itemsize)
+        self.file.close()
+        self.file = None
+
+
+class TrajectoryReader:
+    def __init__(self,path):
+        '''
+        Reads a recording made by TrajectoryRecorder. The frames are memory-mapped, so reading frame k or
+        iterating over the frames only loads those frames from disk.
+        Frame k holds the flock after tick (k + 1) * stride of the recording.
+        :param path: file written by TrajectoryRecorder
+        '''
+        with open(path,'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a boid trajectory'.format(path))
+            frames, length = struct.unpack('<QI',f.read(12))
+            header = json.loads(f.read(length).decode())
+            offset = f.tell()
+        if header['version'] != VERSION:
+            raise ValueError('unsupported trajectory version {}'.format(header['version']))
+        self.path = path
+        self.stride = header['stride']
+        self.handles = header['handles']
+        self.dtype = np.dtype(header['dtype'])
+        dtype = frame_dtype(self.dtype,header['count'])
+        # empty files can't be memory-mapped
+        self.frames = np.memmap(path,dtype,'r',offset,(frames,)) if frames else np.zeros(0,dtype)
+
+
+    def __len__(self):
+        return len(self.frames)
+
+
+    def __getitem__(self,k):
+        '''
+        :return: (positions,orientations) of frame k, read-only arrays of shape (n,2) and (n,)
+        '''
+        frame = self.frames[k]
+        return frame['positions'], frame['orientations']
+
+
+    def __iter__(self):
+        '''
+        Generates (positions,orientations) for each frame in turn
+        '''
+        for k in range(len(self.frames)):
+            yield self[k]
@@ -0,0 +1,239 @@
+import multiprocessing
+
+import numpy as np
+
+from _boidarrays import BoidArrays, find_neighbours, recommendations, arbitrate, apply_changes
+
+DEFAULT_SHARDS = (2,2)
+
+
+def _concatenate(fields_list):
+    '''
+    Joins several dicts of field arrays (from BoidArrays.get_fields, plus 'ids' and 'logics') row-wise
+    '''
+    return {name:np.concatenate([fields[name] for fields in fields_list]) for name in fields_list[0]}
+
+
+def _take(fields,selection):
+    '''
+    Selects rows from a dict of field arrays
+    '''
+    return {name:array[selection] for name, array in fields.items()}
+
+
+class Tiling:
+    def __init__(self,bounds,shards):
+        '''
+        Splits toroidal bounds into a grid of equal rectangular tiles
+        :param bounds: (xmin,xmax,ymin,ymax) boundaries
+        :param shards: (columns,rows) of tiles
+        '''
+        self.bounds = bounds
+        self.columns, self.rows = shards
+        self.tile_width = (bounds[1] - bounds[0]) / self.columns
+        self.tile_height = (bounds[3] - bounds[2]) / self.rows
+
+
+    def __len__(self):
+        return self.columns * self.rows
+
+
+    def tile_of(self,positions):
+        '''
+        Finds the tile owning each position (positions outside the bounds wrap)
+        :param positions: (n,2) array of positions
+        :return: array of tile numbers
+        '''
+        column = np.floor((positions[:,0] - self.bounds[0]) / self.tile_width).astype(np.int64) % self.columns
+        row = np.floor((positions[:,1] - self.bounds[2]) / self.tile_height).astype(np.int64) % self.rows
+        return column * self.rows + row
+
+
+    def distance_to_tile(self,positions,tile):
+        '''
+        Toroidal distance along each axis from each position to the nearest point of a tile
+        :return: (dx,dy) arrays, zero inside the tile
+        '''
+        column, row = divmod(tile,self.rows)
+        distances = []
+        for axis, start, size in ((0,self.bounds[0] + column * self.tile_width,self.tile_width),
+                                  (1,self.bounds[2] + row * self.tile_height,self.tile_height)):
+            width = self.bounds[2 * axis + 1] - self.bounds[2 * axis]
+            offset = positions[:,axis] - (start + size / 2)
+            offset = offset - width * np.round(offset / width)
+            distances.append(np.maximum(0,np.abs(offset) - size / 2))
+        return distances
+
+
+    def near_tile(self,positions,tile,halo):
+        '''
+        :return: boolean mask of positions within halo of a tile (along both axes)
+        '''
+        dx, dy = self.distance_to_tile(positions,tile)
+        return (dx < halo) & (dy < halo)
+
+
+    def near_edge(self,positions,tile,halo):
+        '''
+        :return: boolean mask of positions inside a tile but within halo of its edges
+        '''
+        column, row = divmod(tile,self.rows)
+        x = positions[:,0] - (self.bounds[0] + column * self.tile_width)
+        y = positions[:,1] - (self.bounds[2] + row * self.tile_height)
+        return (np.minimum(x,self.tile_width - x) < halo) | (np.minimum(y,self.tile_height - y) < halo)
+
+
+def _worker(connection,tiling,tile,tolerance,dtype,halo,rules,neighbour_range,kernels):
+    '''
+    Worker process owning the boids in one tile. Each 'tick' message brings boids migrating into the tile
+    and the halo of other tiles' border boids; the reply holds the boids that left, this tile's border and,
+    if asked for, the edges of the neighbour graph starting at this tile's boids (as pairs of ids).
+    Boids move with the kernel backend registered as kernels.
+    '''
+    own = None
+    while True:
+        message = connection.recv()
+        command = message[0]
+        if command == 'load':
+            own = message[1]
+        elif command == 'tick':
+            immigrants, halo_fields, send_edges = message[1], message[2], message[3]
+            own = _concatenate([own,immigrants])
+            local = _concatenate([own,halo_fields])
+            # index order must match the single-process collection, where rows are ordered by id
+            order = np.argsort(local['ids'],kind='stable')
+            is_own = order < len(own['ids'])
+            arrays = BoidArrays.from_fields(_take(local,order))
+            neighbours = find_neighbours(arrays,tiling.bounds,dtype,radii=neighbour_range)
+            severity, change = recommendations(arrays,neighbours,tiling.bounds,rules=rules)
+            edges = None
+            if send_edges:
+                ids = local['ids'][order]
+                rows = neighbours.rows
+                starting_here = is_own[rows]
+                edges = (ids[rows[starting_here]],ids[neighbours.indices[starting_here]])
+            own_arrays = BoidArrays.from_fields(_take(local,order[is_own]))
+            changes = arbitrate(local['logics'][order[is_own]].tolist(),severity[is_own],change[is_own])
+            apply_changes(own_arrays,changes,tiling.bounds,tolerance,kernels)
+            own = own_arrays.get_fields()
+            own['ids'] = local['ids'][order[is_own]]
+            own['logics'] = local['logics'][order[is_own]]
+            leaving = tiling.tile_of(own['positions']) != tile
+            emigrants = _take(own,leaving)
+            own = _take(own,~leaving)
+            connection.send((emigrants,_take(own,tiling.near_edge(own['positions'],tile,halo)),edges))
+        elif command == 'gather':
+            connection.send(own)
+        elif command == 'stop':
+            connection.close()
+            return
+
+
+class ShardedFlock:
+    def __init__(self,bounds,tolerance,dtype='float64',shards=DEFAULT_SHARDS,rules=None,neighbour_range=None,
+                 kernels=None):
+        '''
+        Runs an array-backed flock across worker processes, one per tile of the bounds. Each worker keeps
+        its tile's boids between ticks; every tick the border boids within halo (the largest vision_range,
+        or neighbour_range if larger) of a tile are copied to it, and boids that crossed a tile edge migrate
+        to their new owner.
+        Workers order their rows by id and arbitrate with each boid's own logic (which travels with it), so
+        ticks give the same results as a single-process collection whose rows are in id order.
+        :param bounds: (xmin,xmax,ymin,ymax) boundaries
+        :param tolerance: tolerance for being on boundary
+        :param dtype: float dtype for displacements
+        :param shards: (columns,rows) of tiles, one worker process each
+        :param rules: recommendation rules, as for _boidarrays.recommendations
+        :param neighbour_range: radius workers find neighbours within in place of vision_range, as for
+            BoidCollection (the halo still covers vision_range, for rules looking further)
+        :param kernels: name of the kernel backend boids move with (default None: NumPy), found in the workers'
+            registry of _boidbackends
+        '''
+        self.tiling = Tiling(bounds,shards)
+        self.tolerance = tolerance
+        self.dtype = dtype
+        self.rules = rules
+        self.neighbour_range = neighbour_range
+        self.kernels = kernels
+        self.connections = []
+        self.processes = []
+
+
+    @property
+    def running(self):
+        return bool(self.processes)
+
+
+    def start(self,fields):
+        '''
+        Splits the flock between new worker processes
+        :param fields: dict of field arrays (BoidArrays.get_fields) with an 'ids' array and a 'logics' object
+            array of each boid's (picklable) logic
+        '''
+        self.stop()
+        self.halo = float(fields['vision_ranges'].max()) if len(fields['ids']) else 0
+        if self.neighbour_range is not None:
+            self.halo = max(self.halo,float(self.neighbour_range))
+        context = multiprocessing.get_context()
+        tiles = self.tiling.tile_of(fields['positions'])
+        self.immigrants = []
+        borders = []
+        for tile in range(len(self.tiling)):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_worker,args=(worker_connection,self.tiling,tile,self.tolerance,
+                                                           self.dtype,self.halo,self.rules,
+                                                           self.neighbour_range,self.kernels),daemon=True)
+            process.start()
+            own = _take(fields,tiles == tile)
+            connection.send(('load',own))
+            self.connections.append(connection)
+            self.processes.append(process)
+            self.immigrants.append(_take(fields,np.zeros(len(tiles),bool)))
+            borders.append(_take(own,self.tiling.near_edge(own['positions'],tile,self.halo)))
+        self.borders = _concatenate(borders)
+        self.border_tiles = self.tiling.tile_of(self.borders['positions'])
+
+
+    def tick(self,edges=False):
+        '''
+        Ticks every worker once, exchanging halos and migrating boids
+        :param edges: also collect the neighbour graph the workers found this tick
+        :return: (rows,columns) arrays of edges as ids, one for each boid seeing another, if edges, else None
+        '''
+        for tile, connection in enumerate(self.connections):
+            near = self.tiling.near_tile(self.borders['positions'],tile,self.halo) & (self.border_tiles != tile)
+            connection.send(('tick',self.immigrants[tile],_take(self.borders,near),edges))
+        replies = [connection.recv() for connection in self.connections]
+        emigrants = _concatenate([reply[0] for reply in replies])
+        destinations = self.tiling.tile_of(emigrants['positions'])
+        self.immigrants = [_take(emigrants,destinations == tile) for tile in range(len(self.tiling))]
+        # boids that just migrated aren't in any worker's border yet, but other tiles may still need them
+        self.borders = _concatenate([reply[1] for reply in replies] + [emigrants])
+        self.border_tiles = self.tiling.tile_of(self.borders['positions'])
+        if edges:
+            return (np.concatenate([reply[2][0] for reply in replies]),
+                    np.concatenate([reply[2][1] for reply in replies]))
+        return None
+
+
+    def gather(self):
+        '''
+        Collects every boid from the workers
+        :return: dict of field arrays with 'ids' and 'logics' arrays, sorted by id
+        '''
+        for connection in self.connections:
+            connection.send(('gather',))
+        fields = _concatenate([connection.recv() for connection in self.connections] + self.immigrants)
+        return _take(fields,np.argsort(fields['ids'],kind='stable'))
+
+
+    def stop(self):
+        '''
+        Shuts down the worker processes
+        '''
+        for connection in self.connections:
+            connection.send(('stop',))
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,100 @@
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'BOIDSNAP'
+VERSION = 2
+ALIGNMENT = 16
+
+# the fields of each boid's little-endian record, stored in the file as one column per field
+RECORD_DTYPE = np.dtype([('handle','<i8'),
+                         ('species','<i4'),
+                         ('position','<f8',(2,)),
+                         ('orientation','<f8'),
+                         ('speed','<f8'),
+                         ('vision_range','<f8'),
+                         ('vision_angle','<f8'),
+                         ('length','<f8'),
+                         ('width','<f8'),
+                         ('colour','u1',(3,))])
+
+
+def write_snapshot(path,header,records):
+    '''
+    Writes a snapshot file: MAGIC, the length of a JSON header, the header, then each field of the records as
+    a column (each starting at a multiple of ALIGNMENT bytes, so it can be memory-mapped as an array)
+    :param path: file to write
+    :param header: JSON-serialisable dict
+    :param records: array of RECORD_DTYPE
+    '''
+    header = dict(header,version=VERSION,count=len(records),dtype=RECORD_DTYPE.descr)
+    encoded = json.dumps(header).encode()
+    start = len(MAGIC) + 4 + len(encoded)
+    encoded += b' ' * (-start % ALIGNMENT)
+    with open(path,'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I',len(encoded)))
+        f.write(encoded)
+        for name in RECORD_DTYPE.names:
+            column = np.ascontiguousarray(records[name])
+            f.write(column.tobytes())
+            f.write(b'\0' * (-column.nbytes % ALIGNMENT))
+
+
+def read_snapshot(path,mmap=False):
+    '''
+    Reads a snapshot file
+    :param path: file written by write_snapshot
+    :param mmap: memory-map the columns copy-on-write instead of reading them into memory: pages are only
+        read when used, and writing to the arrays never changes the file
+    :return: (header dict, dict of RECORD_DTYPE field name:array)
+    '''
+    with open(path,'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a boid snapshot'.format(path))
+        length, = struct.unpack('<I',f.read(4))
+        header = json.loads(f.read(length).decode())
+        if header['version'] != VERSION:
+            raise ValueError('unsupported snapshot version {}'.format(header['version']))
+        count = header['count']
+        columns = {}
+        offset = f.tell()
+        for name in RECORD_DTYPE.names:
+            field = RECORD_DTYPE.fields[name][0]
+            dtype, shape = field.base, (count,) + field.shape
+            if mmap:
+                columns[name] = np.memmap(path,dtype,'c',offset,shape) if count else np.zeros(shape,dtype)
+            else:
+                f.seek(offset)
+                columns[name] = np.fromfile(f,dtype,int(np.prod(shape))).reshape(shape)
+            size = dtype.itemsize * int(np.prod(shape))
+            offset += size + (-size % ALIGNMENT)
+    return header, columns
+
+
+def species_to_dict(species):
+    '''
+    Parameters of a Species for a snapshot header. Only species using the default Priority logic can be saved.
+    '''
+    parameters = species.parameters()
+    if parameters.pop('logic') is not None:
+        raise ValueError('boids with a custom logic can not be saved in a snapshot')
+    parameters['bounds'] = list(parameters['bounds'])
+    return parameters
+
+
+def encode_random_state(state):
+    '''
+    random.Random state as JSON-serialisable lists
+    '''
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def decode_random_state(state):
+    '''
+    Inverse of encode_random_state
+    '''
+    version, internal, gauss_next = state
+    return (version, tuple(internal), gauss_next)
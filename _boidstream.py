@@ -0,0 +1,345 @@
+import asyncio
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from _boidthread import capture
+
+DEFAULT_RATE = 60
+DEFAULT_KEYFRAME_INTERVAL = 60
+# bytes a client may have waiting to be sent before further frames to it are dropped
+DEFAULT_MAX_BUFFER = 1 << 20
+KEYFRAME = 0
+DELTA = 1
+# kind, keyframe number, tick, number of boids
+FRAME_HEADER = struct.Struct('<BIQI')
+LENGTH = struct.Struct('<I')
+BOUNDS = struct.Struct('<4d')
+# positions and orientations are quantised to 16 bits across the bounds and the circle, wrapping like them
+STEPS = 1 << 16
+
+
+def quantise(state,bounds):
+    '''
+    Quantises positions and orientations to uint16, wrapping around the bounds and 360 degrees
+    :param state: dict with positions and orientations arrays (e.g. from _boidthread.capture)
+    :return: (n,3) uint16 array of x, y and orientation
+    '''
+    scale = np.array((STEPS / (bounds[1] - bounds[0]),STEPS / (bounds[3] - bounds[2]),STEPS / 360))
+    values = np.column_stack((state['positions'][:,0] - bounds[0],state['positions'][:,1] - bounds[2],
+                              state['orientations']))
+    return np.round(values * scale).astype(np.int64).astype(np.uint16)
+
+
+def dequantise(quantised,bounds):
+    '''
+    Inverse of quantise
+    :return: (positions,orientations)
+    '''
+    values = quantised * np.array(((bounds[1] - bounds[0]) / STEPS,(bounds[3] - bounds[2]) / STEPS,360 / STEPS))
+    return values[:,:2] + (bounds[0],bounds[2]), values[:,2]
+
+
+def encode_keyframe(state,bounds,keyframe,tick):
+    '''
+    Encodes a whole frame: the bounds, then zlib-compressed quantised positions and orientations, colours,
+    lengths and widths
+    :param state: dict from _boidthread.capture
+    :param keyframe: number of the keyframe, which delta frames refer back to
+    :return: (message bytes,quantised values)
+    '''
+    quantised = quantise(state,bounds)
+    body = b''.join((quantised.astype('<u2').tobytes(),
+                     np.ascontiguousarray(state['colours'],np.uint8).tobytes(),
+                     state['lengths'].astype('<f4').tobytes(),
+                     state['widths'].astype('<f4').tobytes()))
+    message = FRAME_HEADER.pack(KEYFRAME,keyframe,tick,len(quantised)) + BOUNDS.pack(*bounds) + zlib.compress(body)
+    return message, quantised
+
+
+def encode_delta(quantised,key_quantised,keyframe,tick):
+    '''
+    Encodes a frame as the zlib-compressed change of each quantised value since a keyframe. Changes wrap
+    around 16 bits like the values, so boids crossing the bounds still give small changes.
+    :return: message bytes
+    '''
+    delta = (quantised - key_quantised).astype('<u2')
+    return FRAME_HEADER.pack(DELTA,keyframe,tick,len(quantised)) + zlib.compress(delta.tobytes())
+
+
+class FrameDecoder:
+    def __init__(self):
+        '''
+        Decodes the frames of a stream, keeping the latest keyframe so delta frames can be applied to it
+        '''
+        self.keyframe = None
+        self.key_quantised = None
+        self.key_state = None
+        self.bounds = None
+
+
+    def decode(self,message):
+        '''
+        :param message: one message from encode_keyframe or encode_delta
+        :return: state dict (tick, keyframe flag, bounds, positions, orientations, colours, lengths, widths),
+            or None for a delta frame whose keyframe was never received
+        '''
+        kind, keyframe, tick, count = FRAME_HEADER.unpack_from(message)
+        offset = FRAME_HEADER.size
+        if kind == KEYFRAME:
+            self.bounds = BOUNDS.unpack_from(message,offset)
+            body = zlib.decompress(message[offset + BOUNDS.size:])
+            quantised = np.frombuffer(body,'<u2',3 * count).reshape(count,3)
+            offset = quantised.nbytes
+            colours = np.frombuffer(body,np.uint8,3 * count,offset).reshape(count,3)
+            offset += colours.nbytes
+            lengths = np.frombuffer(body,'<f4',count,offset).astype(np.float64)
+            widths = np.frombuffer(body,'<f4',count,offset + 4 * count).astype(np.float64)
+            self.keyframe = keyframe
+            self.key_quantised = quantised
+            self.key_state = {'colours':colours,'lengths':lengths,'widths':widths}
+        elif keyframe != self.keyframe:
+            return None
+        else:
+            delta = np.frombuffer(zlib.decompress(message[offset:]),'<u2').reshape(count,3)
+            quantised = self.key_quantised + delta
+        positions, orientations = dequantise(quantised,self.bounds)
+        return dict(self.key_state,tick=tick,keyframe=kind == KEYFRAME,bounds=self.bounds,
+                    positions=positions,orientations=orientations)
+
+
+class _Client:
+    def __init__(self,writer,rate):
+        self.writer = writer
+        self.interval = 1 / rate if rate > 0 else 0
+        self.last_sent = None
+        self.keyframe = None
+        self.sent = 0
+        self.dropped = 0
+
+
+class BoidServer:
+    def __init__(self,collection,rate=DEFAULT_RATE,keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 max_buffer=DEFAULT_MAX_BUFFER):
+        '''
+        Ticks a BoidCollection on an asyncio loop and streams every tick to any number of clients over TCP or
+        Unix sockets. Each tick is encoded once, as a keyframe every keyframe_interval ticks (and whenever
+        boids are added or removed, or their bounds change) and as a delta against the last keyframe otherwise, so any frame can be
+        skipped. Clients ask for a maximum frame rate when they connect; a client whose socket has more than
+        max_buffer bytes waiting has frames dropped instead of holding up the simulation.
+
+        Protocol: the client sends its frame rate as a little-endian float32 (0 for every tick); the server
+        then sends messages, each a uint32 length followed by a frame (see encode_keyframe, encode_delta).
+
+        :param collection: BoidCollection to tick (ticks run on the loop's default executor)
+        :param rate: ticks per second
+        :param keyframe_interval: ticks between keyframes
+        :param max_buffer: bytes waiting for a client beyond which its frames are dropped
+        '''
+        self.collection = collection
+        self.interval = 1 / rate
+        self.keyframe_interval = keyframe_interval
+        self.max_buffer = max_buffer
+        self.clients = set()
+        self.servers = []
+        self.ticks = 0
+        self.keyframe = -1
+        self.keyframe_tick = 0
+        self.key_quantised = None
+        self.key_message = None
+        self.key_bounds = None
+        self._population = None
+
+
+    async def start_tcp(self,host='127.0.0.1',port=0):
+        '''
+        Listens for clients on a TCP port
+        :return: asyncio Server (its sockets give the port chosen when port is 0)
+        '''
+        server = await asyncio.start_server(self._serve,host,port)
+        self.servers.append(server)
+        return server
+
+
+    async def start_unix(self,path):
+        '''
+        Listens for clients on a Unix socket
+        :return: asyncio Server
+        '''
+        server = await asyncio.start_unix_server(self._serve,path)
+        self.servers.append(server)
+        return server
+
+
+    async def _serve(self,reader,writer):
+        '''
+        Internal function, registers a client until it disconnects
+        '''
+        try:
+            rate, = struct.unpack('<f',await reader.readexactly(4))
+        except (asyncio.IncompleteReadError,ConnectionError):
+            writer.close()
+            return
+        client = _Client(writer,rate)
+        self.clients.add(client)
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+
+    async def run(self,ticks=None):
+        '''
+        Ticks the flock at the fixed rate, sending each tick to the clients
+        :param ticks: number of ticks to run for (default None: until cancelled)
+        '''
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while ticks is None or ticks > 0:
+            await loop.run_in_executor(None,self.collection.tick)
+            self.ticks += 1
+            self.broadcast()
+            if ticks is not None:
+                ticks -= 1
+            next_time += self.interval
+            await asyncio.sleep(max(0,next_time - loop.time()))
+
+
+    def broadcast(self):
+        '''
+        Encodes the flock's current state and sends it to every client that is due a frame and keeping up
+        '''
+        collection = self.collection
+        collection.sync()
+        state = capture(collection,self.ticks)
+        # scalar boids carry their own bounds; the collection's are only a default for them
+        bounds = collection._shared_bounds()
+        population = (len(collection.handles),collection._next_handle)
+        if population != self._population or bounds != self.key_bounds or \
+                self.ticks - self.keyframe_tick >= self.keyframe_interval:
+            self.keyframe += 1
+            self.keyframe_tick = self.ticks
+            self._population = population
+            self.key_bounds = bounds
+            self.key_message, self.key_quantised = encode_keyframe(state,bounds,self.keyframe,self.ticks)
+            message = self.key_message
+        else:
+            message = encode_delta(quantise(state,bounds),self.key_quantised,self.keyframe,self.ticks)
+        now = time.perf_counter()
+        for client in list(self.clients):
+            if client.last_sent is not None and now - client.last_sent < client.interval:
+                continue
+            transport = client.writer.transport
+            if transport.is_closing() or transport.get_write_buffer_size() > self.max_buffer:
+                client.dropped += 1
+                continue
+            if client.keyframe != self.keyframe:
+                client.writer.write(LENGTH.pack(len(self.key_message)) + self.key_message)
+                client.keyframe = self.keyframe
+                if message is not self.key_message:
+                    client.writer.write(LENGTH.pack(len(message)) + message)
+            else:
+                client.writer.write(LENGTH.pack(len(message)) + message)
+            client.last_sent = now
+            client.sent += 1
+
+
+    async def close(self):
+        '''
+        Stops listening and disconnects every client
+        '''
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        for client in list(self.clients):
+            client.writer.close()
+        self.clients.clear()
+
+
+class BoidStreamClient:
+    def __init__(self,reader,writer):
+        '''
+        Receives the frames streamed by a BoidServer; use connect_tcp or connect_unix to create one
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder()
+
+
+    @classmethod
+    async def connect_tcp(cls,host='127.0.0.1',port=None,rate=0):
+        '''
+        :param rate: most frames per second wanted (0 for every tick)
+        '''
+        reader, writer = await asyncio.open_connection(host,port)
+        writer.write(struct.pack('<f',rate))
+        return cls(reader,writer)
+
+
+    @classmethod
+    async def connect_unix(cls,path,rate=0):
+        '''
+        :param rate: most frames per second wanted (0 for every tick)
+        '''
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(struct.pack('<f',rate))
+        return cls(reader,writer)
+
+
+    async def receive(self):
+        '''
+        Waits for the next frame that can be decoded
+        :return: state dict from FrameDecoder.decode, or None once the server has closed the stream
+        '''
+        while True:
+            try:
+                length, = LENGTH.unpack(await self.reader.readexactly(LENGTH.size))
+                message = await self.reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return None
+            state = self.decoder.decode(message)
+            if state is not None:
+                return state
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        state = await self.receive()
+        if state is None:
+            raise StopAsyncIteration
+        return state
+
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def apply_state(state,collection):
+    '''
+    Shows a streamed state with an array-backed BoidCollection that is never ticked, so its existing draw()
+    renders the stream. Boids are replaced whenever a keyframe has a different number of them.
+    :param state: state dict from BoidStreamClient.receive
+    :param collection: array-backed BoidCollection with the stream's bounds
+    '''
+    if len(collection.views) != len(state['positions']):
+        for boid in list(collection.views):
+            collection.remove(boid)
+        collection.spawn(len(state['positions']),position=state['positions'],orientation=state['orientations'],
+                         specific_colour=state['colours'])
+    if state['keyframe']:
+        collection.arrays.colours[:] = state['colours']
+        collection.arrays.lengths[:] = state['lengths']
+        collection.arrays.widths[:] = state['widths']
+        collection.drawn_boids = None
+    collection.arrays.positions[:] = state['positions']
+    collection.arrays.orientations[:] = state['orientations']
@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from _boidkernels import get_vertices
+
+DEFAULT_RATE = 60
+# steps the simulation may run late by before it skips ahead instead of trying to catch up
+DEFAULT_MAX_LAG = 5
+
+
+def capture(collection,when):
+    '''
+    Copies what drawing needs from every boid of collection (in draw order)
+    :param when: simulation time of the state
+    :return: dict of time and arrays of positions, orientations, speeds, lengths, widths and colours
+    '''
+    if collection.array_backed:
+        arrays = collection.arrays
+        return {'time':when,
+                'positions':arrays.positions.copy(),
+                'orientations':arrays.orientations.copy(),
+                'speeds':arrays.speeds.copy(),
+                'lengths':arrays.lengths.copy(),
+                'widths':arrays.widths.copy(),
+                'colours':arrays.colours.copy()}
+    boids = list(collection.handles.values())
+    return {'time':when,
+            'positions':np.array([boid.position for boid in boids],float).reshape(-1,2),
+            'orientations':np.array([boid.orientation for boid in boids],float),
+            'speeds':np.array([boid.speed for boid in boids],float),
+            'lengths':np.array([boid.length for boid in boids],float),
+            'widths':np.array([boid.width for boid in boids],float),
+            'colours':np.array([boid.colour for boid in boids],np.uint8).reshape(-1,3)}
+
+
+def interpolate(previous,latest,alpha):
+    '''
+    Positions and orientations between two captured states. Boids that wrapped around the bounds (moved
+    further than twice their speed) are drawn at their latest position rather than dragged across the screen.
+    :param alpha: fraction of the way from previous (0) to latest (1)
+    :return: (positions,orientations)
+    '''
+    if previous is None or len(previous['positions']) != len(latest['positions']):
+        return latest['positions'], latest['orientations']
+    step = latest['positions'] - previous['positions']
+    step[np.abs(step) > 2 * latest['speeds'][:,None]] = 0
+    turn = (latest['orientations'] - previous['orientations'] + 180) % 360 - 180
+    return latest['positions'] - (1 - alpha) * step, (latest['orientations'] - (1 - alpha) * turn) % 360
+
+
+class SimulationThread:
+    def __init__(self,collection,rate=DEFAULT_RATE,max_lag=DEFAULT_MAX_LAG):
+        '''
+        Ticks a BoidCollection on a background thread at a fixed rate, independent of drawing.
+        After each tick the thread captures the flock and publishes it together with the state before it,
+        as one (previous,latest) pair swapped in by a single assignment, so readers never take a lock.
+        Drawing lags one step behind and interpolates between the pair, which keeps motion smooth at any
+        display rate.
+        While the thread runs, only it may touch the collection: change the flock with submit().
+        :param collection: BoidCollection to tick
+        :param rate: ticks per second
+        :param max_lag: steps the simulation may run late by before it gives up on catching up
+        '''
+        self.collection = collection
+        self.interval = 1 / rate
+        self.max_lag = max_lag
+        self.steps = 0
+        self.generation = 0
+        self.error = None
+        self.jobs = queue.Queue()
+        self.frames = (None,capture(collection,time.perf_counter()))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,name='boids simulation',daemon=True)
+
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+    def submit(self,function,*args):
+        '''
+        Calls function(*args) on the simulation thread between two ticks, e.g. submit(collection.add,10)
+        :return: concurrent.futures-style Future of the result
+        '''
+        from concurrent.futures import Future
+        future = Future()
+        self.jobs.put((future,function,args))
+        return future
+
+
+    def _run_jobs(self):
+        '''
+        Internal function, runs submitted jobs
+        '''
+        ran = False
+        while True:
+            try:
+                future, function, args = self.jobs.get_nowait()
+            except queue.Empty:
+                return ran
+            ran = True
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args))
+                except BaseException as error:
+                    future.set_exception(error)
+
+
+    def _run(self):
+        '''
+        Internal function, the thread's fixed-timestep loop
+        '''
+        next_time = time.perf_counter() + self.interval
+        try:
+            while not self._stop.is_set():
+                now = time.perf_counter()
+                if now < next_time:
+                    self._stop.wait(next_time - now)
+                    continue
+                if self._run_jobs():
+                    self.generation += 1
+                    self.frames = (None,capture(self.collection,self.frames[1]['time']))
+                self.collection.tick()
+                self.steps += 1
+                self.frames = (self.frames[1],capture(self.collection,next_time))
+                next_time += self.interval
+                if now - next_time > self.max_lag * self.interval:
+                    next_time = now
+        except BaseException as error:
+            self.error = error
+        self._run_jobs()
+
+
+    def stop(self):
+        '''
+        Stops the thread after its current tick, re-raising any error raised while ticking
+        '''
+        self._stop.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+    def state(self,now=None):
+        '''
+        Interpolated state of the flock for drawing at time now (default: the current time)
+        :return: (latest captured state dict, positions, orientations)
+        '''
+        previous, latest = self.frames
+        if now is None:
+            now = time.perf_counter()
+        alpha = 1.0
+        if previous is not None:
+            alpha = min(1.0,max(0.0,(now - latest['time']) / (latest['time'] - previous['time'])))
+        positions, orientations = interpolate(previous,latest,alpha)
+        return latest, positions, orientations
+
+
+    def vertices(self,now=None):
+        '''
+        Interpolated vertices of every boid for drawing at time now
+        :return: (n,6) array of (x1,y1,x2,y2,x3,y3)
+        '''
+        latest, positions, orientations = self.state(now)
+        return get_vertices(positions,np.pi * orientations / 180,latest['lengths'],latest['widths'])
@@ -0,0 +1,100 @@
+import math
+
+
+class SpatialHash:
+    def __init__(self,bounds,cell_size):
+        '''
+        Uniform grid of cells covering a toroidal area, used to find boids near a position
+        without checking every boid. Cells are at least cell_size wide, so anything closer
+        than cell_size to a position is in the same cell or one of the 8 adjacent cells.
+
+        :param bounds: (xmin,xmax,ymin,ymax) boundaries, wrapped like _find_shortest_path
+        :param cell_size: minimum width of a cell (normally the largest vision_range)
+        '''
+        self.bounds = bounds
+        self.cell_size = cell_size
+        width = bounds[1] - bounds[0]
+        height = bounds[3] - bounds[2]
+        self.columns = _cells_along_axis(width,cell_size)
+        self.rows = _cells_along_axis(height,cell_size)
+        self.cell_width = width / self.columns
+        self.cell_height = height / self.rows
+        self.clear()
+
+
+    def clear(self):
+        '''
+        Empties every cell
+        '''
+        self.cells = {}
+
+
+    def cell(self,position):
+        '''
+        Finds the cell containing position, wrapping positions outside the bounds
+        :param position: (x,y) position
+        :return: (column,row) of cell
+        '''
+        column = int((position[0] - self.bounds[0]) // self.cell_width) % self.columns
+        row = int((position[1] - self.bounds[2]) // self.cell_height) % self.rows
+        return (column,row)
+
+
+    def insert(self,item,position):
+        '''
+        Adds item to the cell containing position
+        :param item: object to store (normally a Boid)
+        :param position: (x,y) position of item
+        '''
+        self.cells.setdefault(self.cell(position),[]).append(item)
+
+
+    def remove(self,item,position):
+        '''
+        Removes item from the cell containing position
+        :param item: object stored with insert
+        :param position: (x,y) position item was inserted at
+        '''
+        cell = self.cell(position)
+        self.cells[cell].remove(item)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+
+    def adjacent_cells(self,position,radius=None):
+        '''
+        Finds the cell containing position and its neighbours, wrapping across the bounds
+        :param position: (x,y) position
+        :param radius: distance to cover, if more than cell_size (more rings of cells are included)
+        :return: set of (column,row) cells (fewer than 9 if the grid is narrower than 3 cells)
+        '''
+        column, row = self.cell(position)
+        columns = rows = 1
+        if radius is not None:
+            columns = max(1,math.ceil(radius / self.cell_width))
+            rows = max(1,math.ceil(radius / self.cell_height))
+        return {((column + dc) % self.columns, (row + dr) % self.rows)
+                for dc in range(-columns,columns + 1) for dr in range(-rows,rows + 1)}
+
+
+    def nearby(self,position,radius=None):
+        '''
+        Yields every item in the cell containing position or an adjacent cell
+        :param position: (x,y) position
+        :param radius: distance to cover, if more than cell_size
+        '''
+        for cell in self.adjacent_cells(position,radius):
+            for item in self.cells.get(cell,()):
+                yield item
+
+
+def _cells_along_axis(length,cell_size):
+    '''
+    Number of whole cells of at least cell_size that fit along an axis
+    :param length: length of axis
+    :param cell_size: minimum width of a cell
+    :return: number of cells (at least 1)
+    '''
+    if cell_size <= 0:
+        return 1
+    return max(1,int(length // cell_size))
@@ -0,0 +1,302 @@
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from _boid import check_for_collision
+from _boidarrays import recommendations_avoidance
+from _boidcollection import BoidCollection
+
+DEFAULT_SIZES = (40,400,4000,40000,100000)
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_SEED = 1
+MODES = ('scalar','array')
+DEFAULT_THETAS = (0,0.25,0.5,1)
+DEFAULT_APPROXIMATION_SIZE = 5000
+DEFAULT_APPROXIMATION_RANGE = 100
+DEFAULT_BOUNDS = (0,640,0,480)
+DEFAULT_KERNEL_SIZE = 4000
+
+# largest flock each benchmark is run at in each mode; the scalar and O(n^2) paths can't reach 100k
+SIZE_LIMITS = {('tick','scalar'):4000,
+               ('tick','array'):100000,
+               ('get_displacements','scalar'):400,
+               ('get_displacements','array'):400,
+               ('neighbours','scalar'):4000,
+               ('neighbours','array'):100000,
+               ('check_for_collision','scalar'):4000,
+               ('check_for_collision','array'):100000,
+               ('vertices','scalar'):40000,
+               ('vertices','array'):100000}
+
+
+def make_collection(n,mode,seed=DEFAULT_SEED):
+    '''
+    Builds a headless flock of n boids with fixed seeds. The bounds grow with n so the density matches
+    40 boids in the default 640x480 window.
+    :param n: number of boids
+    :param mode: 'scalar' or 'array'
+    :return: BoidCollection
+    '''
+    random.seed(seed)
+    scale = math.sqrt(n / 40)
+    bounds = (0,round(640 * scale),0,round(480 * scale))
+    collection = BoidCollection(array_backed=(mode == 'array'),bounds=bounds,headless=True)
+    collection.add(n,bounds=bounds)
+    return collection
+
+
+def _invalidate(collection):
+    '''
+    Marks everything derived from positions as stale, as tick() does
+    '''
+    collection.displacements_up_to_date = False
+    collection.index_up_to_date = False
+    collection.index_checked = False
+    collection.candidate_pairs = None
+    collection.neighbour_lists = None
+    for boid in collection.boids:
+        boid._new_position()
+
+
+def bench_tick(collection):
+    collection.tick()
+
+
+def bench_get_displacements(collection):
+    _invalidate(collection)
+    collection.get_displacements()
+
+
+def bench_neighbours(collection):
+    _invalidate(collection)
+    if collection.array_backed:
+        collection.get_neighbour_lists()
+    else:
+        for boid in collection.boids:
+            boid.neighbours
+
+
+def bench_check_for_collision(collection):
+    if collection.array_backed:
+        recommendations_avoidance(collection.arrays,collection.get_neighbour_lists(),collection.bounds)
+    else:
+        for boid in collection.boids:
+            for neighbour in boid.neighbours:
+                check_for_collision(boid,neighbour)
+
+
+def bench_vertices(collection):
+    collection.get_vertices()
+
+
+BENCHMARKS = {'tick':bench_tick,
+              'get_displacements':bench_get_displacements,
+              'neighbours':bench_neighbours,
+              'check_for_collision':bench_check_for_collision,
+              'vertices':bench_vertices}
+
+
+def run(benchmarks=tuple(BENCHMARKS),modes=MODES,sizes=DEFAULT_SIZES,repeat=DEFAULT_REPEAT,seed=DEFAULT_SEED,log=None):
+    '''
+    Times each benchmark at each flock size allowed by SIZE_LIMITS
+    :param log: optional function called with a line of progress text
+    :return: dict of run metadata and list of results
+    '''
+    results = []
+    for name in benchmarks:
+        for mode in modes:
+            for n in sizes:
+                if n > SIZE_LIMITS[(name,mode)]:
+                    continue
+                collection = make_collection(n,mode,seed)
+                BENCHMARKS[name](collection)  # warm up: builds indexes, neighbour lists etc.
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    BENCHMARKS[name](collection)
+                    timings.append(time.perf_counter() - start)
+                result = {'benchmark':name,'mode':mode,'n':n,'repeat':repeat,
+                          'min':min(timings),'median':statistics.median(timings)}
+                results.append(result)
+                if log:
+                    log('{benchmark:>20} {mode:>6} {n:>7} {median:10.6f}s'.format(**result))
+    return {'meta':{'python':platform.python_version(),'numpy':np.__version__,'machine':platform.machine(),
+                    'platform':platform.platform(),'seed':seed},
+            'results':results}
+
+
+def run_approximation(n=DEFAULT_APPROXIMATION_SIZE,thetas=DEFAULT_THETAS,vision_range=DEFAULT_APPROXIMATION_RANGE,
+                      avoidance_range=None,seed=DEFAULT_SEED,log=None):
+    '''
+    Times the phases of an array-backed tick on a dense flock with a long vision_range, once exactly and once
+    with approximate matching and centering (_boidquadtree) at each theta, and measures how far the
+    approximate recommendations and the boids' resulting turns are from the exact ones. Exact ticks find
+    neighbours within vision_range for every rule; approximate ticks only find them within avoidance_range,
+    for avoidance, as a collection with that neighbour_range does.
+    :param n: number of boids, in a 640x480 area
+    :param thetas: accuracy parameters to try
+    :param avoidance_range: neighbour_range of the approximate ticks (default None:
+        _boidquadtree.DEFAULT_AVOIDANCE_RANGE)
+    :return: list of dicts of theta (None for the exact tick), seconds for neighbours, avoidance and rules
+        (matching and centering) and their sum as tick, and the median and 95th percentile error in degrees
+        of centering, matching and the turn each boid makes
+    '''
+    from _boidarrays import find_neighbours, recommendations_avoidance, recommendations_matching, \
+        recommendations_centering, arbitrate
+    from _boidquadtree import ApproximateRules, DEFAULT_AVOIDANCE_RANGE
+    if avoidance_range is None:
+        avoidance_range = DEFAULT_AVOIDANCE_RANGE
+    collection = BoidCollection(array_backed=True,bounds=DEFAULT_BOUNDS,headless=True,seed=seed)
+    collection.spawn(n,bounds=DEFAULT_BOUNDS,vision_range=vision_range)
+    arrays = collection.arrays
+    logics = [boid.logic for boid in collection.views]
+    rule_sets = [(None,None,recommendations_matching,recommendations_centering)]
+    for theta in sorted(thetas):
+        rules = ApproximateRules(theta)
+        rule_sets.append((theta,avoidance_range,rules.recommendations_matching,rules.recommendations_centering))
+    results = []
+    exact = None
+    for theta, radius, matching_rule, centering_rule in rule_sets:
+        result = {'theta':theta}
+        start = time.perf_counter()
+        neighbours = find_neighbours(arrays,DEFAULT_BOUNDS,radii=radius)
+        result['neighbours'] = time.perf_counter() - start
+        start = time.perf_counter()
+        avoidance = recommendations_avoidance(arrays,neighbours,DEFAULT_BOUNDS)
+        result['avoidance'] = time.perf_counter() - start
+        start = time.perf_counter()
+        matching = matching_rule(arrays,neighbours,DEFAULT_BOUNDS)
+        centering = centering_rule(arrays,neighbours,DEFAULT_BOUNDS)
+        result['rules'] = time.perf_counter() - start
+        result['tick'] = result['neighbours'] + result['avoidance'] + result['rules']
+        turn = arbitrate(logics,*(np.stack(values,axis=1) for values in zip(avoidance,matching,centering)))
+        changes = {'centering':centering[1],'matching':matching[1],'turn':turn}
+        if exact is None:
+            exact = changes
+        for name, approximate in changes.items():
+            errors = np.abs((approximate - exact[name] + 180) % 360 - 180)
+            result[name + '_error_median'] = float(np.median(errors))
+            result[name + '_error_p95'] = float(np.percentile(errors,95))
+        results.append(result)
+    if log:
+        for result in results:
+            log('{:>8} neighbours {neighbours:.6f}s avoidance {avoidance:.6f}s rules {rules:.6f}s tick {tick:.6f}s '
+                'error (median, p95) centering {centering_error_median:.3f} {centering_error_p95:.3f} matching '
+                '{matching_error_median:.3f} {matching_error_p95:.3f} turn {turn_error_median:.3f} '
+                '{turn_error_p95:.3f} degrees'.format('exact' if result['theta'] is None else result['theta'],
+                                                      **result))
+    return results
+
+
+def run_kernels(n=DEFAULT_KERNEL_SIZE,backends=None,repeat=DEFAULT_REPEAT,seed=DEFAULT_SEED,log=None):
+    '''
+    Times the array-backed tick with each compute-kernel backend (_boidbackends) on the same flock. The
+    first tick is left out, so JIT backends aren't timed compiling.
+    :param n: number of boids
+    :param backends: backend names (default None: every available backend)
+    :return: list of dicts of backend, min and median seconds per tick
+    '''
+    from _boidbackends import available_backends
+    results = []
+    for backend in backends or available_backends():
+        random.seed(seed)
+        scale = math.sqrt(n / 40)
+        bounds = (0,round(640 * scale),0,round(480 * scale))
+        collection = BoidCollection(array_backed=True,bounds=bounds,headless=True,kernels=backend)
+        collection.add(n,bounds=bounds)
+        collection.tick()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            collection.tick()
+            timings.append(time.perf_counter() - start)
+        result = {'backend':backend,'n':n,'min':min(timings),'median':statistics.median(timings)}
+        results.append(result)
+        if log:
+            log('{backend:>8} {n:>7} {median:10.6f}s'.format(**result))
+    return results
+
+
+def compare(current,baseline,threshold=DEFAULT_THRESHOLD):
+    '''
+    Compares median timings with a baseline run
+    :param current: results from run()
+    :param baseline: results from run(), e.g. loaded from a stored file
+    :param threshold: allowed slowdown as a fraction (0.2 allows 20% slower)
+    :return: list of (result,baseline_result,ratio) for every regression above threshold
+    '''
+    stored = {(r['benchmark'],r['mode'],r['n']):r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        previous = stored.get((result['benchmark'],result['mode'],result['n']))
+        if previous is None or previous['median'] <= 0:
+            continue
+        ratio = result['median'] / previous['median']
+        if ratio > 1 + threshold:
+            regressions.append((result,previous,ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times tick, neighbour search, collision checks and vertex '
+                                                 'generation across flock sizes')
+    parser.add_argument('--benchmarks',nargs='+',choices=tuple(BENCHMARKS),default=tuple(BENCHMARKS))
+    parser.add_argument('--modes',nargs='+',choices=MODES,default=MODES)
+    parser.add_argument('--sizes',nargs='+',type=int,default=DEFAULT_SIZES)
+    parser.add_argument('--repeat',type=int,default=DEFAULT_REPEAT)
+    parser.add_argument('--seed',type=int,default=DEFAULT_SEED)
+    parser.add_argument('--output',help='write results as JSON to this file')
+    parser.add_argument('--baseline',help='JSON results to compare against; exits 1 on regressions')
+    parser.add_argument('--threshold',type=float,default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown against the baseline as a fraction (default 0.2)')
+    parser.add_argument('--approximation',action='store_true',
+                        help='instead, time tick phases with quadtree centering and matching at --thetas and '
+                             'neighbours only found within --avoidance-range, against exact ticks')
+    parser.add_argument('--thetas',nargs='+',type=float,default=DEFAULT_THETAS)
+    parser.add_argument('--avoidance-range',type=float,
+                        help='neighbour_range of the approximate ticks '
+                             '(default: DEFAULT_AVOIDANCE_RANGE of _boidquadtree)')
+    parser.add_argument('--kernels',nargs='*',
+                        help='instead, time the array tick with these kernel backends (default: all available)')
+    args = parser.parse_args(argv)
+
+    if args.approximation:
+        results = run_approximation(args.sizes[0] if args.sizes != DEFAULT_SIZES else DEFAULT_APPROXIMATION_SIZE,
+                                    args.thetas,avoidance_range=args.avoidance_range,seed=args.seed,log=print)
+        if args.output:
+            with open(args.output,'w') as f:
+                json.dump(results,f,indent=1)
+        return 0
+    if args.kernels is not None:
+        results = run_kernels(args.sizes[0] if args.sizes != DEFAULT_SIZES else DEFAULT_KERNEL_SIZE,
+                              args.kernels,args.repeat,args.seed,log=print)
+        if args.output:
+            with open(args.output,'w') as f:
+                json.dump(results,f,indent=1)
+        return 0
+    results = run(args.benchmarks,args.modes,args.sizes,args.repeat,args.seed,log=print)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results,baseline,args.threshold)
+        for result, previous, ratio in regressions:
+            print('REGRESSION {benchmark} {mode} n={n}: {median:.6f}s'.format(**result),
+                  'vs {:.6f}s ({:+.0%})'.format(previous['median'],ratio - 1))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
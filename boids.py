@@ -1,8 +1,91 @@
+import argparse
+import asyncio
+import threading
+
 import pyglet
 from _boidcollection import BoidCollection
 
 
-def main():
+def _split_address(address):
+    '''
+    :param address: host:port, or the path of a Unix socket
+    :return: (host,port), or (path,None)
+    '''
+    host, colon, port = address.rpartition(':')
+    if colon and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return address, None
+
+
+def serve(address):
+    '''
+    Ticks a flock without a window, streaming it to clients at address
+    '''
+    from _boidstream import BoidServer
+    boids = BoidCollection(headless=True)
+    boids.add(40)
+    server = BoidServer(boids)
+
+    async def run():
+        host, port = _split_address(address)
+        if port is None:
+            await server.start_unix(host)
+        else:
+            await server.start_tcp(host,port)
+        await server.run()
+
+    asyncio.run(run())
+
+
+def view(address):
+    '''
+    Draws a flock streamed from a server at address. Frames are received on a background thread and the
+    latest is drawn through an array-backed BoidCollection that is never ticked.
+    '''
+    from _boidstream import BoidStreamClient, apply_state
+    latest = []
+
+    async def receive():
+        host, port = _split_address(address)
+        if port is None:
+            client = await BoidStreamClient.connect_unix(host,60)
+        else:
+            client = await BoidStreamClient.connect_tcp(host,port,60)
+        async for state in client:
+            latest[:] = [state]
+
+    threading.Thread(target=asyncio.run,args=(receive(),),daemon=True).start()
+    window = pyglet.window.Window()
+    viewer = []
+
+    @window.event
+    def on_draw():
+        window.clear()
+        if latest:
+            state = latest[0]
+            if not viewer:
+                viewer.append(BoidCollection(array_backed=True,bounds=state['bounds']))
+            apply_state(state,viewer[0])
+            viewer[0].draw()
+
+    pyglet.clock.schedule(lambda dt: None)
+    pyglet.app.run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Boids')
+    parser.add_argument('--background',action='store_true',
+                        help='tick on a background thread at a fixed rate and interpolate between ticks when drawing')
+    parser.add_argument('--serve',metavar='ADDRESS',
+                        help='stream the flock to clients at host:port or a Unix socket path, without a window')
+    parser.add_argument('--connect',metavar='ADDRESS',
+                        help='draw a flock streamed by --serve from host:port or a Unix socket path')
+    args = parser.parse_args(argv)
+    if args.serve:
+        return serve(args.serve)
+    if args.connect:
+        return view(args.connect)
+
     window = pyglet.window.Window()
     boids = BoidCollection()
     boids.add(40)
@@ -22,8 +105,14 @@ def main():
         window.clear()
         boids.draw()
 
-    pyglet.clock.schedule_interval(tick,1/60)
+    if args.background:
+        boids.run_in_background(60)
+        # redraw as often as the display allows
+        pyglet.clock.schedule(lambda dt: None)
+    else:
+        pyglet.clock.schedule_interval(tick,1/60)
     pyglet.app.run()
+    boids.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import argparse
+import functools
+import itertools
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from _boidarrays import find_neighbours, recommendations_avoidance
+from _boidcollection import BoidCollection
+from _boidlogic import Priority
+
+# Boid parameters passed to BoidCollection.spawn
+BOID_PARAMETERS = ('size','width','length','speed','vision_range','vision_angle')
+# Priority(allowed_change) is given to every boid as its logic
+LOGIC_PARAMETERS = ('allowed_change',)
+# n is the number of boids, the rest are passed to BoidCollection
+COLLECTION_PARAMETERS = ('n','array_backed','skin')
+PARAMETERS = BOID_PARAMETERS + LOGIC_PARAMETERS + COLLECTION_PARAMETERS
+METRICS = ('polarisation','nearest_neighbour','collision_rate')
+DEFAULT_N = 40
+DEFAULT_TICKS = 200
+DEFAULT_SAMPLE_EVERY = 10
+DEFAULT_SEEDS = (1,)
+
+
+def expand_grid(grid,seeds=DEFAULT_SEEDS):
+    '''
+    Every combination of the values in grid, once for each seed
+    :param grid: dict of parameter name (from PARAMETERS) to a sequence of values
+    :param seeds: seeds to run each combination with
+    :return: list of configuration dicts of parameter values and seed
+    '''
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError('unknown parameters {}'.format(', '.join(sorted(unknown))))
+    names = sorted(grid)
+    return [dict(zip(names,values),seed=seed)
+            for values in itertools.product(*(grid[name] for name in names)) for seed in seeds]
+
+
+def make_flock(configuration):
+    '''
+    Builds the headless flock a configuration describes (parameters it doesn't give keep their defaults)
+    :param configuration: dict from expand_grid
+    :return: BoidCollection
+    '''
+    collection = BoidCollection(headless=True,seed=configuration['seed'],
+                                **{name:configuration[name] for name in COLLECTION_PARAMETERS[1:]
+                                   if name in configuration})
+    kwargs = {name:configuration[name] for name in BOID_PARAMETERS if name in configuration}
+    if 'allowed_change' in configuration:
+        kwargs['logic'] = Priority(configuration['allowed_change'])
+    collection.spawn(configuration.get('n',DEFAULT_N),**kwargs)
+    return collection
+
+
+def flock_metrics(collection):
+    '''
+    Measures how ordered a flock is:
+    polarisation, the length of the mean unit heading (1 when every boid heads the same way, near 0 for
+    random headings);
+    nearest_neighbour, the mean distance from each boid to its nearest other boid, over the boids with
+    another within vision_range (nan if none have);
+    collision_rate, the fraction of boids whose collision avoidance recommends a turn.
+    :return: dict of metric values
+    '''
+    if not collection.handles:
+        return dict.fromkeys(METRICS,math.nan)
+    if collection.array_backed:
+        collection.sync()
+        arrays, bounds = collection.arrays, collection.bounds
+    else:
+        arrays, bounds = collection._scalar_arrays()[1:]
+    angles = np.pi * arrays.orientations / 180
+    polarisation = math.hypot(np.cos(angles).mean(),np.sin(angles).mean())
+    nearby = find_neighbours(arrays,bounds,radii=arrays.vision_ranges,cones=180)
+    starts = nearby.indptr[:-1][nearby.counts > 0]
+    nearest_neighbour = np.minimum.reduceat(nearby.distances,starts).mean() if len(starts) else math.nan
+    avoidance = recommendations_avoidance(arrays,find_neighbours(arrays,bounds),bounds)[1]
+    return {'polarisation':float(polarisation),
+            'nearest_neighbour':float(nearest_neighbour),
+            'collision_rate':float(np.count_nonzero(avoidance) / len(arrays))}
+
+
+def run_configuration(configuration,ticks=DEFAULT_TICKS,sample_every=DEFAULT_SAMPLE_EVERY):
+    '''
+    Builds and ticks a flock, measuring it every sample_every ticks. Only the configuration is sent to a
+    worker and only numbers come back, so no collection is ever pickled.
+    :param configuration: dict from expand_grid
+    :param ticks: number of ticks to run for
+    :param sample_every: ticks between measurements
+    :return: dict of the configuration, the mean of each metric over the samples (name_mean), its value
+        after the last tick (name_final) and seconds_per_tick (not counting measurements)
+    '''
+    collection = make_flock(configuration)
+    samples = []
+    seconds = 0
+    for tick in range(1,ticks + 1):
+        start = time.perf_counter()
+        collection.tick()
+        seconds += time.perf_counter() - start
+        if tick % sample_every == 0 or tick == ticks:
+            samples.append(flock_metrics(collection))
+    collection.close()
+    result = dict(configuration)
+    for metric in METRICS:
+        values = [sample[metric] for sample in samples]
+        result[metric + '_mean'] = float(np.nanmean(values)) if not all(map(math.isnan,values)) else math.nan
+        result[metric + '_final'] = values[-1]
+    result['seconds_per_tick'] = seconds / ticks
+    return result
+
+
+def _warm_up():
+    '''
+    Internal function, initialises worker processes by importing and running everything a configuration
+    needs, so the first configuration each worker runs isn't timed with that cost
+    '''
+    run_configuration({'n':4,'seed':0,'array_backed':True},ticks=1)
+    run_configuration({'n':4,'seed':0},ticks=1)
+
+
+def to_columns(results):
+    '''
+    :param results: list of dicts with the same keys
+    :return: dict of key to numpy array of values, in the order of the first result's keys
+    '''
+    return {name:np.array([result[name] for result in results]) for name in (results[0] if results else {})}
+
+
+def sweep(grid,seeds=DEFAULT_SEEDS,ticks=DEFAULT_TICKS,sample_every=DEFAULT_SAMPLE_EVERY,workers=None,
+          executor=None,log=None):
+    '''
+    Runs every configuration of a parameter grid with run_configuration in a pool of worker processes.
+    The workers are started (and warmed up) once and run configurations in turn; pass a
+    concurrent.futures executor to reuse the same workers across several sweeps.
+    :param grid: dict of parameter name (from PARAMETERS) to a sequence of values
+    :param seeds: seeds to run each combination with
+    :param workers: number of worker processes (default None: one per core); 0 runs in this process
+    :param executor: executor to run configurations on instead of starting a pool
+    :param log: optional function called with a line of text for each finished configuration
+    :return: results as columns (see to_columns), one row per configuration in expand_grid order
+    '''
+    configurations = expand_grid(grid,seeds)
+    run = functools.partial(run_configuration,ticks=ticks,sample_every=sample_every)
+    if executor is None and workers == 0:
+        results = map(run,configurations)
+    elif executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers,initializer=_warm_up) as pool:
+            return sweep(grid,seeds,ticks,sample_every,executor=pool,log=log)
+    else:
+        results = executor.map(run,configurations)
+    rows = []
+    for result in results:
+        rows.append(result)
+        if log:
+            log(' '.join('{}={}'.format(name,result[name]) for name in sorted(configurations[0])) +
+                ' polarisation {polarisation_mean:.3f} nearest {nearest_neighbour_mean:.2f} collisions '
+                '{collision_rate_mean:.3f} {seconds_per_tick:.6f}s/tick'.format(**result))
+    return to_columns(rows)
+
+
+def write_results(path,columns):
+    '''
+    Writes results columns as a .npz archive of one array per column, or as JSON of column lists
+    '''
+    if str(path).endswith('.npz'):
+        np.savez(path,**columns)
+    else:
+        with open(path,'w') as f:
+            json.dump({name:values.tolist() for name, values in columns.items()},f,indent=1)
+
+
+def read_results(path):
+    '''
+    Reads results columns written by write_results
+    :return: dict of column name to numpy array
+    '''
+    if str(path).endswith('.npz'):
+        with np.load(path) as archive:
+            return {name:archive[name] for name in archive.files}
+    with open(path) as f:
+        return {name:np.array(values) for name, values in json.load(f).items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs a grid of boid parameters headless in worker processes '
+                                                 'and measures how ordered each flock becomes')
+    for name in BOID_PARAMETERS + LOGIC_PARAMETERS + ('skin',):
+        parser.add_argument('--' + name.replace('_','-'),nargs='+',type=float,dest=name)
+    parser.add_argument('--n',nargs='+',type=int,default=(DEFAULT_N,))
+    parser.add_argument('--array-backed',action='store_true',help='tick array-backed flocks')
+    parser.add_argument('--seeds',nargs='+',type=int,default=DEFAULT_SEEDS)
+    parser.add_argument('--ticks',type=int,default=DEFAULT_TICKS)
+    parser.add_argument('--sample-every',type=int,default=DEFAULT_SAMPLE_EVERY)
+    parser.add_argument('--workers',type=int,help='worker processes (default: one per core, 0: none)')
+    parser.add_argument('--output',help='write results columns to this .npz or JSON file')
+    args = parser.parse_args(argv)
+
+    grid = {name:getattr(args,name) for name in PARAMETERS if getattr(args,name,None)}
+    if args.array_backed:
+        grid['array_backed'] = (True,)
+    columns = sweep(grid,args.seeds,args.ticks,args.sample_every,args.workers,log=print)
+    if args.output:
+        write_results(args.output,columns)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
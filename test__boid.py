@@ -1,6 +1,8 @@
+import math
 import random
 import pytest
-from _boid import Boid, _find_shortest_path, angle_between_vectors
+from _boid import Boid, _find_shortest_path, angle_between_vectors, segment_intersection_distance, \
+    check_for_collision
 
 
 @pytest.fixture
@@ -58,7 +60,6 @@ def test_vertices(boid,x,y,orientation,width,length,expected_vertices):
     boid.width = width
     boid.length = length
     boid.position = [x,y]
-    boid._update_offsets()
     v = boid.get_vertices()
     for i,result in enumerate(expected_vertices):
         assert v[i] == pytest.approx(result)
@@ -105,6 +106,60 @@ def test__can_see(pos1,pos2,vision_angle,orientation,expected_result):
     assert boid1._in_vision_angle(boid2) == expected_result
 
 
+def test_boids_share_species():
+    boid1 = Boid(speed=3)
+    boid2 = Boid(speed=3)
+    assert boid1.species is boid2.species
+    assert boid1.logic is boid2.logic
+    assert not hasattr(boid1,'__dict__')
+
+
+def test_override_moves_to_other_species():
+    boid1 = Boid()
+    boid2 = Boid()
+    boid2.length = 30
+    assert boid2.species is not boid1.species
+    assert boid2.offsets[0] == (15,0)
+    assert boid1.length == 20
+    boid2.length = 20
+    assert boid2.species is boid1.species
+
+
+def test_cos_vision_angle_follows_vision_angle():
+    boid = Boid(vision_angle=60)
+    assert boid.cos_vision_angle == pytest.approx(0.5)
+    boid.vision_angle = 270
+    assert boid.cos_vision_angle == pytest.approx(-1)
+
+
+def test_angle_is_cached_until_orientation_changes():
+    boid = Boid(orientation=90)
+    assert boid.angle == pytest.approx(math.pi / 2)
+    assert boid._last_orientation == 90
+    boid.orientation = 180
+    assert boid.angle == pytest.approx(math.pi) and boid.direction == pytest.approx((-1,0))
+
+
+def test_quantised_trig_matches_exact_on_steps():
+    for orientation in (0,37.25,90,359.75):
+        exact = Boid(position=(100,100),orientation=orientation)
+        quantised = Boid(position=(100,100),orientation=orientation,angle_step=0.25)
+        assert quantised.get_vertices() == pytest.approx(exact.get_vertices())
+        assert quantised.get_heading() == pytest.approx(exact.get_heading())
+    # between steps, orientation is rounded to the nearest step
+    boid = Boid(position=(100,100),orientation=359.9,angle_step=0.25,size=20)
+    assert boid.angle == 0 and boid.get_vertices() == pytest.approx([110,100,90,90,90,110])
+    assert boid.species.vertex_template(0) is boid.species.vertex_template(0)
+    # changing the step takes effect without the orientation changing
+    boid.angle_step = 90
+    boid.orientation = 50
+    assert boid.angle == pytest.approx(math.pi / 2)
+    boid.angle_step = None
+    assert boid.angle == pytest.approx(math.pi * 50 / 180)
+    with pytest.raises(ValueError):
+        Boid(angle_step=7)
+
+
 @pytest.mark.parametrize('pos1,pos2,orientation,expected_result',(
         ((0,0),(1,1),0,45),
         ((0,1),(1,0),0,45),
@@ -130,4 +185,52 @@ def test__angle_from_me_to_position(pos1,pos2,orientation,expected_result):
         ((0,1),(1,0),90)
 ))
 def test_angle_between_vectors(v1,v2,expected_result):
-    assert angle_between_vectors(v1,v2) == pytest.approx(expected_result)
\ No newline at end of file
+    assert angle_between_vectors(v1,v2) == pytest.approx(expected_result)
+
+
+@pytest.mark.parametrize('a1,a2,b1,b2,expected_result',(
+        ((0,0),(10,0),(5,-5),(5,5),5),
+        ((0,0),(10,0),(5,1),(5,5),None),
+        ((0,0),(10,0),(10,0),(10,5),10),
+        ((0,0),(10,0),(0,1),(10,1),None),
+        ((0,0),(10,0),(4,0),(20,0),4),
+        ((0,0),(10,0),(-5,0),(3,0),0),
+        ((0,0),(10,0),(11,0),(20,0),None),
+        ((0,0),(0,0),(-1,-1),(1,1),0),
+        ((0,0),(0,0),(1,1),(2,2),None),
+        ((0,0),(10,0),(3,0),(3,0),3)
+))
+def test_segment_intersection_distance(a1,a2,b1,b2,expected_result):
+    result = segment_intersection_distance(a1,a2,b1,b2)
+    if expected_result is None:
+        assert result is None
+    else:
+        assert result == pytest.approx(expected_result)
+
+
+def test_segment_intersection_distance_matches_shapely():
+    geometry = pytest.importorskip('shapely.geometry')
+    rng = random.Random(2)
+    for _ in range(2000):
+        a1, a2, b1, b2 = [(rng.randint(0,20),rng.randint(0,20)) for _ in range(4)]
+        l1 = geometry.LineString((a1,a2))
+        l2 = geometry.LineString((b1,b2))
+        result = segment_intersection_distance(a1,a2,b1,b2)
+        if l1.intersects(l2):
+            assert result == pytest.approx(geometry.Point(a1).distance(l1.intersection(l2)))
+        else:
+            assert result is None
+
+
+@pytest.mark.parametrize('pos1,orientation1,pos2,orientation2,expected_change',(
+        ((100,100),0,(130,80),90,1),
+        ((100,100),0,(150,80),135,-1),
+        ((100,100),0,(100,130),0,0),
+        ((635,100),0,(15,80),90,1)
+))
+def test_check_for_collision(pos1,orientation1,pos2,orientation2,expected_change):
+    boid1 = Boid(position=pos1,orientation=orientation1,vision_range=60)
+    boid2 = Boid(position=pos2,orientation=orientation2,vision_range=60)
+    severity, change = check_for_collision(boid1,boid2)
+    assert change == expected_change
+    assert (severity > 0) == (change != 0)
@@ -0,0 +1,218 @@
+import random
+import pytest
+import numpy as np
+from _boid import adjust_position_for_boundaries, get_displacement
+from _boidarrays import BoidArrays, ArrayBoid, find_neighbours, recommendations_avoidance, \
+    recommendations_matching, recommendations_centering, recommendations, vertices, DEFAULT_RULES
+from _boidcollection import BoidCollection
+from _boidprofile import TickProfiler
+
+
+@pytest.fixture
+def boidcollection():
+    random.seed(1)
+    boidcollection = BoidCollection(array_backed=True)
+    boidcollection.add(150)
+    return boidcollection
+
+
+def test_append_grows():
+    arrays = BoidArrays(capacity=2)
+    for expected in range(5):
+        assert arrays.append() == expected
+    assert len(arrays) == 5
+    assert arrays.capacity >= 5
+    assert arrays.positions.shape == (5,2)
+
+
+def test_remove_moves_last_row():
+    arrays = BoidArrays()
+    for i in range(3):
+        arrays.append()
+        arrays.orientations[i] = i
+    assert arrays.remove(0) == 2
+    assert arrays.orientations.tolist() == [2,1]
+
+
+def test_view_writes_through():
+    arrays = BoidArrays()
+    boid = ArrayBoid(arrays,position=(3,4),orientation=90,speed=5,specific_colour=(1,2,3))
+    assert arrays.positions[0].tolist() == [3,4]
+    boid.position[0] += 1
+    boid.orientation = 45
+    assert arrays.positions[0].tolist() == [4,4]
+    assert arrays.orientations[0] == 45
+    assert boid.speed == 5
+    assert boid.colour == (1,2,3)
+
+
+def test_remove_keeps_views_aligned(boidcollection):
+    boids = list(boidcollection.views)
+    boidcollection.remove(boids[0])
+    assert len(boidcollection.views) == len(boidcollection.arrays) == 149
+    for index, boid in enumerate(boidcollection.views):
+        assert boid._index == index
+    assert boidcollection.views[0] is boids[-1]
+
+
+def test_add_rejects_other_bounds(boidcollection):
+    with pytest.raises(ValueError):
+        boidcollection.add(bounds=(0,100,0,100))
+
+
+def test_neighbours_match_scalar(boidcollection):
+    displacements = boidcollection.get_displacements()
+    for boid in boidcollection.views:
+        expected = [other for other in boidcollection.views if other is not boid and
+                    displacements[boid][other] < boid.vision_range and boid._in_vision_angle(other)]
+        assert list(boid.neighbours) == expected
+        for other, distance in boid.neighbours.items():
+            assert distance == pytest.approx(get_displacement(boid,other))
+
+
+def test_recommendations_match_scalar(boidcollection):
+    neighbours = find_neighbours(boidcollection.arrays,boidcollection.bounds)
+    avoidance = np.stack(recommendations_avoidance(boidcollection.arrays,neighbours,boidcollection.bounds),axis=1)
+    matching = np.stack(recommendations_matching(boidcollection.arrays,neighbours),axis=1)
+    centering = np.stack(recommendations_centering(boidcollection.arrays,neighbours),axis=1)
+    assert avoidance[:,1].any()
+    for index, boid in enumerate(boidcollection.views):
+        assert avoidance[index] == pytest.approx(boid._get_recommendation_avoidance())
+        assert matching[index] == pytest.approx(boid._get_recommendation_matching())
+        assert centering[index] == pytest.approx(boid._get_recommendation_centering())
+
+
+def test_tick_matches_scalar(boidcollection):
+    expected = []
+    for boid in boidcollection.views:
+        recommendations = [boid._get_recommendation_avoidance(),
+                           boid._get_recommendation_matching(),
+                           boid._get_recommendation_centering()]
+        orientation = (boid.orientation + boid.logic.from_recommendations(recommendations)) % 360
+        angle = np.pi * orientation / 180
+        position = (boid.position[0] + boid.speed * np.cos(angle), boid.position[1] + boid.speed * np.sin(angle))
+        expected.append((orientation,adjust_position_for_boundaries(position,boid.bounds,boid.tolerance)))
+    boidcollection.tick()
+    for boid, (orientation, position) in zip(boidcollection.views,expected):
+        assert boid.orientation == pytest.approx(orientation)
+        assert boid.position.tolist() == pytest.approx(position)
+
+
+def test_vertices_match_scalar(boidcollection):
+    bulk = vertices(boidcollection.arrays)
+    for index, boid in enumerate(boidcollection.views):
+        assert bulk[index].tolist() == pytest.approx(boid.get_vertices())
+
+
+def test_get_displacements(boidcollection):
+    displacements = boidcollection.get_displacements()
+    boids = boidcollection.views
+    assert len(displacements[boids[0]]) == len(boids) - 1
+    assert displacements[boids[0]][boids[1]] == pytest.approx(get_displacement(boids[0],boids[1]))
+
+
+def test_neighbours_brute_force_matches_cell_list(boidcollection,monkeypatch):
+    cell_list = find_neighbours(boidcollection.arrays,boidcollection.bounds)
+    monkeypatch.setattr('_boidarrays.BRUTE_FORCE_LIMIT',len(boidcollection.arrays))
+    brute_force = find_neighbours(boidcollection.arrays,boidcollection.bounds)
+    assert brute_force.indptr.tolist() == cell_list.indptr.tolist()
+    assert brute_force.indices.tolist() == cell_list.indices.tolist()
+    assert brute_force.distances.tolist() == cell_list.distances.tolist()
+
+
+def _positions_by_row(boids,neighbours):
+    return {tuple(boid.position[:]):{tuple(boids[j].position[:]) for j in neighbours.indices[start:end].tolist()}
+            for boid, start, end in zip(boids,neighbours.indptr[:-1],neighbours.indptr[1:])}
+
+
+@pytest.mark.parametrize('radius,angle',((None,None),(100,None),(30,180)))
+def test_query_neighbours_matches_scalar(boidcollection,radius,angle):
+    random.seed(1)
+    scalar = BoidCollection()
+    scalar.add(150)
+    scalar_boids, expected = scalar.query_neighbours(radius,angle)
+    boids, neighbours = boidcollection.query_neighbours(radius,angle)
+    assert _positions_by_row(boids,neighbours) == _positions_by_row(scalar_boids,expected)
+
+
+def test_neighbours_view(boidcollection):
+    boid = boidcollection.views[0]
+    neighbours = boid.neighbours
+    displacements = boidcollection.get_displacements()[boid]
+    assert len(neighbours) == len(list(neighbours)) > 0
+    for other in boidcollection.views:
+        if other in neighbours:
+            assert neighbours[other] == pytest.approx(displacements[other])
+    with pytest.raises(KeyError):
+        neighbours[boid]
+
+
+def _turn_left(arrays,neighbours,bounds):
+    return np.full(len(arrays),1000.0), -arrays.speeds
+
+
+def test_chunked_recommendations_match_whole_flock(boidcollection):
+    from concurrent.futures import ThreadPoolExecutor
+    from _boidobstacles import ObstacleLayer
+    rules = DEFAULT_RULES + (('obstacles',ObstacleLayer([[(0,100),(640,150)],[(300,0),(300,480)]]).recommendations),)
+    neighbours = boidcollection.get_neighbour_lists()
+    expected = recommendations(boidcollection.arrays,neighbours,boidcollection.bounds,rules=rules)
+    assert expected[1][:,3].any()
+    with ThreadPoolExecutor(3) as executor:
+        for chunks in (2,3,7):
+            severity, change = recommendations(boidcollection.arrays,neighbours,boidcollection.bounds,rules=rules,
+                                               executor=executor,chunks=chunks)
+            assert severity.tobytes() == expected[0].tobytes() and change.tobytes() == expected[1].tobytes()
+
+
+def test_take_rows(boidcollection):
+    neighbours = boidcollection.get_neighbour_lists()
+    part = neighbours.take_rows(40,90)
+    assert (part.start, part.stop) == (40,90)
+    counts = neighbours.counts
+    counts[:40] = 0
+    counts[90:] = 0
+    assert part.counts.tolist() == counts.tolist()
+    assert part.indices.tolist() == neighbours.indices[neighbours.indptr[40]:neighbours.indptr[90]].tolist()
+
+
+def test_custom_rules():
+    random.seed(1)
+    boidcollection = BoidCollection(array_backed=True,rules=DEFAULT_RULES + (('turn_left',_turn_left),))
+    boidcollection.add(50)
+    orientations = boidcollection.arrays.orientations.copy()
+    severity, change = recommendations(boidcollection.arrays,boidcollection.get_neighbour_lists(),
+                                       boidcollection.bounds,rules=boidcollection.rules)
+    assert severity.shape == change.shape == (50,4)
+    boidcollection.tick()
+    # the most severe rule uses up each boid's allowed change
+    assert boidcollection.arrays.orientations.tolist() == ((orientations - 2) % 360).tolist()
+
+
+def test_add_and_remove_update_candidates_in_place(boidcollection):
+    boidcollection.tick()
+    for index in (0,10,-1):
+        boidcollection.remove(boidcollection.views[index])
+    boidcollection.add(5)
+    boidcollection.spawn(5)
+    boidcollection.tick()
+    neighbours = boidcollection.get_neighbour_lists()
+    expected = find_neighbours(boidcollection.arrays,boidcollection.bounds)
+    assert neighbours.indptr.tolist() == expected.indptr.tolist()
+    assert neighbours.indices.tolist() == expected.indices.tolist()
+
+
+def test_skin_matches_rebuilding_every_tick():
+    collections = []
+    for skin in (0,40):
+        random.seed(1)
+        boidcollection = BoidCollection(array_backed=True,skin=skin,profiler=TickProfiler())
+        boidcollection.add(300)
+        for _ in range(30):
+            boidcollection.tick()
+        collections.append(boidcollection)
+    unskinned, skinned = collections
+    assert skinned.arrays.positions.tolist() == unskinned.arrays.positions.tolist()
+    assert skinned.arrays.orientations.tolist() == unskinned.arrays.orientations.tolist()
+    assert sum(record['counts'].get('candidate_rebuilds',0) for record in unskinned.profiler.history) == 30
+    assert sum(record['counts'].get('candidate_rebuilds',0) for record in skinned.profiler.history) <= 4
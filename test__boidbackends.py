@@ -0,0 +1,128 @@
+import pickle
+import numpy as np
+import pytest
+from _boidbackends import KERNELS, KernelBackend, available_backends, get_backend, loop_kernels, register_backend, \
+    _factories, _backends
+from _boidcollection import BoidCollection
+
+BOUNDS = (0,640,0,480)
+
+
+def _plain_loop_kernels():
+    '''
+    loop_kernels run as plain Python, checking the source numba compiles without needing numba
+    '''
+    return loop_kernels(lambda function: np.vectorize(function,otypes=[np.float64]),lambda function: function)
+
+
+@pytest.fixture
+def loops():
+    '''
+    Registers _plain_loop_kernels as 'loops' for one test, leaving the registry as it was afterwards
+    '''
+    register_backend('loops',_plain_loop_kernels)
+    yield 'loops'
+    _factories.pop('loops',None)
+    _backends.pop('loops',None)
+
+
+@pytest.fixture(params=('python','loops'))
+def name(request):
+    if request.param == 'loops':
+        request.getfixturevalue('loops')
+    return request.param
+
+
+def _segments(rng,n):
+    '''
+    Heading segment pairs, including parallel, collinear, touching and zero-length ones
+    '''
+    starts_1 = rng.uniform(0,100,(n,2)).round()
+    ends_1 = starts_1 + rng.uniform(-40,40,(n,2)).round()
+    starts_2 = rng.uniform(0,100,(n,2)).round()
+    ends_2 = starts_2 + rng.uniform(-40,40,(n,2)).round()
+    quarter = n // 4
+    # parallel and collinear
+    ends_2[:quarter] = starts_2[:quarter] + (ends_1[:quarter] - starts_1[:quarter])
+    starts_2[quarter:2 * quarter] = starts_1[quarter:2 * quarter] + 0.5 * (ends_1[quarter:2 * quarter] - starts_1[quarter:2 * quarter])
+    ends_2[quarter:2 * quarter] = starts_1[quarter:2 * quarter] + 2 * (ends_1[quarter:2 * quarter] - starts_1[quarter:2 * quarter])
+    # touching at an end, and points
+    starts_2[2 * quarter:2 * quarter + 10] = ends_1[2 * quarter:2 * quarter + 10]
+    ends_1[-10:] = starts_1[-10:]
+    return starts_1, ends_1, starts_2, ends_2
+
+
+def test_backends_agree_with_numpy(name):
+    rng = np.random.default_rng(5)
+    backend = get_backend(name)
+    numpy = get_backend('numpy')
+    n1, n2 = rng.uniform(-10,650,200), rng.uniform(-10,650,200)
+    assert np.allclose(backend.find_shortest_paths(n1,n2,640),numpy.find_shortest_paths(n1,n2,640))
+    # halfway across the bounds both round to even
+    assert np.allclose(backend.find_shortest_paths(np.array([0.0,0.0]),np.array([320.0,960.0]),640),
+                       numpy.find_shortest_paths(np.array([0.0,0.0]),np.array([320.0,960.0]),640))
+    x1, y1, x2, y2 = rng.normal(0,5,(4,200))
+    x1[:5] = y1[:5] = 0
+    assert np.allclose(backend.distances_between_points(x1,y1,x2,y2),numpy.distances_between_points(x1,y1,x2,y2))
+    assert np.allclose(backend.angles_between_vectors(x1,y1,x2,y2),numpy.angles_between_vectors(x1,y1,x2,y2))
+    assert np.allclose(backend.angles_between_vectors(1.0,0.0,x2,y2),numpy.angles_between_vectors(1.0,0.0,x2,y2))
+    positions = rng.uniform(-20,660,(200,2))
+    expected = positions.copy()
+    numpy.adjust_positions_for_boundaries(expected,BOUNDS,1e-3)
+    backend.adjust_positions_for_boundaries(positions,BOUNDS,1e-3)
+    assert np.allclose(positions,expected)
+    segments = _segments(rng,400)
+    orientations_1, orientations_2 = rng.uniform(0,360,(2,400))
+    severity, change = backend.collision_recommendations(*segments,orientations_1,orientations_2)
+    expected_severity, expected_change = numpy.collision_recommendations(*segments,orientations_1,orientations_2)
+    assert np.count_nonzero(expected_change) > 100
+    assert np.allclose(severity,expected_severity) and np.array_equal(change,expected_change)
+
+
+def test_registry(loops):
+    assert get_backend() is get_backend('numpy') is get_backend(get_backend('numpy'))
+    assert available_backends()[-1] == 'loops' and 'python' in available_backends()
+    assert get_backend('auto').name == available_backends()[0]
+    assert pickle.loads(pickle.dumps(get_backend('python'))) is get_backend('python')
+    with pytest.raises(ValueError):
+        get_backend('fortran')
+    with pytest.raises(ValueError):
+        KernelBackend('partial',{KERNELS[0]:abs})
+
+
+def test_numba_backend():
+    pytest.importorskip('numba')
+    assert available_backends()[0] == 'numba'
+    test_backends_agree_with_numpy('numba')
+
+
+def test_collection_ticks_with_backend(name):
+    flocks = [BoidCollection(array_backed=True,headless=True,seed=2,kernels=kernels) for kernels in (None,name)]
+    for boidcollection in flocks:
+        boidcollection.spawn(60)
+        for _ in range(15):
+            boidcollection.tick()
+    assert flocks[1].kernels is get_backend(name)
+    assert np.allclose(flocks[0].arrays.positions,flocks[1].arrays.positions)
+    assert np.allclose(flocks[0].arrays.orientations,flocks[1].arrays.orientations)
+
+
+def test_snapshot_keeps_the_backend(tmp_path,name):
+    path = str(tmp_path / 'flock.boids')
+    boidcollection = BoidCollection(array_backed=True,headless=True,seed=2,kernels=name)
+    boidcollection.spawn(60)
+    boidcollection.tick()
+    boidcollection.snapshot(path)
+    restored = BoidCollection.restore(path)
+    assert restored.kernels is get_backend(name)
+    for collection in (boidcollection,restored):
+        for _ in range(10):
+            collection.tick()
+    assert np.array_equal(restored.arrays.positions,boidcollection.arrays.positions)
+    assert np.array_equal(restored.arrays.orientations,boidcollection.arrays.orientations)
+
+
+def test_loops_fixture_leaves_the_registry_as_it_was():
+    assert 'loops' not in available_backends()
+    with pytest.raises(ValueError):
+        get_backend('loops')
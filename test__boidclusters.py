@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from _boidclusters import ClusterTracker, connect
+from _boidcollection import BoidCollection
+from _boidprofile import TickProfiler
+
+
+def _components(n,rows,columns):
+    '''
+    Connected components by depth-first search, as the smallest index in each boid's component
+    '''
+    adjacent = [set() for _ in range(n)]
+    for row, column in zip(rows.tolist(),columns.tolist()):
+        adjacent[row].add(column)
+        adjacent[column].add(row)
+    roots = [-1] * n
+    for start in range(n):
+        if roots[start] < 0:
+            roots[start] = start
+            stack = [start]
+            while stack:
+                for other in adjacent[stack.pop()]:
+                    if roots[other] < 0:
+                        roots[other] = start
+                        stack.append(other)
+    return roots
+
+
+@pytest.mark.parametrize('edges',(0,50,150,400))
+def test_connect_matches_search(edges):
+    rng = np.random.default_rng(edges)
+    rows, columns = rng.integers(0,200,edges), rng.integers(0,200,edges)
+    assert connect(200,rows,columns).tolist() == _components(200,rows,columns)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_clusters_of_a_flock(array_backed):
+    tracker = ClusterTracker()
+    boidcollection = BoidCollection(array_backed=array_backed,headless=True,clusters=tracker)
+    # a group across the left and right bounds, a group in the middle and a boid on its own
+    boidcollection.add(position=(630,100),orientation=0)
+    boidcollection.add(position=(10,100),orientation=180)
+    boidcollection.add(position=(300,300),orientation=0)
+    boidcollection.add(position=(320,300),orientation=180)
+    boidcollection.add(position=(340,300),orientation=180)
+    boidcollection.add(position=(100,400),orientation=90)
+    boidcollection.tick()
+    assert tracker.sizes.tolist() == [2,3,1]
+    assert tracker.ids.tolist() == [0,0,1,1,1,2]
+    assert len(tracker) == 3 and tracker.cluster_of(boidcollection.get(4)) == 1
+    assert tracker.members(1).tolist() == [2,3,4]
+    positions = np.array([boidcollection.get(handle).position for handle in range(6)])
+    centroids = tracker.centroids
+    # the first group is averaged across the bounds, not across the window
+    assert positions[0,0] > 600 and positions[1,0] < 40
+    assert (centroids[0,0] + 320) % 640 - 320 == pytest.approx((positions[0,0] - 640 + positions[1,0]) / 2)
+    assert centroids[0,1] == pytest.approx(positions[:2,1].mean())
+    assert centroids[1] == pytest.approx(positions[2:5].mean(axis=0))
+    assert centroids[2] == pytest.approx(positions[5])
+    ids, sizes, centroids = tracker.summary(min_size=2)
+    assert ids.tolist() == [0,1] and sizes.tolist() == [2,3] and centroids.shape == (2,2)
+
+
+def test_scalar_centroids_wrap_at_the_boids_bounds():
+    tracker = ClusterTracker()
+    boidcollection = BoidCollection(headless=True,clusters=tracker)
+    # the collection keeps its default bounds; only the boids know theirs
+    boidcollection.add(position=(195,100),orientation=90,bounds=(0,200,0,200),speed=0)
+    boidcollection.add(position=(5,100),orientation=90,bounds=(0,200,0,200),speed=0)
+    boidcollection.tick()
+    assert tracker.sizes.tolist() == [2]
+    assert (tracker.centroids[0,0] + 100) % 200 - 100 == pytest.approx(0)
+    assert tracker.centroids[0,1] == pytest.approx(100)
+
+
+def test_clusters_follow_the_neighbour_graph():
+    tracker = ClusterTracker()
+    profiler = TickProfiler()
+    boidcollection = BoidCollection(array_backed=True,headless=True,seed=3,clusters=tracker,profiler=profiler,
+                                    bounds=(0,1280,0,960))
+    boidcollection.spawn(150)
+    for _ in range(10):
+        neighbours = boidcollection.get_neighbour_lists()
+        roots = _components(150,neighbours.rows,neighbours.indices)
+        boidcollection.tick()
+        assert tracker.sizes.sum() == 150
+        # boids share an id exactly when they share a component
+        assert len(set(zip(roots,tracker.ids.tolist()))) == len(set(roots)) == len(tracker)
+    assert tracker.updates == 10 and tracker.resets == 1
+    assert 'clusters' in profiler.history[-1]['times']
+    boidcollection.remove(boidcollection.get(0))
+    boidcollection.tick()
+    assert tracker.resets == 2 and tracker.sizes.sum() == 149
+
+
+def test_ids_persist_through_merges_and_splits():
+    tracker = ClusterTracker()
+    boidcollection = BoidCollection(array_backed=True,headless=True,clusters=tracker)
+    boidcollection.spawn(6)
+    edges = lambda *pairs: (np.array([pair[0] for pair in pairs]),np.array([pair[1] for pair in pairs]))
+    tracker.update(boidcollection,*edges((0,1),(2,3),(3,4)))
+    assert tracker.cluster_ids.tolist() == [0,1,2] and tracker.sizes.tolist() == [2,3,1]
+    # 0-1 and 2-3-4 merge; 5 stays alone
+    tracker.update(boidcollection,*edges((0,1),(1,2),(2,3),(3,4)))
+    assert tracker.cluster_ids.tolist() == [0,2] and tracker.sizes.tolist() == [5,1]
+    # the merged cluster splits into 0-1 and 2-3-4: the larger part keeps the id
+    tracker.update(boidcollection,*edges((0,1),(2,3),(3,4)))
+    assert tracker.cluster_ids.tolist() == [3,0,2] and tracker.sizes.tolist() == [2,3,1]
+
+
+def test_sharded_clusters_use_the_workers_graph(monkeypatch):
+    trackers = [ClusterTracker() for _ in range(2)]
+    single, sharded = [BoidCollection(array_backed=True,headless=True,seed=5,shards=shards,clusters=tracker)
+                       for shards, tracker in zip((None,(2,2)),trackers)]
+    for boidcollection in (single,sharded):
+        boidcollection.spawn(200)
+    # no neighbour search outside the workers
+    monkeypatch.setattr(sharded,'get_neighbour_lists',None)
+    try:
+        for _ in range(5):
+            single.tick()
+            sharded.tick()
+            assert trackers[1].ids.tolist() == trackers[0].ids.tolist()
+            assert trackers[1].sizes.tolist() == trackers[0].sizes.tolist()
+            assert np.allclose(trackers[1].centroids,trackers[0].centroids)
+    finally:
+        sharded.close()
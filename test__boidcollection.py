@@ -1,6 +1,11 @@
+import os
 import random
+import subprocess
+import sys
+import numpy as np
 import pytest
 from _boidcollection import BoidCollection
+from _boidprofile import TickProfiler
 
 
 @pytest.fixture
@@ -30,4 +35,287 @@ def test_get_displacements(boidcollection,position1,position2,expected_value):
     b1 = boidcollection.add(position=position1,bounds=(0,640,0,480))[0]
     b2 = boidcollection.add(position=position2,bounds=(0,640,0,480))[0]
     displacements = boidcollection.get_displacements()
-    assert displacements[b1][b2] == pytest.approx(expected_value)
\ No newline at end of file
+    assert displacements[b1][b2] == pytest.approx(expected_value)
+
+def test_neighbours_match_brute_force(boidcollection):
+    boidcollection.add(200,bounds=(0,640,0,480))
+    displacements = boidcollection.get_displacements()
+    for boid in boidcollection.boids:
+        expected = {other for other, displacement in displacements[boid].items()
+                    if displacement < boid.vision_range and boid._in_vision_angle(other)}
+        assert set(boid.neighbours) == expected
+
+
+def test_neighbours_match_brute_force_between_rebuilds():
+    random.seed(1)
+    boidcollection = BoidCollection(profiler=TickProfiler())
+    boidcollection.add(100,bounds=(0,640,0,480))
+    for _ in range(15):
+        boidcollection.tick()
+    displacements = boidcollection.get_displacements()
+    for boid in boidcollection.boids:
+        expected = {other for other, displacement in displacements[boid].items()
+                    if displacement < boid.vision_range and boid._in_vision_angle(other)}
+        assert set(boid.neighbours) == expected
+    assert sum(record['counts'].get('index_rebuilds',0) for record in boidcollection.profiler.history) < 15
+
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_neighbours_follow_a_longer_vision_range(array_backed):
+    boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=1)
+    boidcollection.add(200,bounds=(0,640,0,480))
+    boidcollection.tick()
+    boid = boidcollection.get(0)
+    assert len(boid.neighbours) < 20
+    boid.vision_range = 300
+    for _ in range(2):
+        displacements = boidcollection.get_displacements()
+        expected = {other for other, displacement in displacements[boid].items()
+                    if displacement < 300 and boid._in_vision_angle(other)}
+        assert len(expected) > 100 and set(boid.neighbours) == expected
+        boidcollection.tick()
+
+@pytest.mark.parametrize('radius,angle',((None,None),(100,None),(None,180),(30,45)))
+def test_query_neighbours_matches_brute_force(boidcollection,radius,angle):
+    boidcollection.add(200,bounds=(0,640,0,480))
+    boidcollection.tick()
+    boids, neighbours = boidcollection.query_neighbours(radius,angle)
+    displacements = boidcollection.get_displacements()
+    for row, boid in enumerate(boids):
+        boid.vision_range = radius or boid.vision_range
+        boid.vision_angle = angle or boid.vision_angle
+        expected = sorted(boids.index(other) for other, displacement in displacements[boid].items()
+                          if displacement < boid.vision_range and boid._in_vision_angle(other))
+        assert neighbours.indices[neighbours.indptr[row]:neighbours.indptr[row + 1]].tolist() == expected
+
+
+def test_query_neighbours_rejects_mixed_bounds(boidcollection):
+    boidcollection.add(5,bounds=(0,640,0,480))
+    boidcollection.add(5,bounds=(0,320,0,240))
+    with pytest.raises(ValueError):
+        boidcollection.query_neighbours()
+
+
+def test_handles_are_stable(boidcollection):
+    boids = boidcollection.add(5)
+    assert [boid.handle for boid in boids] == [0,1,2,3,4]
+    boidcollection.remove(boids[1])
+    boidcollection.remove(3)
+    assert boidcollection.add()[0].handle == 5
+    assert boidcollection.get(4) is boids[4]
+    with pytest.raises(KeyError):
+        boidcollection.get(3)
+
+
+def test_add_and_remove_update_index_in_place():
+    random.seed(1)
+    boidcollection = BoidCollection(profiler=TickProfiler())
+    boidcollection.add(100)
+    for tick in range(12):
+        boidcollection.tick()
+        boidcollection.remove(random.choice(sorted(boidcollection.boids,key=lambda boid: boid.handle)))
+        boidcollection.add(2,vision_range=random.choice((40,60,90)))
+        displacements = boidcollection.get_displacements()
+        for boid in boidcollection.boids:
+            expected = {other for other, displacement in displacements[boid].items()
+                        if displacement < boid.vision_range and boid._in_vision_angle(other)}
+            assert set(boid.neighbours) == expected
+    assert sum(record['counts'].get('index_rebuilds',0) for record in boidcollection.profiler.history) < 6
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_spawn(array_backed):
+    spawned = []
+    for _ in range(2):
+        random.seed(1)
+        boidcollection = BoidCollection(array_backed=array_backed,headless=True)
+        boidcollection.add(3)
+        boids = boidcollection.spawn(200,palette=(0,128,255),speed=3)
+        spawned.append([(tuple(boid.position[:]),boid.orientation,boid.colour) for boid in boids])
+    assert spawned[0] == spawned[1]
+    assert len(boidcollection.boids) == 203
+    assert [boid.handle for boid in boids] == list(range(3,203))
+    for boid in boids:
+        assert 0 <= boid.position[0] <= 640 and 0 <= boid.position[1] <= 480
+        assert 0 <= boid.orientation < 360
+        assert boid.colour[0] <= 40 and 88 <= boid.colour[1] <= 168 and boid.colour[2] >= 215
+        assert boid.speed == 3 and boid.collection is boidcollection
+    boidcollection.tick()
+
+
+def test_spawn_given_positions(boidcollection):
+    boids = boidcollection.spawn(3,position=[(1,2),(3,4),(5,6)],orientation=90)
+    assert [boid.position for boid in boids] == [[1,2],[3,4],[5,6]]
+    assert [boid.orientation for boid in boids] == [90,90,90]
+
+
+def _state(boidcollection):
+    return sorted((boid.handle,tuple(boid.position[:]),boid.orientation,tuple(boid.colour))
+                  for boid in boidcollection.boids)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_seed_is_reproducible(array_backed):
+    states = []
+    for _ in range(2):
+        random.seed()
+        boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=7)
+        boidcollection.add(30,vision_range=70)
+        boidcollection.spawn(30)
+        for tick in range(5):
+            boidcollection.tick()
+        states.append(_state(boidcollection))
+    assert states[0] == states[1]
+
+
+@pytest.mark.parametrize('array_backed,mmap,angle_step',((False,False,None),(False,False,0.25),(True,False,None),
+                                                         (True,True,None)))
+def test_snapshot_and_restore_continue_the_run(tmp_path,array_backed,mmap,angle_step):
+    path = str(tmp_path / 'flock.boids')
+    boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=3,bounds=(0,300,0,200),
+                                    angle_step=angle_step)
+    boidcollection.add(40,bounds=(0,300,0,200))
+    boidcollection.add(10,bounds=(0,300,0,200),vision_range=90,specific_colour=(1,2,3))
+    for tick in range(4):
+        boidcollection.tick()
+    boidcollection.remove(5)
+    boidcollection.snapshot(path)
+    restored = BoidCollection.restore(path,mmap=mmap)
+    assert restored.bounds == (0,300,0,200) and restored.array_backed == array_backed
+    assert restored.angle_step == angle_step
+    assert [boid.colour for boid in restored.boids].count((1,2,3)) == 10
+    assert _state(restored) == _state(boidcollection)
+    for collection in (boidcollection,restored):
+        for tick in range(6):
+            collection.tick()
+        collection.add(2,bounds=(0,300,0,200))
+        collection.tick()
+    assert _state(restored) == _state(boidcollection)
+    assert restored.get(50).handle == 50
+
+
+def test_snapshot_rejects_custom_logic(tmp_path,boidcollection):
+    from _boidlogic import Priority
+    boidcollection.add(2,logic=Priority(2))
+    with pytest.raises(ValueError):
+        boidcollection.snapshot(str(tmp_path / 'flock.boids'))
+
+
+def test_boids_decide_from_the_state_at_the_start_of_the_tick():
+    forwards = BoidCollection(headless=True,seed=6)
+    forwards.add(80)
+    backwards = BoidCollection(headless=True,seed=6)
+    backwards.add(80)
+    backwards.handles = dict(reversed(list(backwards.handles.items())))
+    arrays = BoidCollection(array_backed=True,headless=True,seed=6)
+    arrays.add(80)
+    for tick in range(10):
+        for collection in (forwards,backwards,arrays):
+            collection.tick()
+    assert _state(forwards) == _state(backwards)
+    for (handle, position, orientation, colour), boid in zip(_state(forwards),arrays.handles.values()):
+        assert position == pytest.approx(tuple(boid.position)) and orientation == pytest.approx(boid.orientation)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_workers_match_one_thread(array_backed):
+    states = []
+    for workers in (None,3):
+        boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=8,workers=workers)
+        boidcollection.add(100)
+        for tick in range(5):
+            boidcollection.tick()
+        assert (boidcollection.executor is not None) == bool(workers)
+        boidcollection.close()
+        assert boidcollection.executor is None
+        states.append(_state(boidcollection))
+    assert states[0] == states[1]
+
+
+def test_tick_with_mixed_bounds(boidcollection):
+    boidcollection.add(5,bounds=(0,640,0,480))
+    boidcollection.add(5,bounds=(0,320,0,240))
+    boidcollection.tick()
+    assert boidcollection.index is None
+
+
+def test_headless_never_imports_pyglet():
+    script = ('import sys, random; random.seed(1); from _boidcollection import BoidCollection; '
+              'c = BoidCollection(headless=True); c.add(20); c.tick(); '
+              'assert all(b.vertex_list is None for b in c.boids); '
+              'assert "pyglet" not in sys.modules')
+    subprocess.run([sys.executable,'-c',script],check=True,cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_headless_draw_raises():
+    boidcollection = BoidCollection(headless=True)
+    boidcollection.add(2)
+    with pytest.raises(RuntimeError):
+        boidcollection.draw()
+    with pytest.raises(RuntimeError):
+        next(iter(boidcollection.boids)).draw()
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_bulk_vertices_and_colours(array_backed):
+    random.seed(1)
+    boidcollection = BoidCollection(array_backed=array_backed)
+    boidcollection.add(30)
+    boids = boidcollection.views if array_backed else sorted(boidcollection.boids,key=lambda boid: boid.handle)
+    vertices = boidcollection.get_vertices()
+    colours = boidcollection.get_colours()
+    assert colours.tolist() == [c for boid in boids for c in boid.colour_info]
+    for boid, boid_vertices in zip(boids,vertices):
+        assert boid_vertices.tolist() == pytest.approx(boid.get_vertices())
+
+
+def test_quantised_vertices_come_from_templates(monkeypatch):
+    import _boidkernels
+    boidcollection = BoidCollection(headless=True,seed=4,angle_step=0.25)
+    boidcollection.spawn(20)
+    expected = [boid.get_vertices() for boid in sorted(boidcollection.boids,key=lambda boid: boid.handle)]
+
+    def rotate(*args):
+        raise AssertionError('quantised boids should not be rotated')
+
+    monkeypatch.setattr(_boidkernels,'get_vertices',rotate)
+    assert np.allclose(boidcollection.get_vertices(),expected)
+
+
+def test_quantised_flock_stays_close_to_exact():
+    flocks = [BoidCollection(headless=True,seed=4,angle_step=angle_step) for angle_step in (None,0.25)]
+    for boidcollection in flocks:
+        boidcollection.spawn(30)
+        for _ in range(5):
+            boidcollection.tick()
+    exact, quantised = (sorted(boidcollection.boids,key=lambda boid: boid.handle) for boidcollection in flocks)
+    assert all(boid.angle_step == 0.25 for boid in quantised)
+    for boid, other in zip(exact,quantised):
+        assert other.position == pytest.approx(boid.position,abs=0.5)
+    # some boids drawn exactly, the rest from their species' templates
+    flocks[1].add(5,angle_step=None)
+    boids = sorted(flocks[1].boids,key=lambda boid: boid.handle)
+    for boid, boid_vertices in zip(boids,flocks[1].get_vertices()):
+        assert boid_vertices.tolist() == pytest.approx(boid.get_vertices())
+    with pytest.raises(ValueError):
+        BoidCollection(array_backed=True,headless=True).add(angle_step=0.25)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_draw_uses_one_vertex_list(array_backed):
+    pyglet = pytest.importorskip('pyglet')
+    try:
+        import pyglet.graphics
+        assert pyglet.gl.current_context is not None
+    except Exception:
+        pytest.skip('no GL context available')
+    boidcollection = BoidCollection(array_backed=array_backed)
+    boidcollection.add(10)
+    boidcollection.draw()
+    assert boidcollection.vertex_list.get_size() == 30
+    boidcollection.add(5)
+    boidcollection.tick()
+    boidcollection.draw()
+    assert boidcollection.vertex_list.get_size() == 45
+    assert all(boid.vertex_list is None for boid in boidcollection.boids)
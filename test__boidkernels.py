@@ -0,0 +1,93 @@
+import pytest
+import numpy as np
+from _boid import _find_shortest_path, angle_between_vectors, adjust_position_for_boundaries, \
+    segment_intersection_distance
+from _boidkernels import find_shortest_paths, angles_between_vectors, adjust_positions_for_boundaries, \
+    cell_list_pairs, pair_displacements, symmetric_pair_displacements, displacement_matrix, \
+    segment_intersection_distances
+
+
+def test_find_shortest_paths():
+    rng = np.random.default_rng(1)
+    n1 = rng.uniform(0,800,100)
+    n2 = rng.uniform(0,800,100)
+    expected = [_find_shortest_path(a,b,800,10) for a, b in zip(n1,n2)]
+    assert find_shortest_paths(n1,n2,800,10).tolist() == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('v1,v2',(
+        ((0,1),(0,1)),
+        ((1,0),(-1,0)),
+        ((0,1),(1,0)),
+        ((0,0),(1,0)),
+        ((3,4),(-2,7))
+))
+def test_angles_between_vectors(v1,v2):
+    assert angles_between_vectors(*v1,*v2) == pytest.approx(angle_between_vectors(v1,v2))
+
+
+def test_adjust_positions_for_boundaries():
+    positions = np.array([[-1.,10],[641,10],[10,-1],[10,481],[10,10]])
+    expected = [adjust_position_for_boundaries(p,(0,640,0,480)) for p in positions.tolist()]
+    adjust_positions_for_boundaries(positions,(0,640,0,480),1E-8)
+    assert positions.tolist() == expected
+
+
+def test_cell_list_pairs_covers_close_pairs():
+    rng = np.random.default_rng(2)
+    positions = rng.uniform(0,1,(300,2)) * (640,480)
+    i, j = cell_list_pairs(positions,(0,640,0,480),60)
+    candidates = set(zip(i.tolist(),j.tolist()))
+    assert len(candidates) == len(i)
+    for a in range(len(positions)):
+        for b in range(len(positions)):
+            dx = _find_shortest_path(positions[a,0],positions[b,0],640)
+            dy = _find_shortest_path(positions[a,1],positions[b,1],480)
+            if a != b and (dx**2 + dy**2)**0.5 < 60:
+                assert (a,b) in candidates
+
+
+def test_cell_list_pairs_small_grid():
+    positions = np.array([[10.,10],[90,90],[50,50]])
+    i, j = cell_list_pairs(positions,(0,100,0,100),60)
+    assert sorted(zip(i.tolist(),j.tolist())) == [(0,1),(0,2),(1,0),(1,2),(2,0),(2,1)]
+
+
+@pytest.mark.parametrize('dtype',(np.float64,np.float32))
+def test_displacement_matrix(dtype):
+    rng = np.random.default_rng(3)
+    positions = rng.uniform(0,1,(50,2)) * (640,480)
+    dx, dy, distances = displacement_matrix(positions,(0,640,0,480),dtype)
+    assert distances.dtype == dtype
+    for a in range(len(positions)):
+        for b in range(len(positions)):
+            expected_dx = _find_shortest_path(positions[a,0],positions[b,0],640)
+            expected_dy = _find_shortest_path(positions[a,1],positions[b,1],480)
+            assert dx[a,b] == pytest.approx(expected_dx,abs=1E-3)
+            assert dy[a,b] == pytest.approx(expected_dy,abs=1E-3)
+            assert distances[a,b] == pytest.approx((expected_dx**2 + expected_dy**2)**0.5,abs=1E-3)
+
+
+def test_symmetric_pair_displacements_mirror():
+    rng = np.random.default_rng(4)
+    positions = rng.uniform(0,1,(200,2)) * (640,480)
+    i, j = cell_list_pairs(positions,(0,640,0,480),60)
+    mirrored = symmetric_pair_displacements(positions,(0,640,0,480),i,j)
+    assert sorted(zip(mirrored[0].tolist(),mirrored[1].tolist())) == sorted(zip(i.tolist(),j.tolist()))
+    direct = pair_displacements(positions,(0,640,0,480),mirrored[0],mirrored[1])
+    for computed, expected in zip(mirrored[2:],direct):
+        assert computed.tolist() == expected.tolist()
+
+
+
+def test_segment_intersection_distances():
+    rng = np.random.default_rng(5)
+    segments = rng.integers(0,20,(5000,8)).astype(float)
+    segments[:100,2:4] = segments[:100,0:2]
+    distances = segment_intersection_distances(*segments.T)
+    for segment, distance in zip(segments.tolist(),distances.tolist()):
+        expected = segment_intersection_distance(segment[0:2],segment[2:4],segment[4:6],segment[6:8])
+        if expected is None:
+            assert np.isnan(distance)
+        else:
+            assert distance == pytest.approx(expected)
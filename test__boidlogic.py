@@ -1,6 +1,8 @@
 import pytest
+import numpy as np
 
-from _boidlogic import Priority
+from _boidlogic import Priority, BaseLogic
+from _boidarrays import arbitrate
 
 
 @pytest.mark.parametrize('avoid,match,centre,allowed_change,expected_result',(
@@ -13,4 +15,29 @@ from _boidlogic import Priority
 def test_priority_from_recommendations(avoid,match,centre,allowed_change,expected_result):
     priority = Priority(allowed_change)
     recommendations = (avoid,match,centre)
-    assert priority.from_recommendations(recommendations) == expected_result
\ No newline at end of file
+    assert priority.from_recommendations(recommendations) == expected_result
+
+class Halve(BaseLogic):
+    def from_recommendations(self,recommendations):
+        return sum(change for severity, change in recommendations) / 2
+
+
+def test_base_logic_is_abstract():
+    with pytest.raises(TypeError):
+        BaseLogic()
+
+
+def test_priority_from_recommendation_arrays_matches_scalar():
+    rng = np.random.default_rng(1)
+    severity = rng.integers(0,4,(500,3)).astype(float)
+    change = rng.choice([0,-1,1,0.5,-2.5,3],(500,3))
+    logics = [Priority(allowed_change) for allowed_change in rng.choice([0,1,2,2.5],500).tolist()]
+    expected = [logic.from_recommendations(list(zip(s,c)))
+                for logic, s, c in zip(logics,severity.tolist(),change.tolist())]
+    assert Priority.from_recommendation_arrays(logics,severity,change).tolist() == expected
+
+
+def test_arbitrate_mixed_logics():
+    severity = np.array([[3.,2.,1.],[3.,2.,1.]])
+    change = np.array([[1.,1.,1.],[1.,1.,1.]])
+    assert arbitrate([Priority(2),Halve()],severity,change).tolist() == [2,1.5]
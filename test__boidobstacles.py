@@ -0,0 +1,82 @@
+import random
+import numpy as np
+import pytest
+from _boid import Boid, segment_intersection_distance
+from _boidarrays import BoidArrays
+from _boidcollection import BoidCollection
+from _boidobstacles import ObstacleLayer
+
+SQUARE = [(200,200),(300,200),(300,300),(200,300),(200,200)]
+WALL = [(0,100),(640,100)]
+
+
+def _brute_force(segments,start,end):
+    hits = [(distance,edge) for edge, (x1, y1, x2, y2) in enumerate(segments)
+            for distance in [segment_intersection_distance(start,end,(x1,y1),(x2,y2))] if distance is not None]
+    return min(hits) if hits else None
+
+
+@pytest.mark.parametrize('cell_size',(7,60,1000))
+def test_nearest_hits_match_brute_force(cell_size):
+    rng = random.Random(3)
+    obstacles = [[(rng.uniform(-50,700),rng.uniform(-50,500)) for _ in range(rng.randint(2,5))] for _ in range(30)]
+    layer = ObstacleLayer(obstacles + [SQUARE,WALL],cell_size)
+    starts = np.array([(rng.uniform(-100,740),rng.uniform(-100,580)) for _ in range(300)])
+    angles = np.array([rng.uniform(0,2 * np.pi) for _ in range(300)])
+    ends = starts + 60 * np.stack((np.cos(angles),np.sin(angles)),axis=1)
+    expected = {k:_brute_force(layer._segments,tuple(starts[k]),tuple(ends[k])) for k in range(300)}
+    boids, edges, distances = layer.nearest_hits(starts,ends)
+    assert boids.tolist() == [k for k, hit in expected.items() if hit is not None]
+    assert edges.tolist() == [expected[k][1] for k in boids.tolist()]
+    assert np.allclose(distances,[expected[k][0] for k in boids.tolist()])
+    for k in range(300):
+        assert layer.nearest_hit(tuple(starts[k]),tuple(ends[k])) == expected[k]
+
+
+def test_recommendation_turns_parallel_to_the_wall():
+    layer = ObstacleLayer([WALL])
+    boid = Boid(position=(100,80),orientation=60,headless=True)
+    severity, change = layer.recommendation(boid)
+    assert severity == pytest.approx(1/(20/np.sin(np.pi/3) + 0.0001))
+    assert change == pytest.approx(-60)
+    boid.orientation = 120
+    assert layer.recommendation(boid)[1] == pytest.approx(60)
+    boid.orientation = 240
+    assert layer.recommendation(boid) == (0,0)
+
+
+def test_array_recommendations_match_scalar():
+    random.seed(2)
+    layer = ObstacleLayer([SQUARE,WALL,[(400,0),(450,480)]],cell_size=25)
+    boids = [Boid(headless=True,vision_range=random.choice((30,60,120))) for _ in range(200)]
+    arrays = BoidArrays()
+    arrays.extend({'positions':[boid.position for boid in boids],
+                   'orientations':[boid.orientation for boid in boids],
+                   'speeds':[boid.speed for boid in boids],
+                   'vision_ranges':[boid.vision_range for boid in boids],
+                   'vision_angles':[boid.vision_angle for boid in boids],
+                   'lengths':[boid.length for boid in boids],
+                   'widths':[boid.width for boid in boids],
+                   'colours':[boid.colour for boid in boids]})
+    severity, change = layer.recommendations(arrays)
+    expected = [layer.recommendation(boid) for boid in boids]
+    assert any(s for s, c in expected)
+    assert np.allclose(severity,[s for s, c in expected])
+    assert np.allclose(change,[c for s, c in expected])
+
+
+def test_empty_layer():
+    layer = ObstacleLayer([])
+    assert len(layer) == 0
+    assert layer.recommendation(Boid(headless=True)) == (0,0)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_boids_steer_clear_of_obstacles(array_backed):
+    boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=1,
+                                    obstacles=ObstacleLayer([WALL]))
+    boidcollection.add(position=(100,40),orientation=80,speed=2)
+    for tick in range(40):
+        boidcollection.tick()
+        boid, = boidcollection.boids
+        assert boid.position[1] < 100
@@ -0,0 +1,88 @@
+import random
+import sys
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from _boidcollection import BoidCollection
+from _boidprofile import TickProfiler, timed
+
+
+def test_end_tick_records():
+    records = []
+    profiler = TickProfiler(window=2,callback=records.append)
+    for tick in range(3):
+        profiler.add_time('phase',tick)
+        profiler.count('counter',tick + 1)
+        with profiler.phase('context'):
+            pass
+        profiler.end_tick()
+    assert [record['tick'] for record in records] == [0,1,2]
+    assert records[-1]['counts'] == {'counter':3}
+    stats = profiler.stats()
+    assert stats['ticks'] == 2
+    assert stats['times']['phase'] == {'mean':1.5,'min':1,'max':2,'last':2}
+    assert stats['counts']['counter']['mean'] == 2.5
+    assert stats['times']['context']['min'] >= 0
+
+
+def test_missing_phase_counts_as_zero():
+    profiler = TickProfiler()
+    profiler.count('collision_checks',4)
+    profiler.end_tick()
+    profiler.end_tick()
+    assert profiler.stats()['counts']['collision_checks']['mean'] == 2
+
+
+def test_reset():
+    profiler = TickProfiler()
+    profiler.end_tick()
+    profiler.reset()
+    assert profiler.stats() == {'ticks':0,'times':{},'counts':{}}
+
+
+def test_timed():
+    profiler = TickProfiler()
+    assert timed(profiler,'phase',max,1,2) == 2
+    assert timed(None,'phase',max,1,2) == 2
+    assert 'phase' in profiler.times
+
+
+@pytest.mark.parametrize('array_backed,phases',(
+        (False,{'index','nearby','vision','avoidance','matching','centering','arbitration','movement','vertices'}),
+        (True,{'candidates','vision','avoidance','matching','centering','arbitration','movement'})
+))
+def test_collection_phases(array_backed,phases):
+    random.seed(1)
+    profiler = TickProfiler()
+    boidcollection = BoidCollection(array_backed=array_backed,profiler=profiler)
+    boidcollection.add(60)
+    boidcollection.tick()
+    boidcollection.tick()
+    stats = profiler.stats()
+    assert stats['ticks'] == 2
+    assert phases <= set(stats['times'])
+    assert stats['counts']['boids']['last'] == 60
+    assert stats['counts']['neighbours']['last'] == stats['counts']['collision_checks']['last'] > 0
+
+
+def test_counts_from_several_threads():
+    profiler = TickProfiler()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1E-6)
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: [profiler.count('checks') for _ in range(20000)],range(4)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert profiler.counts['checks'] == 80000
+
+
+def test_workers_count_like_one_thread():
+    counts = []
+    for workers in (None,4):
+        profiler = TickProfiler()
+        boidcollection = BoidCollection(headless=True,seed=2,workers=workers,profiler=profiler)
+        boidcollection.spawn(80)
+        boidcollection.tick()
+        boidcollection.close()
+        counts.append(profiler.history[-1]['counts'])
+    assert counts[0] == counts[1]
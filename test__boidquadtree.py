@@ -0,0 +1,98 @@
+import random
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from _boidarrays import BoidArrays, find_neighbours, recommendations, recommendations_centering, \
+    recommendations_matching, recommendations_avoidance, arbitrate, apply_changes
+from _boidcollection import BoidCollection
+from _boidquadtree import FlockTree, ApproximateRules, DEFAULT_AVOIDANCE_RANGE
+
+
+@pytest.fixture
+def boidcollection():
+    boidcollection = BoidCollection(array_backed=True,headless=True,seed=1,bounds=(0,400,0,300))
+    boidcollection.add(300,bounds=(0,400,0,300),vision_range=70)
+    # a tight cluster straddling the corner of the bounds
+    boidcollection.spawn(60,bounds=(0,400,0,300),position=[(random.Random(k).uniform(-15,15) % 400,
+                                                              random.Random(-k).uniform(-15,15) % 300)
+                                                             for k in range(60)],vision_range=70)
+    return boidcollection
+
+
+def _exact_sums(arrays,bounds):
+    neighbours = find_neighbours(arrays,bounds)
+    rows = neighbours.rows
+    n = len(arrays)
+    last = np.full(n,-1)
+    seen = neighbours.counts > 0
+    last[seen] = neighbours.indices[neighbours.indptr[1:][seen] - 1]
+    return [neighbours.counts,np.bincount(rows,neighbours.dx,n),np.bincount(rows,neighbours.dy,n),last]
+
+
+@pytest.mark.parametrize('leaf_size',(1,8,1000))
+def test_theta_zero_is_exact(boidcollection,leaf_size):
+    arrays = boidcollection.arrays
+    tree = FlockTree(arrays.positions,boidcollection.bounds,leaf_size)
+    cos_vision_angles = np.cos(np.pi * np.minimum(arrays.vision_angles,180) / 180)
+    sums = tree.aggregate(np.arange(len(arrays)),arrays.orientations,arrays.vision_ranges,cos_vision_angles,0)
+    for total, expected in zip(sums,_exact_sums(arrays,boidcollection.bounds)):
+        assert np.allclose(total,expected)
+    neighbours = find_neighbours(arrays,boidcollection.bounds)
+    rules = ApproximateRules(0,leaf_size)
+    for approximate, exact in ((rules.recommendations_centering,recommendations_centering),
+                               (rules.recommendations_matching,recommendations_matching)):
+        severity, change = approximate(arrays,None,boidcollection.bounds)
+        expected = exact(arrays,neighbours)
+        assert np.allclose(severity,expected[0]) and np.allclose(change,expected[1])
+
+
+def test_error_shrinks_with_theta(boidcollection):
+    arrays = boidcollection.arrays
+    exact = _exact_sums(arrays,boidcollection.bounds)[1]
+    errors = []
+    for theta in (1,0.5,0.2):
+        rules = ApproximateRules(theta,leaf_size=2)
+        rows, (count, dx, dy, last) = rules.aggregate(arrays,None,boidcollection.bounds)
+        errors.append(np.abs(dx - exact).mean())
+    assert errors[0] > errors[1] > errors[2] > 0
+
+
+def test_matching_follows_the_last_neighbour():
+    boidcollection = BoidCollection(array_backed=True,headless=True)
+    for position, orientation in (((100,100),0),((120,100),90),((120,110),350)):
+        boidcollection.add(position=position,orientation=orientation)
+    severity, change = ApproximateRules(0).recommendations_matching(boidcollection.arrays,None,boidcollection.bounds)
+    # as the scalar rule: the last neighbour's turn (350 - 0 is -10), shared between both neighbours
+    assert change[0] == pytest.approx(-5)
+    assert severity[0] == pytest.approx(5)
+
+
+def test_rules_in_chunks_and_ticks(boidcollection):
+    rules = ApproximateRules(0.5).rules()
+    arrays = boidcollection.arrays
+    neighbours = boidcollection.get_neighbour_lists()
+    expected = recommendations(arrays,neighbours,boidcollection.bounds,rules=rules)
+    with ThreadPoolExecutor(2) as executor:
+        chunked = recommendations(arrays,neighbours,boidcollection.bounds,rules=rules,executor=executor,chunks=3)
+    assert np.array_equal(chunked[0],expected[0]) and np.array_equal(chunked[1],expected[1])
+    boidcollection.rules = rules
+    boidcollection.tick()
+
+
+def test_ticks_only_find_neighbours_to_avoid(boidcollection):
+    arrays = BoidArrays.from_fields(boidcollection.arrays.get_fields())
+    bounds = boidcollection.bounds
+    near = find_neighbours(arrays,bounds,radii=DEFAULT_AVOIDANCE_RANGE)
+    everyone = find_neighbours(arrays,bounds)
+    results = (recommendations_avoidance(arrays,near,bounds),recommendations_matching(arrays,everyone),
+               recommendations_centering(arrays,everyone))
+    changes = arbitrate([boid.logic for boid in boidcollection.views],np.stack([r[0] for r in results],axis=1),
+                        np.stack([r[1] for r in results],axis=1))
+    apply_changes(arrays,changes,bounds,boidcollection.tolerance)
+    boidcollection.rules = ApproximateRules().rules()
+    boidcollection.neighbour_range = DEFAULT_AVOIDANCE_RANGE
+    neighbours = boidcollection.get_neighbour_lists()
+    assert np.array_equal(neighbours.indptr,near.indptr) and np.array_equal(neighbours.indices,near.indices)
+    boidcollection.tick()
+    assert np.allclose(boidcollection.arrays.positions,arrays.positions)
+    assert np.allclose(boidcollection.arrays.orientations,arrays.orientations)
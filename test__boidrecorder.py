@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from _boidcollection import BoidCollection
+from _boidrecorder import TrajectoryRecorder, TrajectoryReader
+
+
+def _positions(boidcollection):
+    return np.array([boid.position for boid in boidcollection.handles.values()],float)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+@pytest.mark.parametrize('stride,chunk_frames',((1,4),(3,2),(2,100)))
+def test_recording_matches_the_flock(tmp_path,array_backed,stride,chunk_frames):
+    path = str(tmp_path / 'flock.traj')
+    recorder = TrajectoryRecorder(path,stride,'float64',chunk_frames)
+    boidcollection = BoidCollection(array_backed=array_backed,headless=True,seed=2,recorder=recorder)
+    boidcollection.add(20)
+    boidcollection.remove(4)
+    expected = []
+    for tick in range(1,13):
+        boidcollection.tick()
+        if tick % stride == 0:
+            expected.append((_positions(boidcollection),
+                             [boid.orientation for boid in boidcollection.handles.values()]))
+        if tick == 5:
+            recorder.flush()
+            assert len(TrajectoryReader(path)) == 5 // stride
+    boidcollection.close()
+    reader = TrajectoryReader(path)
+    assert len(reader) == len(expected) and reader.stride == stride
+    assert reader.handles == [handle for handle in range(20) if handle != 4]
+    for (positions, orientations), (expected_positions, expected_orientations) in zip(reader,expected):
+        assert (positions == expected_positions).all()
+        assert orientations.tolist() == expected_orientations
+    assert (reader[-1][0] == expected[-1][0]).all()
+
+
+@pytest.mark.parametrize('dtype,tolerance',(('float32',1e-3),('float16',0.5)))
+def test_quantised_recording(tmp_path,dtype,tolerance):
+    path = str(tmp_path / 'flock.traj')
+    boidcollection = BoidCollection(array_backed=True,headless=True,seed=2)
+    boidcollection.add(10)
+    with TrajectoryRecorder(path,dtype=dtype) as recorder:
+        boidcollection.recorder = recorder
+        boidcollection.tick()
+    reader = TrajectoryReader(path)
+    assert reader.dtype == np.dtype(dtype)
+    assert np.abs(reader[0][0] - _positions(boidcollection)).max() < tolerance
+
+
+def test_population_change_raises(tmp_path):
+    boidcollection = BoidCollection(headless=True,recorder=TrajectoryRecorder(str(tmp_path / 'flock.traj')))
+    boidcollection.add(3)
+    boidcollection.tick()
+    boidcollection.remove(0)
+    boidcollection.add()
+    with pytest.raises(ValueError):
+        boidcollection.tick()
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'flock.traj')
+    with open(path,'wb') as f:
+        f.write(b'not a trajectory file')
+    with pytest.raises(ValueError):
+        TrajectoryReader(path)
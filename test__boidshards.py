@@ -0,0 +1,117 @@
+import multiprocessing
+import random
+import pytest
+import numpy as np
+from _boidbackends import KERNELS, get_backend, register_backend, _factories, _backends
+from _boidcollection import BoidCollection
+from _boidlogic import Priority
+from _boidshards import Tiling
+
+
+@pytest.fixture
+def tiling():
+    return Tiling((0,640,0,480),(2,3))
+
+
+def test_tile_of(tiling):
+    positions = np.array([[0.,0],[639,479],[320,160],[640,480],[-1,-1]])
+    assert tiling.tile_of(positions).tolist() == [0,5,4,0,5]
+
+
+def test_near_tile_wraps(tiling):
+    positions = np.array([[635.,10],[330,10],[200,10],[10,475],[10,300]])
+    assert tiling.near_tile(positions,0,10).tolist() == [True,False,True,True,False]
+
+
+def test_near_edge(tiling):
+    positions = np.array([[5.,80],[160,80],[160,155],[315,80]])
+    assert tiling.near_edge(positions,0,10).tolist() == [True,False,True,True]
+
+
+def _flock(shards,kernels=None,neighbour_range=None,**kwargs):
+    random.seed(3)
+    boidcollection = BoidCollection(array_backed=True,shards=shards,bounds=(0,640,0,480),kernels=kernels,
+                                    neighbour_range=neighbour_range)
+    boidcollection.add(300,**kwargs)
+    return boidcollection
+
+
+@pytest.mark.parametrize('shards,neighbour_range',(((2,2),None),((3,1),None),((2,2),90)))
+def test_sharded_tick_matches_single_process(shards,neighbour_range):
+    single = _flock(None,neighbour_range=neighbour_range)
+    sharded = _flock(shards,neighbour_range=neighbour_range)
+    try:
+        for _ in range(30):
+            single.tick()
+            sharded.tick()
+        sharded.sync()
+        assert sharded.arrays.positions.tolist() == single.arrays.positions.tolist()
+        assert sharded.arrays.orientations.tolist() == single.arrays.orientations.tolist()
+    finally:
+        sharded.close()
+
+
+def test_sharded_tick_keeps_each_boids_logic():
+    flocks = [_flock(shards,logic=Priority(7)) for shards in (None,(2,2))]
+    single, sharded = flocks
+    for boid in single.views[::3] + sharded.views[::3]:
+        boid.logic = Priority(0.5)
+    try:
+        for _ in range(20):
+            single.tick()
+            sharded.tick()
+        sharded.sync()
+        assert sharded.arrays.positions.tolist() == single.arrays.positions.tolist()
+        assert sharded.arrays.orientations.tolist() == single.arrays.orientations.tolist()
+    finally:
+        sharded.close()
+
+
+@pytest.fixture
+def half_pixels():
+    '''
+    Registers NumPy kernels that also round positions to half pixels as 'half_pixels', for one test
+    '''
+    if multiprocessing.get_start_method() != 'fork':
+        pytest.skip('workers only see backends registered by the test when forked')
+
+    def kernels():
+        numpy = get_backend('numpy')
+
+        def adjust_positions_for_boundaries(positions,bounds,tolerance):
+            numpy.adjust_positions_for_boundaries(positions,bounds,tolerance)
+            positions[:] = np.round(positions * 2) / 2
+
+        return dict({kernel:getattr(numpy,kernel) for kernel in KERNELS},
+                    adjust_positions_for_boundaries=adjust_positions_for_boundaries)
+
+    register_backend('half_pixels',kernels)
+    yield 'half_pixels'
+    _factories.pop('half_pixels',None)
+    _backends.pop('half_pixels',None)
+
+
+def test_sharded_tick_uses_the_collections_kernels(half_pixels):
+    single, sharded = [_flock(shards,half_pixels) for shards in (None,(2,2))]
+    try:
+        for _ in range(10):
+            single.tick()
+            sharded.tick()
+        sharded.sync()
+        assert (sharded.arrays.positions * 2 % 1 == 0).all()
+        assert sharded.arrays.positions.tolist() == single.arrays.positions.tolist()
+    finally:
+        sharded.close()
+
+
+def test_add_restarts_shards():
+    sharded = _flock((2,2))
+    try:
+        sharded.tick()
+        sharded.add(10)
+        assert not sharded.sharded_flock.running
+        sharded.tick()
+        sharded.sync()
+        assert len(sharded.views) == len(sharded.arrays) == 310
+    finally:
+        sharded.close()
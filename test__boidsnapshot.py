@@ -0,0 +1,44 @@
+import json
+import random
+import numpy as np
+import pytest
+from _boidsnapshot import (RECORD_DTYPE, write_snapshot, read_snapshot, encode_random_state,
+                           decode_random_state)
+
+
+@pytest.mark.parametrize('mmap',(False,True))
+def test_write_and_read(tmp_path,mmap):
+    path = str(tmp_path / 'test.boids')
+    records = np.zeros(5,RECORD_DTYPE)
+    records['handle'] = range(5)
+    records['position'] = np.arange(10).reshape(5,2) / 3
+    records['colour'] = 255
+    write_snapshot(path,{'extra':[1,2]},records)
+    with open(path,'rb') as f:
+        written = f.read()
+    header, loaded = read_snapshot(path,mmap)
+    assert header['extra'] == [1,2] and header['count'] == 5
+    for name in RECORD_DTYPE.names:
+        assert loaded[name].tobytes() == np.ascontiguousarray(records[name]).tobytes()
+    # mapped columns are copy-on-write
+    loaded['position'][:] = -1
+    with open(path,'rb') as f:
+        assert f.read() == written
+    assert len(written) % 16 == 0
+
+
+def test_read_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'test.boids')
+    with open(path,'wb') as f:
+        f.write(b'not a snapshot')
+    with pytest.raises(ValueError):
+        read_snapshot(path)
+
+
+def test_random_state_round_trip():
+    generator = random.Random(4)
+    state = json.loads(json.dumps(encode_random_state(generator.getstate())))
+    expected = [generator.random() for _ in range(3)]
+    generator.setstate(decode_random_state(state))
+    assert [generator.random() for _ in range(3)] == expected
+
@@ -0,0 +1,145 @@
+import asyncio
+import numpy as np
+import pytest
+from _boidcollection import BoidCollection
+from _boidstream import BoidServer, BoidStreamClient, FrameDecoder, encode_keyframe, encode_delta, quantise, \
+    apply_state
+from _boidthread import capture
+
+BOUNDS = (0,640,0,480)
+TOLERANCE = (640 / 65536,480 / 65536,360 / 65536)
+
+
+def _flock(number=30,**kwargs):
+    boidcollection = BoidCollection(array_backed=True,headless=True,seed=4,**kwargs)
+    boidcollection.add(number)
+    return boidcollection
+
+
+def _assert_close(state,boidcollection):
+    expected = capture(boidcollection,0)
+    error = np.abs(state['positions'] - expected['positions'])
+    error = np.minimum(error,np.array((640,480)) - error)
+    assert (error <= np.array(TOLERANCE[:2])).all()
+    turn = np.abs((state['orientations'] - expected['orientations'] + 180) % 360 - 180)
+    assert (turn <= TOLERANCE[2]).all()
+
+
+def test_keyframes_and_deltas():
+    boidcollection = _flock()
+    boidcollection.views[0].position[:] = (639.999,0)
+    decoder = FrameDecoder()
+    message, key_quantised = encode_keyframe(capture(boidcollection,0),BOUNDS,3,10)
+    state = decoder.decode(message)
+    assert state['keyframe'] and state['tick'] == 10 and state['bounds'] == BOUNDS
+    assert state['colours'].tolist() == boidcollection.arrays.colours.tolist()
+    _assert_close(state,boidcollection)
+    for tick in range(11,20):
+        boidcollection.tick()
+        delta = encode_delta(quantise(capture(boidcollection,0),BOUNDS),key_quantised,3,tick)
+        assert len(delta) < len(message)
+        state = decoder.decode(delta)
+        assert not state['keyframe'] and state['tick'] == tick
+        _assert_close(state,boidcollection)
+    assert decoder.decode(encode_delta(key_quantised,key_quantised,4,20)) is None
+
+
+def test_apply_state_draws_through_a_collection():
+    boidcollection = _flock()
+    decoder = FrameDecoder()
+    viewer = BoidCollection(array_backed=True,headless=True)
+    message, key_quantised = encode_keyframe(capture(boidcollection,0),BOUNDS,0,0)
+    apply_state(decoder.decode(message),viewer)
+    assert len(viewer.views) == 30
+    boidcollection.tick()
+    apply_state(decoder.decode(encode_delta(quantise(capture(boidcollection,0),BOUNDS),key_quantised,0,1)),viewer)
+    assert np.allclose(viewer.get_vertices(),boidcollection.get_vertices(),atol=0.1)
+    assert viewer.get_colours().tolist() == boidcollection.get_colours().tolist()
+
+
+def test_keyframes_of_scalar_flocks():
+    boidcollection = BoidCollection(headless=True,seed=4)
+    boidcollection.add(30)
+    state = FrameDecoder().decode(encode_keyframe(capture(boidcollection,0),BOUNDS,0,0)[0])
+    boids = list(boidcollection.handles.values())
+    assert state['colours'].tolist() == [list(boid.colour) for boid in boids]
+    assert state['lengths'].tolist() == [boid.length for boid in boids]
+    _assert_close(state,boidcollection)
+
+
+def test_server_quantises_to_the_boids_bounds():
+    bounds = (0,200,0,150)
+    boidcollection = BoidCollection(headless=True,seed=4)
+    boidcollection.spawn(30,bounds=bounds)
+    server = BoidServer(boidcollection)
+    server.broadcast()
+    state = FrameDecoder().decode(server.key_message)
+    assert state['bounds'] == bounds
+    error = np.abs(state['positions'] - capture(boidcollection,0)['positions'])
+    # boids on the upper bounds come back on the lower ones
+    error = np.minimum(error,np.array((200,150)) - error)
+    assert (error <= np.array((200,150)) / 65536).all()
+
+
+async def _stream(connect,server,ticks,rate=0):
+    client = await connect(rate)
+    while len(server.clients) < 1:
+        await asyncio.sleep(0.001)
+    running = asyncio.ensure_future(server.run(ticks))
+    states = []
+    async for state in client:
+        states.append(state)
+        if state['tick'] == ticks:
+            break
+    await running
+    await client.close()
+    await server.close()
+    return states
+
+
+@pytest.mark.parametrize('transport',('tcp','unix'))
+def test_server_streams_to_clients(tmp_path,transport):
+    boidcollection = _flock()
+    server = BoidServer(boidcollection,rate=500,keyframe_interval=8)
+
+    async def main():
+        if transport == 'tcp':
+            listening = await server.start_tcp()
+            port = listening.sockets[0].getsockname()[1]
+            connect = lambda rate: BoidStreamClient.connect_tcp(port=port,rate=rate)
+        else:
+            path = str(tmp_path / 'boids.sock')
+            await server.start_unix(path)
+            connect = lambda rate: BoidStreamClient.connect_unix(path,rate)
+        return await _stream(connect,server,20)
+
+    states = asyncio.run(main())
+    assert [state['tick'] for state in states] == list(range(1,21))
+    assert [state['tick'] for state in states if state['keyframe']] == [1,9,17]
+    _assert_close(states[-1],boidcollection)
+
+
+@pytest.mark.parametrize('rate,max_buffer',((20,None),(0,-1)))
+def test_rate_limits_and_dropped_frames(rate,max_buffer):
+    boidcollection = _flock()
+    server = BoidServer(boidcollection,rate=500)
+
+    async def main():
+        listening = await server.start_tcp()
+        client = await BoidStreamClient.connect_tcp(port=listening.sockets[0].getsockname()[1],rate=rate)
+        while len(server.clients) < 1:
+            await asyncio.sleep(0.001)
+        if max_buffer is not None:
+            server.max_buffer = max_buffer
+        record, = server.clients
+        await server.run(40)
+        await client.close()
+        await server.close()
+        return record
+
+    record = asyncio.run(main())
+    if max_buffer is None:
+        # 40 ticks at 500 per second take 0.08s, long enough for two or three frames at 20 per second
+        assert 1 <= record.sent < 20 and record.dropped == 0
+    else:
+        assert record.sent == 0 and record.dropped == 40
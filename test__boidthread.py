@@ -0,0 +1,79 @@
+import time
+import numpy as np
+import pytest
+from _boidcollection import BoidCollection
+from _boidthread import SimulationThread, capture, interpolate
+
+
+def _state(boidcollection):
+    return [(tuple(boid.position[:]),boid.orientation) for boid in boidcollection.handles.values()]
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_background_ticks_match_foreground(array_backed):
+    background = BoidCollection(array_backed=array_backed,headless=True,seed=5)
+    background.add(30)
+    foreground = BoidCollection(array_backed=array_backed,headless=True,seed=5)
+    foreground.add(30)
+    simulation = background.run_in_background(rate=500)
+    while simulation.steps < 5:
+        time.sleep(0.01)
+    background.stop_background()
+    assert not simulation.running
+    for tick in range(simulation.steps):
+        foreground.tick()
+    assert _state(background) == _state(foreground)
+    assert simulation.frames[1]['positions'].tolist() == [list(position) for position, _ in _state(foreground)]
+
+
+def test_submit_runs_between_ticks():
+    boidcollection = BoidCollection(headless=True,seed=5)
+    boidcollection.add(3)
+    simulation = boidcollection.run_in_background(rate=500)
+    future = simulation.submit(boidcollection.add,2)
+    assert len(future.result(timeout=5)) == 2
+    generation = simulation.generation
+    while simulation.steps < 3 or len(simulation.frames[1]['positions']) != 5:
+        time.sleep(0.01)
+    boidcollection.close()
+    assert generation == 1 and len(boidcollection.boids) == 5
+
+
+def test_errors_are_raised_on_stop():
+    boidcollection = BoidCollection(headless=True)
+    boidcollection.add(3)
+    simulation = boidcollection.run_in_background(rate=500)
+    simulation.submit(boidcollection.remove,99)
+    simulation.submit(setattr,boidcollection,'tick',None)
+    while simulation.running:
+        time.sleep(0.01)
+    with pytest.raises(TypeError):
+        boidcollection.stop_background()
+
+
+def test_interpolate():
+    boidcollection = BoidCollection(array_backed=True,headless=True,bounds=(0,100,0,100))
+    boidcollection.add(position=(50,50),orientation=350,speed=2)
+    boidcollection.add(position=(99,50),orientation=0,speed=2)
+    previous = capture(boidcollection,0)
+    boidcollection.views[0].position[:] = (52,50)
+    boidcollection.views[0].orientation = 10
+    boidcollection.views[1].position[:] = (1,50)
+    latest = capture(boidcollection,1)
+    positions, orientations = interpolate(previous,latest,0.25)
+    assert positions.tolist() == [[50.5,50],[1,50]]
+    assert orientations.tolist() == [355,0]
+    assert interpolate(None,latest,0.25)[0] is latest['positions']
+
+
+def test_state_lags_one_step():
+    boidcollection = BoidCollection(array_backed=True,headless=True)
+    boidcollection.add(position=(10,10),speed=2)
+    simulation = SimulationThread(boidcollection,rate=10)
+    previous = simulation.frames[1]
+    boidcollection.views[0].position[:] = (12,10)
+    simulation.frames = (previous,capture(boidcollection,previous['time'] + 0.1))
+    for delay, x in ((-1,10),(0,10),(0.05,11),(0.1,12),(1,12)):
+        latest, positions, orientations = simulation.state(previous['time'] + 0.1 + delay)
+        assert np.allclose(positions,[[x,10]])
+    assert simulation.vertices(previous['time']).shape == (1,6)
@@ -0,0 +1,39 @@
+import pytest
+from _spatialhash import SpatialHash
+
+
+@pytest.mark.parametrize('bounds,cell_size,expected_columns,expected_rows',(
+        ((0,640,0,480),60,10,8),
+        ((0,640,0,480),1000,1,1),
+        ((10,110,0,100),30,3,3),
+        ((0,640,0,480),0,1,1)
+))
+def test_grid_size(bounds,cell_size,expected_columns,expected_rows):
+    index = SpatialHash(bounds,cell_size)
+    assert index.columns == expected_columns
+    assert index.rows == expected_rows
+    assert index.cell_width >= min(cell_size,bounds[1]-bounds[0])
+
+
+@pytest.mark.parametrize('position,expected_cell',(
+        ((0,0),(0,0)),
+        ((639,479),(9,7)),
+        ((640,480),(0,0)),
+        ((-1,-1),(9,7)),
+        ((64,48),(1,0))
+))
+def test_cell(position,expected_cell):
+    index = SpatialHash((0,640,0,480),60)
+    assert index.cell(position) == expected_cell
+
+
+def test_nearby_wraps():
+    index = SpatialHash((0,640,0,480),60)
+    index.insert('corner',(639,479))
+    index.insert('far',(320,240))
+    assert set(index.nearby((1,1))) == {'corner'}
+
+
+def test_adjacent_cells_small_grid():
+    index = SpatialHash((0,100,0,100),60)
+    assert index.adjacent_cells((10,10)) == {(0,0)}
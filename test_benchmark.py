@@ -0,0 +1,61 @@
+import json
+import pytest
+import benchmark
+
+
+@pytest.fixture(scope='module')
+def results():
+    return benchmark.run(sizes=(40,),repeat=1)
+
+
+def test_run(results):
+    assert {(r['benchmark'],r['mode']) for r in results['results']} == set(benchmark.SIZE_LIMITS)
+    for result in results['results']:
+        assert result['n'] == 40
+        assert 0 <= result['min'] <= result['median']
+
+
+def test_make_collection_is_seeded():
+    first = benchmark.make_collection(40,'array')
+    second = benchmark.make_collection(40,'array')
+    assert first.arrays.positions.tolist() == second.arrays.positions.tolist()
+
+
+def _scaled(results,factor):
+    return {'meta':results['meta'],
+            'results':[dict(r,median=r['median'] * factor) for r in results['results']]}
+
+
+def test_compare(results):
+    assert benchmark.compare(results,results) == []
+    assert len(benchmark.compare(results,_scaled(results,0.5),0.2)) == len(results['results'])
+    assert benchmark.compare(results,_scaled(results,0.9),0.2) == []
+
+
+def test_main_fails_on_regression(results,tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(_scaled(results,1E-6)))
+    output = tmp_path / 'results.json'
+    args = ['--sizes','40','--repeat','1','--benchmarks','vertices','--output',str(output)]
+    assert benchmark.main(args + ['--baseline',str(baseline)]) == 1
+    assert json.loads(output.read_text())['results'][0]['benchmark'] == 'vertices'
+    baseline.write_text(json.dumps(_scaled(results,1E6)))
+    assert benchmark.main(args + ['--baseline',str(baseline)]) == 0
+
+
+def test_run_approximation():
+    results = benchmark.run_approximation(200,(0,0.5),vision_range=60,avoidance_range=20)
+    assert [result['theta'] for result in results] == [None,0,0.5]
+    assert results[0]['centering_error_p95'] == results[0]['matching_error_p95'] == results[0]['turn_error_p95'] == 0
+    # theta=0 reproduces the exact rules, only avoidance looks less far
+    assert results[1]['centering_error_p95'] < 1e-6 and results[1]['matching_error_p95'] < 1e-6
+    assert results[1]['neighbours'] < results[0]['neighbours']
+    for result in results:
+        assert result['tick'] == pytest.approx(result['neighbours'] + result['avoidance'] + result['rules'])
+        assert result['rules'] > 0
+
+
+def test_run_kernels():
+    results = benchmark.run_kernels(100,('numpy','python'),repeat=1)
+    assert [result['backend'] for result in results] == ['numpy','python']
+    assert all(0 < result['min'] <= result['median'] for result in results)
@@ -0,0 +1,57 @@
+import math
+import numpy as np
+import pytest
+import sweep
+from _boidcollection import BoidCollection
+
+
+def test_expand_grid():
+    configurations = sweep.expand_grid({'speed':(1,2),'vision_range':(40,)},seeds=(1,2))
+    assert configurations == [{'speed':1,'vision_range':40,'seed':1},{'speed':1,'vision_range':40,'seed':2},
+                              {'speed':2,'vision_range':40,'seed':1},{'speed':2,'vision_range':40,'seed':2}]
+    with pytest.raises(ValueError):
+        sweep.expand_grid({'colour':(1,)})
+
+
+def test_make_flock():
+    collection = sweep.make_flock({'n':5,'seed':1,'array_backed':True,'vision_angle':90,'allowed_change':7})
+    assert collection.array_backed and len(collection.views) == 5
+    assert all(boid.vision_angle == 90 and boid.logic.allowed_change == 7 for boid in collection.views)
+
+
+@pytest.mark.parametrize('array_backed',(False,True))
+def test_flock_metrics(array_backed):
+    collection = BoidCollection(array_backed=array_backed,headless=True)
+    collection.add(position=(100,100),orientation=0)
+    collection.add(position=(110,100),orientation=0)
+    collection.add(position=(300,300),orientation=0)
+    metrics = sweep.flock_metrics(collection)
+    assert metrics['polarisation'] == pytest.approx(1)
+    assert metrics['nearest_neighbour'] == pytest.approx(10)
+    assert metrics['collision_rate'] == pytest.approx(1 / 3)
+    collection.get(2).orientation = 180
+    assert sweep.flock_metrics(collection)['polarisation'] == pytest.approx(1 / 3)
+    assert math.isnan(sweep.flock_metrics(BoidCollection(headless=True))['nearest_neighbour'])
+
+
+def test_run_configuration_agrees_between_modes():
+    scalar = sweep.run_configuration({'n':30,'seed':3},ticks=20,sample_every=5)
+    array = sweep.run_configuration({'n':30,'seed':3,'array_backed':True},ticks=20,sample_every=5)
+    for metric in sweep.METRICS:
+        assert scalar[metric + '_mean'] == pytest.approx(array[metric + '_mean'])
+    assert scalar['seconds_per_tick'] > 0
+
+
+def test_sweep_in_worker_processes(tmp_path):
+    grid = {'vision_range':(40,80),'allowed_change':(1,4)}
+    columns = sweep.sweep(grid,seeds=(1,2),ticks=10,sample_every=5,workers=2)
+    assert len(columns['seed']) == 8
+    assert columns['vision_range'].tolist() == [40,40,80,80] * 2
+    local = sweep.sweep(grid,seeds=(1,2),ticks=10,sample_every=5,workers=0)
+    for metric in sweep.METRICS:
+        assert np.allclose(columns[metric + '_mean'],local[metric + '_mean'],equal_nan=True)
+    for name in ('results.npz','results.json'):
+        sweep.write_results(tmp_path / name,columns)
+        read = sweep.read_results(tmp_path / name)
+        assert list(read) == list(columns)
+        assert np.allclose(read['polarisation_final'],columns['polarisation_final'])